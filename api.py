@@ -0,0 +1,334 @@
+"""Versioned JSON API for the mobile and kiosk clients, under /api/v1.
+
+    GET /api/v1/<resource>                  one page, newest first
+    GET /api/v1/<resource>?ids=3,9,12       batch lookup, in the order asked
+    GET /api/v1/<resource>/<id>
+
+Resources: ``users``, ``nutrition-logs``, ``progress`` and ``workout-plans``
+(with their ``exercises``). Query options:
+
+* ``fields=id,date,calories``: only these fields; only their columns are read
+* ``limit`` (default 50, at most 500) and ``cursor``, the ``next_cursor`` of
+  the previous page
+* ``from`` / ``to`` (YYYY-MM-DD): date range, on the dated resources
+* ``user_id``: another member's data, admins only
+
+Members see their own data and admins anyone's. Pages use keyset cursors
+over (date, id) or id, so paging does not skip or repeat rows when new rows
+arrive between pages. Nutrition and progress include archived entries
+(archive.py), merged in by date.
+
+Rows are selected as plain tuples and zipped with the field names, never
+loaded as ORM objects. Bodies are encoded with orjson, and gzip-compressed
+when the client accepts it and they are large enough to benefit.
+"""
+import base64
+import binascii
+import gzip
+import heapq
+from collections import namedtuple
+from datetime import date
+
+import orjson
+from flask import Blueprint, current_app, request
+from flask_login import current_user
+from sqlalchemy import select, tuple_
+
+from db import db
+import archive
+from models import Exercise, NutritionLog, Progress, User, WorkoutPlan, workout_exercises
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_IDS = 100
+COMPRESS_MIN_BYTES = 1024  # Smaller bodies gain less than the gzip header and CPU cost
+COMPRESS_LEVEL = 5
+MAX_INT = 2 ** 63 - 1  # Ids are 64-bit integers in the database; larger ones cannot be bound
+
+bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+# ``keys`` order pages, newest first; ``dated`` resources filter on ``date``
+Resource = namedtuple('Resource', 'name model owner columns keys dated archive_kind')
+
+
+def _columns(model, names):
+    return {name: getattr(model, name) for name in names}
+
+
+RESOURCES = {resource.name: resource for resource in (
+    Resource('users', User, User.id,
+             _columns(User, ['id', 'email', 'name', 'age', 'gender', 'height', 'weight', 'role', 'goals',
+                             'created_at']),
+             ('id',), False, None),
+    Resource('nutrition-logs', NutritionLog, NutritionLog.user_id,
+             _columns(NutritionLog, ['id', 'user_id', 'date', 'meal', 'calories', 'protein', 'carbs', 'fats']),
+             ('date', 'id'), True, archive.NUTRITION),
+    Resource('progress', Progress, Progress.user_id,
+             _columns(Progress, ['id', 'user_id', 'date', 'weight', 'body_fat_percentage', 'notes']),
+             ('date', 'id'), True, archive.PROGRESS),
+    # Plans can be undated, so they page by id; recurring ones are listed once, as stored
+    Resource('workout-plans', WorkoutPlan, WorkoutPlan.created_by,
+             _columns(WorkoutPlan, ['id', 'created_by', 'title', 'level', 'description', 'duration', 'date',
+                                    'recurrence', 'series_id', 'series_date', 'ends_on', 'progress', 'calories',
+                                    'created_at']),
+             ('id',), True, None),
+)}
+EXERCISE_FIELDS = ('id', 'name', 'muscle_group', 'sets', 'reps', 'notes', 'description', 'video_url')
+EMBEDDED = {'workout-plans': ('exercises',)}
+
+
+# Request parsing
+
+def _fields(resource):
+    """(column fields, embedded fields) asked for, in the order asked."""
+    allowed = list(resource.columns) + list(EMBEDDED.get(resource.name, ()))
+    asked = request.args.get('fields')
+    if not asked:
+        names = allowed
+    else:
+        names = list(dict.fromkeys(name.strip() for name in asked.split(',') if name.strip()))
+        unknown = [name for name in names if name not in allowed]
+        if unknown or not names:
+            raise ApiError(f'Unknown fields {", ".join(unknown) or "(none)"}; choose from {", ".join(allowed)}')
+    return ([name for name in names if name in resource.columns],
+            [name for name in names if name not in resource.columns])
+
+
+def _check_int(value, name):
+    if not -MAX_INT - 1 <= value <= MAX_INT:
+        raise ApiError(f'{name} is out of range')
+    return value
+
+
+def _int_list(value, name):
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ApiError(f'{name} must be a comma-separated list of integers')
+    if not ids or len(ids) > MAX_IDS:
+        raise ApiError(f'{name} takes 1 to {MAX_IDS} ids')
+    for i in ids:
+        _check_int(i, name)
+    return list(dict.fromkeys(ids))
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} must be a date as YYYY-MM-DD')
+
+
+def _limit():
+    limit = request.args.get('limit', PAGE_SIZE, type=int)
+    return min(max(limit, 1), MAX_PAGE_SIZE)
+
+
+def _encode_cursor(resource, key):
+    payload = [resource.name, *(value.isoformat() if isinstance(value, date) else value for value in key)]
+    return base64.urlsafe_b64encode(orjson.dumps(payload)).decode().rstrip('=')
+
+
+def _decode_cursor(resource, cursor):
+    try:
+        name, *key = orjson.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if name != resource.name or len(key) != len(resource.keys):
+            raise ValueError
+        key = [date.fromisoformat(value) if column == 'date' else int(value)
+               for column, value in zip(resource.keys, key)]
+        if any(isinstance(value, int) and not -MAX_INT - 1 <= value <= MAX_INT for value in key):
+            raise ValueError
+    except (ValueError, TypeError, OverflowError, binascii.Error, orjson.JSONDecodeError):
+        raise ApiError('Invalid cursor')
+    return tuple(key)
+
+
+def _member_id(resource):
+    """Whose data this request reads; None when an admin reads every member's accounts."""
+    user_id = request.args.get('user_id') or None
+    if user_id is not None:
+        try:
+            user_id = _check_int(int(user_id), 'user_id')
+        except ValueError:
+            raise ApiError('user_id must be an integer')
+    if current_user.role != 'admin':
+        if user_id not in (None, current_user.id):
+            raise ApiError('Members can only read their own data', 403)
+        return current_user.id
+    if user_id is None:
+        return None if resource.name == 'users' else current_user.id
+    return user_id
+
+
+# Reading
+
+def _query(resource, names, member_id):
+    """SELECT of ``names`` for the member; rows come back as tuples in that order."""
+    query = select(*(resource.columns[name] for name in names))
+    if member_id is not None:
+        query = query.where(resource.owner == member_id)
+    if resource.dated:
+        start, end = _date_arg('from'), _date_arg('to')
+        if start is not None:
+            query = query.where(resource.model.date >= start)
+        if end is not None:
+            query = query.where(resource.model.date <= end)
+        if 'date' in resource.keys:
+            # Rows without a date have no place in a date-ordered page; the app always sets one
+            query = query.where(resource.model.date.isnot(None))
+    return query
+
+
+def _archived_rows(resource, names, member_id, newer_than=None, before=None, ids=None):
+    """Archived entries as tuples in ``names`` order, newest first."""
+    if resource.archive_kind is None or member_id is None:
+        return []
+    start, end = _date_arg('from'), _date_arg('to')
+    if newer_than is not None:
+        start = max(start, newer_than[0]) if start else newer_than[0]
+    if before is not None:
+        end = min(end, before[0]) if end else before[0]
+    rows = []
+    for entry in archive.archived_entries(resource.archive_kind, member_id, start, end):
+        if before is not None and (entry.date, entry.id) >= before:
+            continue
+        if ids is not None and entry.id not in ids:
+            continue
+        rows.append(tuple(member_id if name == 'user_id' else getattr(entry, name) for name in names))
+    return rows
+
+
+def _page(resource, names, member_id, limit):
+    keys = [names.index(key) for key in resource.keys]
+    key_columns = [resource.columns[key] for key in resource.keys]
+    query = _query(resource, names, member_id)
+    cursor = request.args.get('cursor')
+    before = _decode_cursor(resource, cursor) if cursor else None
+    if before is not None:
+        query = query.where(tuple_(*key_columns) < tuple_(*before))
+    rows = db.session.execute(query.order_by(*(column.desc() for column in key_columns)).limit(limit + 1)).all()
+
+    if resource.archive_kind is not None:
+        # Archived entries older than a full page of live rows cannot make this page; their files stay shut
+        newer_than = tuple(rows[-1][i] for i in keys) if len(rows) > limit else None
+        archived = _archived_rows(resource, names, member_id, newer_than, before)
+        if archived:
+            rows = list(heapq.merge(rows, archived, key=lambda row: tuple(row[i] for i in keys), reverse=True))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(resource, tuple(rows[-1][i] for i in keys))
+    return rows, next_cursor
+
+
+def _by_ids(resource, names, member_id, ids):
+    id_index = names.index('id')
+    query = _query(resource, names, member_id).where(resource.columns['id'].in_(ids))
+    found = {row[id_index]: row for row in db.session.execute(query)}
+    missing = [i for i in ids if i not in found]
+    if missing and resource.archive_kind is not None:
+        found.update((row[id_index], row) for row in _archived_rows(resource, names, member_id, ids=set(missing)))
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+
+def _exercises(plan_ids):
+    """{plan id: [exercise dicts]} for every plan in one query."""
+    by_plan = {plan_id: [] for plan_id in plan_ids}
+    if not plan_ids:
+        return by_plan
+    rows = db.session.execute(
+        select(workout_exercises.c.workout_id, *(getattr(Exercise, name) for name in EXERCISE_FIELDS))
+        .join(Exercise, Exercise.id == workout_exercises.c.exercise_id)
+        .where(workout_exercises.c.workout_id.in_(plan_ids))
+        .order_by(workout_exercises.c.workout_id, Exercise.id)
+    )
+    for plan_id, *values in rows:
+        by_plan[plan_id].append(dict(zip(EXERCISE_FIELDS, values)))
+    return by_plan
+
+
+def _serialize(fields, embedded, names, rows):
+    """Dicts of the asked-for ``fields`` (the first values of each row), plus embedded lists."""
+    count = len(fields)
+    items = [dict(zip(fields, row[:count])) for row in rows]
+    if 'exercises' in embedded:
+        # 'id' is a page key, so it is always selected
+        id_index = names.index('id')
+        exercises = _exercises([row[id_index] for row in rows])
+        for item, row in zip(items, rows):
+            item['exercises'] = exercises[row[id_index]]
+    return items
+
+
+def _selected(resource, fields):
+    # The page keys ride along after the asked-for fields so cursors and embeds work without them
+    return fields + [key for key in resource.keys if key not in fields]
+
+
+# Responses
+
+def respond(payload, status=200):
+    body = orjson.dumps(payload)
+    response = current_app.response_class(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if len(body) >= COMPRESS_MIN_BYTES and request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=COMPRESS_LEVEL, mtime=0))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@bp.errorhandler(ApiError)
+def api_error(error):
+    return respond({'error': error.message}, error.status)
+
+
+@bp.before_request
+def require_login():
+    # A JSON 401 rather than login_required's redirect to the HTML login page
+    if not current_user.is_authenticated:
+        return respond({'error': 'Authentication required'}, 401)
+
+
+def list_view(resource):
+    resource = RESOURCES[resource]
+    fields, embedded = _fields(resource)
+    names = _selected(resource, fields)
+    member_id = _member_id(resource)
+    ids = request.args.get('ids')
+    if ids:
+        rows, missing = _by_ids(resource, names, member_id, _int_list(ids, 'ids'))
+        return respond({'data': _serialize(fields, embedded, names, rows), 'missing': missing})
+    rows, next_cursor = _page(resource, names, member_id, _limit())
+    return respond({'data': _serialize(fields, embedded, names, rows), 'next_cursor': next_cursor})
+
+
+def detail_view(resource, item_id):
+    resource = RESOURCES[resource]
+    fields, embedded = _fields(resource)
+    names = _selected(resource, fields)
+    rows, _ = _by_ids(resource, names, _member_id(resource), [_check_int(item_id, 'id')])
+    if not rows:
+        raise ApiError('Not found', 404)
+    return respond({'data': _serialize(fields, embedded, names, rows)[0]})
+
+
+for _name in RESOURCES:
+    _endpoint = _name.replace('-', '_')
+    bp.add_url_rule(f'/{_name}', f'{_endpoint}_list', list_view, defaults={'resource': _name})
+    bp.add_url_rule(f'/{_name}/<int:item_id>', f'{_endpoint}_detail', detail_view, defaults={'resource': _name})
+
+
+def init_api(app):
+    app.register_blueprint(bp)
@@ -1,12 +1,13 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, send_file, jsonify, session
+from flask import Blueprint, Flask, current_app, render_template, redirect, url_for, request, flash, send_file, jsonify, session, Response
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_migrate import Migrate
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta  # Correct import for timedelta
 from db import db  # This assumes your db is initialized in db.py
-from models import User, WorkoutPlan, Exercise, NutritionLog, Progress  # Your model definitions
+from models import User, WorkoutPlan, Exercise, NutritionLog, Progress, PoseSession, WeeklyReport  # Your model definitions
 import csv
+import functools
 import io
 from sqlalchemy import func, extract
 import os
@@ -15,27 +16,93 @@ import cv2
 import mediapipe as mp
 import numpy as np
 import json
+from pose_server import make_ws_token
+import pose_store
+import fragment_cache
+import calorie_engine
+import leaderboard
+import recommendations
+import profiling
+import archive
+import schedule
+import ratelimit
+import reports
+import api
+from ratelimit import coalesce
+from seed import seed_data_command
+from bench import bench_command
+from db_maint import db_maint_cli
+from config import Config
 
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fitness_app.db'
-app.config['SECRET_KEY'] = 'your_secret_key'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db.init_app(app)
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 
 # Initialize Flask-Migrate
-migrate = Migrate(app, db)
+migrate = Migrate()
+
+bp = Blueprint('main', __name__)
+bp.add_app_template_filter(schedule.describe_rule, 'describe_rule')
+bp.add_app_template_global(schedule.parse_rule, 'parse_rule')
+
+
+def create_app(config=Config):
+    """Build the app from a config class, import path, or mapping of overrides."""
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not Config:
+        app.config.from_object(config)
+    app.config.setdefault('POSE_SESSION_DIR', os.path.join(app.instance_path, 'pose_sessions'))
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+
+    # Developer commands: flask seed-data, flask bench
+    app.cli.add_command(seed_data_command)
+    app.cli.add_command(bench_command)
+
+    # Backups and SQLite upkeep: flask db-maint
+    app.cli.add_command(db_maint_cli)
+
+    # {% cache %} fragments for dashboard/list widgets, templates compiled up front
+    fragment_cache.init_fragment_cache(app)
+
+    # Background calorie estimates for workout plans, plus flask calories recompute
+    calorie_engine.init_calorie_engine(app)
+
+    # Streak and calories leaderboards, plus flask leaderboard reconcile
+    leaderboard.init_leaderboards(app)
+
+    # Exercise suggestions from memory-mapped similarity snapshots, plus flask recommend
+    recommendations.init_recommendations(app)
+
+    # Opt-in capture of slow and sampled requests, plus flask profile
+    profiling.init_profiling(app)
+
+    # Old nutrition/progress rows moved to compressed files, plus flask archive
+    archive.init_archive(app)
+
+    # Token buckets for /api/ requests per member and endpoint
+    ratelimit.init_rate_limiting(app)
+
+    # Weekly member reports in a content-addressed file store, plus flask reports
+    reports.init_reports(app)
+
+    # Versioned JSON API for mobile and kiosk clients: /api/v1
+    api.init_api(app)
+
+    return app
 
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-@app.route('/', methods=['GET', 'POST'])
+@bp.route('/', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         email = request.form['email']
@@ -43,11 +110,11 @@ def login():
         user = User.query.filter_by(email=email).first()
         if user and check_password_hash(user.password, password):
             login_user(user)
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         flash('Invalid email or password')
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         email = request.form['email']
@@ -55,117 +122,117 @@ def register():
         name = request.form['name']
         if User.query.filter_by(email=email).first():
             flash('Email already registered')
-            return redirect(url_for('register'))
+            return redirect(url_for('main.register'))
         new_user = User(email=email, password=password, name=name)
         db.session.add(new_user)
         db.session.commit()
         flash('Registration successful, please log in')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's nutrition logs for today
+    # Widgets load their data lazily from inside {% cache %} blocks in dashboard.html,
+    # so these queries only run when a fragment is missing or stale
+    user_id = current_user.id
     today = datetime.now().date()
-    today_logs = NutritionLog.query.filter_by(
-        user_id=current_user.id,
-        date=today
-    ).all()
     
-    # Calculate today's totals
-    total_calories = sum(log.calories for log in today_logs)
-    total_protein = sum(log.protein for log in today_logs)
-    total_carbs = sum(log.carbs for log in today_logs)
-    total_fats = sum(log.fats for log in today_logs)
-    
-    # Get today's workout plan
-    today_workout = WorkoutPlan.query.filter(
-        WorkoutPlan.created_by == current_user.id,
-        WorkoutPlan.date == today
-    ).first()
-    
-    if not today_workout:
-        # Create a default workout if none exists
-        today_workout = {
-            "name": "No workout planned",
-            "duration": 0,
-            "calories": 0,
-            "progress": 0,
-            "workout_id": None
-        }
-    else:
-        today_workout = {
+    def load_nutrition_totals():
+        # Get user's nutrition logs for today
+        today_logs = NutritionLog.query.filter_by(
+            user_id=user_id,
+            date=today
+        ).all()
+        
+        # Calculate today's totals
+        return (
+            sum(log.calories for log in today_logs),
+            sum(log.protein for log in today_logs),
+            sum(log.carbs for log in today_logs),
+            sum(log.fats for log in today_logs)
+        )
+    
+    def load_today_workout():
+        # Get today's workout plan, including occurrences of repeating plans; open ones first
+        occurrences = schedule.calendar(user_id, today, today)
+        today_workout = min(occurrences, key=lambda o: o.completed, default=None)
+        
+        if not today_workout:
+            # Create a default workout if none exists
+            return {
+                "name": "No workout planned",
+                "duration": 0,
+                "calories": 0,
+                "progress": 0,
+                "workout_id": None
+            }
+        return {
             "name": today_workout.title,
             "duration": today_workout.duration,
             "calories": today_workout.calories or 0,
             "progress": today_workout.progress,
-            "workout_id": today_workout.id
+            "workout_id": today_workout.plan_id
         }
     
-    # Get recent workouts
-    recent_workouts = WorkoutPlan.query.filter_by(
-        created_by=current_user.id
-    ).order_by(WorkoutPlan.created_at.desc()).limit(5).all()
-    
-    # Get latest progress
-    latest_progress = Progress.query.filter_by(
-        user_id=current_user.id
-    ).order_by(Progress.date.desc()).first()
-    
-    # Calculate weight change
-    weight_change = 0
-    if latest_progress:
-        month_ago = today - timedelta(days=30)
-        old_progress = Progress.query.filter(
-            Progress.user_id == current_user.id,
-            Progress.date <= month_ago
+    def load_recent_workouts():
+        return WorkoutPlan.query.filter_by(
+            created_by=user_id
+        ).order_by(WorkoutPlan.created_at.desc()).limit(5).all()
+    
+    def load_progress():
+        # Get latest progress
+        latest_progress = Progress.query.filter_by(
+            user_id=user_id
         ).order_by(Progress.date.desc()).first()
         
-        if old_progress:
-            weight_change = latest_progress.weight - old_progress.weight
-    
-    # Get weekly stats
-    week_ago = today - timedelta(days=7)
-    calories_burned_week = WorkoutPlan.query.filter(
-        WorkoutPlan.created_by == current_user.id,
-        WorkoutPlan.date >= week_ago,
-        WorkoutPlan.progress == 100
-    ).with_entities(func.sum(WorkoutPlan.calories)).scalar() or 0
-    
-    workouts_completed = WorkoutPlan.query.filter(
-        WorkoutPlan.created_by == current_user.id,
-        WorkoutPlan.date >= week_ago,
-        WorkoutPlan.progress == 100
-    ).count()
-    
-    # Get weekly goals
-    weekly_goals = [
-        {"name": "Workouts", "current": workouts_completed, "target": 5},
-        {"name": "Calories Burned", "current": calories_burned_week, "target": 2000}
-    ]
-    
-    # Calculate streak
-    streak = 0
-    current_date = today
-    while True:
-        workout = WorkoutPlan.query.filter(
-            WorkoutPlan.created_by == current_user.id,
-            WorkoutPlan.date == current_date,
+        # Calculate weight change
+        weight_change = 0
+        if latest_progress:
+            month_ago = today - timedelta(days=30)
+            old_progress = Progress.query.filter(
+                Progress.user_id == user_id,
+                Progress.date <= month_ago
+            ).order_by(Progress.date.desc()).first()
+            
+            if old_progress:
+                weight_change = latest_progress.weight - old_progress.weight
+        return latest_progress, weight_change
+    
+    @functools.cache
+    def load_week_stats():
+        # Shared by the banner stats and the weekly goals widget
+        week_ago = today - timedelta(days=7)
+        calories_burned_week = WorkoutPlan.query.filter(
+            WorkoutPlan.created_by == user_id,
+            WorkoutPlan.date >= week_ago,
             WorkoutPlan.progress == 100
-        ).first()
+        ).with_entities(func.sum(WorkoutPlan.calories)).scalar() or 0
         
-        if not workout:
-            break
-            
-        streak += 1
-        current_date -= timedelta(days=1)
+        workouts_completed = WorkoutPlan.query.filter(
+            WorkoutPlan.created_by == user_id,
+            WorkoutPlan.date >= week_ago,
+            WorkoutPlan.progress == 100
+        ).count()
+        return calories_burned_week, workouts_completed
+    
+    def load_weekly_goals():
+        calories_burned_week, workouts_completed = load_week_stats()
+        return [
+            {"name": "Workouts", "current": workouts_completed, "target": 5},
+            {"name": "Calories Burned", "current": calories_burned_week, "target": 2000}
+        ]
+    
+    def load_streak():
+        # Same rule as the streak leaderboard: one query over the completed days
+        streak, _ = leaderboard.user_streak(user_id, today)
+        return streak
     
     # Daily calorie goal (placeholder)
     daily_calorie_goal = 2400
@@ -173,46 +240,43 @@ def dashboard():
     return render_template(
         'dashboard.html',
         user=current_user,
-        total_calories=total_calories,
-        total_protein=total_protein,
-        total_carbs=total_carbs,
-        total_fats=total_fats,
+        today=today,
         daily_calorie_goal=daily_calorie_goal,
-        recent_workouts=recent_workouts,
-        latest_progress=latest_progress,
-        weight_change=weight_change,
-        calories_burned_week=calories_burned_week,
-        workouts_completed=workouts_completed,
-        weekly_goals=weekly_goals,
-        streak=streak,
-        today_workout=today_workout
+        load_nutrition_totals=load_nutrition_totals,
+        load_today_workout=load_today_workout,
+        load_recent_workouts=load_recent_workouts,
+        load_progress=load_progress,
+        load_week_stats=load_week_stats,
+        load_weekly_goals=load_weekly_goals,
+        load_streak=load_streak
     )
 
-@app.route('/workout_plans')
+@bp.route('/workout_plans')
 @login_required
 def workout_plans():
-    plans = WorkoutPlan.query.filter_by(created_by=current_user.id).all()
+    plans = WorkoutPlan.query.filter_by(created_by=current_user.id, series_id=None).all()
     return render_template('workout_plans.html', plans=plans)
 
-@app.route('/workout_plans/<int:id>')
+@bp.route('/workout_plans/<int:id>')
 @login_required
 def workout_plan(id):
     plan = WorkoutPlan.query.get_or_404(id)
     return render_template('workout_plan.html', plan=plan)
 
-# @app.route('/nutrition_logs')
+# @bp.route('/nutrition_logs')
 # @login_required
 # def nutrition_logs():
 #     logs = NutritionLog.query.filter_by(user_id=current_user.id).all()
 #     return render_template('nutrition_logs.html', logs=logs)
 
-@app.route('/progress_logs')
+@bp.route('/progress_logs')
 @login_required
 def progress_logs():
-    logs = Progress.query.filter_by(user_id=current_user.id).all()
+    # Includes archived entries, see archive.py
+    logs = archive.progress_entries(current_user.id)
     return render_template('progress_logs.html', logs=logs)
 
-@app.route('/nutrition_logs')
+@bp.route('/nutrition_logs')
 @login_required
 def nutrition_logs():
     # Get filter parameters
@@ -221,9 +285,11 @@ def nutrition_logs():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
     per_page = 10  # Number of logs per page
+    user_id = current_user.id
     
     # Base query
-    query = NutritionLog.query.filter_by(user_id=current_user.id)
+    query = NutritionLog.query.filter_by(user_id=user_id)
+    start_date = None
     
     # Apply date filter
     if date_range != 'all':
@@ -239,55 +305,27 @@ def nutrition_logs():
     if search:
         query = query.filter(NutritionLog.meal.ilike(f'%{search}%'))
     
-    # Calculate averages for the summary stats
-    # First, get the unique dates in the filtered set
-    date_subquery = query.with_entities(NutritionLog.date).distinct().subquery()
-    
-    # Calculate daily averages
-    avg_calories = db.session.query(func.avg(
-        db.session.query(func.sum(NutritionLog.calories))
-        .filter(NutritionLog.user_id == current_user.id, NutritionLog.date == date_subquery.c.date)
-        .group_by(NutritionLog.date)
-        .scalar_subquery()
-    )).scalar()
-    
-    avg_protein = db.session.query(func.avg(
-        db.session.query(func.sum(NutritionLog.protein))
-        .filter(NutritionLog.user_id == current_user.id, NutritionLog.date == date_subquery.c.date)
-        .group_by(NutritionLog.date)
-        .scalar_subquery()
-    )).scalar()
-    
-    avg_carbs = db.session.query(func.avg(
-        db.session.query(func.sum(NutritionLog.carbs))
-        .filter(NutritionLog.user_id == current_user.id, NutritionLog.date == date_subquery.c.date)
-        .group_by(NutritionLog.date)
-        .scalar_subquery()
-    )).scalar()
-    
-    avg_fats = db.session.query(func.avg(
-        db.session.query(func.sum(NutritionLog.fats))
-        .filter(NutritionLog.user_id == current_user.id, NutritionLog.date == date_subquery.c.date)
-        .group_by(NutritionLog.date)
-        .scalar_subquery()
-    )).scalar()
-    
-    # Order by date (most recent first) and paginate results
-    pagination = query.order_by(NutritionLog.date.desc(), NutritionLog.id.desc()).paginate(page=page, per_page=per_page)
-    logs = pagination.items
+    # The summary and the table are cached fragments; these only run on a cache miss
+    def load_averages():
+        # Daily averages over the days in the filtered set, archived days included
+        return archive.nutrition_daily_averages(
+            user_id, start_date, meal_type if meal_type != 'all' else None, search
+        )
+    
+    def load_page():
+        # Order by date (most recent first) and paginate results
+        # The table lists recent entries only; archived ones are in the export
+        return query.order_by(NutritionLog.date.desc(), NutritionLog.id.desc()).paginate(page=page, per_page=per_page)
     
     return render_template(
         'nutrition_logs.html',
-        logs=logs,
-        pagination=pagination,
-        avg_calories=avg_calories,
-        avg_protein=avg_protein,
-        avg_carbs=avg_carbs,
-        avg_fats=avg_fats
+        today=datetime.now().date(),
+        load_averages=load_averages,
+        load_page=load_page
     )
 
 
-@app.route('/edit_nutrition_log/<int:id>', methods=['GET', 'POST'])
+@bp.route('/edit_nutrition_log/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_nutrition_log(id):
     log = NutritionLog.query.get_or_404(id)
@@ -295,7 +333,7 @@ def edit_nutrition_log(id):
     # Ensure the log belongs to the current user
     if log.user_id != current_user.id:
         flash('You do not have permission to edit this log', 'danger')
-        return redirect(url_for('nutrition_logs'))
+        return redirect(url_for('main.nutrition_logs'))
     
     if request.method == 'POST':
         log.date = datetime.strptime(request.form['date'], '%Y-%m-%d')
@@ -305,13 +343,14 @@ def edit_nutrition_log(id):
         log.carbs = float(request.form['carbs'])
         log.fats = float(request.form['fats'])
         
+        fragment_cache.invalidate(current_user.id, fragment_cache.NUTRITION)
         db.session.commit()
         flash('Nutrition log updated successfully!', 'success')
-        return redirect(url_for('nutrition_logs'))
+        return redirect(url_for('main.nutrition_logs'))
     
     return render_template('edit_nutrition_log.html', log=log)
 
-@app.route('/delete_nutrition_log/<int:id>', methods=['POST'])
+@bp.route('/delete_nutrition_log/<int:id>', methods=['POST'])
 @login_required
 def delete_nutrition_log(id):
     log = NutritionLog.query.get_or_404(id)
@@ -319,18 +358,19 @@ def delete_nutrition_log(id):
     # Ensure the log belongs to the current user
     if log.user_id != current_user.id:
         flash('You do not have permission to delete this log', 'danger')
-        return redirect(url_for('nutrition_logs'))
+        return redirect(url_for('main.nutrition_logs'))
     
     db.session.delete(log)
+    fragment_cache.invalidate(current_user.id, fragment_cache.NUTRITION)
     db.session.commit()
     flash('Nutrition log deleted successfully!', 'success')
-    return redirect(url_for('nutrition_logs'))
+    return redirect(url_for('main.nutrition_logs'))
 
-@app.route('/export_nutrition_logs')
+@bp.route('/export_nutrition_logs')
 @login_required
 def export_nutrition_logs():
-    # Get all logs for the current user
-    logs = NutritionLog.query.filter_by(user_id=current_user.id).order_by(NutritionLog.date.desc()).all()
+    # Get all logs for the current user, archived ones included
+    logs = archive.nutrition_entries(current_user.id)
     
     export_format = request.args.get('format', 'csv')
     
@@ -362,56 +402,40 @@ def export_nutrition_logs():
         )
     
     elif export_format == 'pdf':
-        # This is a placeholder for PDF generation
-        # You would need to install a library like fpdf or reportlab
-        
-        # For now, just redirect back with a message
-        flash('PDF export is not implemented yet', 'warning')
-        return redirect(url_for('nutrition_logs'))
+        now = datetime.now()
+        return send_file(
+            io.BytesIO(reports.nutrition_log_pdf(current_user.name or current_user.email, logs, now)),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name=f'nutrition_logs_{now.strftime("%Y%m%d")}.pdf'
+        )
     
     else:
-        return redirect(url_for('nutrition_logs'))
+        return redirect(url_for('main.nutrition_logs'))
 
 # API endpoint for chart data
-@app.route('/api/nutrition_chart_data')
+@bp.route('/api/nutrition_chart_data')
 @login_required
+@coalesce
 def nutrition_chart_data():
-    # Get date range from query parameters
-    days = request.args.get('days', 30, type=int)
+    # Get date range from query parameters, at most ten years
+    days = min(max(request.args.get('days', 30, type=int), 1), 3650)
     start_date = datetime.now().date() - timedelta(days=days)
     
+    # Each query covers recent rows and the daily rollups of archived ones
     # Query for daily calorie data
-    daily_calories = db.session.query(
-        NutritionLog.date,
-        func.sum(NutritionLog.calories).label('total_calories')
-    ).filter(
-        NutritionLog.user_id == current_user.id,
-        NutritionLog.date >= start_date
-    ).group_by(NutritionLog.date).order_by(NutritionLog.date).all()
+    daily_calories = archive.nutrition_daily(current_user.id, start_date)
     
     # Query for macro distribution
-    macro_data = db.session.query(
-        func.sum(NutritionLog.protein).label('total_protein'),
-        func.sum(NutritionLog.carbs).label('total_carbs'),
-        func.sum(NutritionLog.fats).label('total_fats')
-    ).filter(
-        NutritionLog.user_id == current_user.id,
-        NutritionLog.date >= start_date
-    ).first()
+    macro_data = archive.nutrition_totals(current_user.id, start_date)
     
     # Query for meal type breakdown
-    meal_breakdown = db.session.query(
-        NutritionLog.meal,
-        func.sum(NutritionLog.calories).label('total_calories')
-    ).filter(
-        NutritionLog.user_id == current_user.id,
-        NutritionLog.date >= start_date
-    ).group_by(NutritionLog.meal).all()
+    meal_breakdown = archive.nutrition_by_meal(current_user.id, start_date)
     
     # Format the data for charts
     calorie_data = [{
         'date': entry.date.strftime('%Y-%m-%d'),
-        'calories': float(entry.total_calories)
+        'calories': float(entry.calories)
     } for entry in daily_calories]
     
     macro_distribution = {
@@ -432,7 +456,7 @@ def nutrition_chart_data():
     })
 
 
-@app.route('/add_nutrition_log', methods=['GET', 'POST'])
+@bp.route('/add_nutrition_log', methods=['GET', 'POST'])
 @login_required
 def add_nutrition_log():
     if request.method == 'POST':
@@ -458,17 +482,18 @@ def add_nutrition_log():
             
             # Save to database
             db.session.add(new_log)
+            fragment_cache.invalidate(current_user.id, fragment_cache.NUTRITION)
             db.session.commit()
             flash('Nutrition log added successfully!', 'success')
-            return redirect(url_for('nutrition_logs'))
+            return redirect(url_for('main.nutrition_logs'))
             
         except ValueError as e:
             flash(f'Error: Invalid input format. Please check your values. {str(e)}', 'danger')
-            return redirect(url_for('add_nutrition_log'))
+            return redirect(url_for('main.add_nutrition_log'))
         except Exception as e:
             flash(f'Error: An unexpected error occurred. {str(e)}', 'danger')
             db.session.rollback()
-            return redirect(url_for('add_nutrition_log'))
+            return redirect(url_for('main.add_nutrition_log'))
     
     # If GET request, display the form
     # Get today's nutrition logs for the current user
@@ -487,12 +512,7 @@ def add_nutrition_log():
     }
     
     # Default user goals (these would normally come from user settings)
-    user_goals = {
-        'calories': 2000,
-        'protein': 150,
-        'carbs': 250,
-        'fats': 70
-    }
+    user_goals = current_app.config['NUTRITION_GOALS']
     
     return render_template(
         'add_nutrition_log.html',
@@ -502,7 +522,7 @@ def add_nutrition_log():
     )
 
 
-@app.route('/add_progress_log', methods=['GET', 'POST'])
+@bp.route('/add_progress_log', methods=['GET', 'POST'])
 @login_required
 def add_progress_log():
     if request.method == 'POST':
@@ -514,8 +534,9 @@ def add_progress_log():
             notes=request.form['notes']
         )
         db.session.add(new_log)
+        fragment_cache.invalidate(current_user.id, fragment_cache.PROGRESS)
         db.session.commit()
-        return redirect(url_for('progress_logs'))
+        return redirect(url_for('main.progress_logs'))
     return render_template('add_progress_log.html')
 
 
@@ -523,7 +544,7 @@ def add_progress_log():
 
 # Add these routes to your Flask application (app.py)
 
-@app.route('/add_workout_plan', methods=['GET', 'POST'])
+@bp.route('/add_workout_plan', methods=['GET', 'POST'])
 @login_required
 def add_workout_plan():
     if request.method == 'POST':
@@ -537,6 +558,13 @@ def add_workout_plan():
             created_at=datetime.now()
         )
         
+        # Optional date and repeat rule
+        try:
+            schedule.set_schedule(new_plan, *schedule.schedule_from_form(request.form))
+        except schedule.ScheduleError as e:
+            flash(str(e), 'danger')
+            return render_template('add_workout_plan.html')
+        
         db.session.add(new_plan)
         db.session.commit()
         
@@ -572,9 +600,11 @@ def add_workout_plan():
                     db.session.add(new_exercise)
                     new_plan.exercises.append(new_exercise)
         
+        fragment_cache.invalidate(current_user.id, fragment_cache.WORKOUTS)
         db.session.commit()
+        calorie_engine.schedule(new_plan.id)
         flash('Workout plan created successfully!', 'success')
-        return redirect(url_for('workout_plans'))
+        return redirect(url_for('main.workout_plans'))
         
     return render_template('add_workout_plan.html')
 
@@ -583,7 +613,7 @@ def add_workout_plan():
 
 
 
-@app.route('/edit_workout_plan/<int:id>', methods=['GET', 'POST'])
+@bp.route('/edit_workout_plan/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit_workout_plan(id):
     plan = WorkoutPlan.query.get_or_404(id)
@@ -591,7 +621,7 @@ def edit_workout_plan(id):
     # Make sure the current user owns this workout plan
     if plan.created_by != current_user.id:
         flash('You do not have permission to edit this workout plan', 'danger')
-        return redirect(url_for('workout_plans'))
+        return redirect(url_for('main.workout_plans'))
     
     if request.method == 'POST':
         # Update workout plan from form data
@@ -600,6 +630,16 @@ def edit_workout_plan(id):
         plan.level = request.form['level']
         plan.duration = int(request.form['duration']) if request.form['duration'] else None
         
+        # Date and repeat rule, when they changed
+        try:
+            first_date, recurrence = schedule.schedule_from_form(request.form)
+            if (first_date, recurrence) != (plan.date, plan.recurrence):
+                schedule.set_schedule(plan, first_date, recurrence)
+        except schedule.ScheduleError as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('main.edit_workout_plan', id=plan.id))
+        
         # Remove existing exercise associations
         plan.exercises.clear()
         
@@ -635,9 +675,11 @@ def edit_workout_plan(id):
                     db.session.add(new_exercise)
                     plan.exercises.append(new_exercise)
         
+        fragment_cache.invalidate(current_user.id, fragment_cache.WORKOUTS)
         db.session.commit()
+        calorie_engine.schedule(plan.id)
         flash('Workout plan updated successfully!', 'success')
-        return redirect(url_for('workout_plans', id=plan.id))
+        return redirect(url_for('main.workout_plans', id=plan.id))
     
     return render_template('edit_workout_plan.html', plan=plan)
 
@@ -645,7 +687,7 @@ def edit_workout_plan(id):
 
 
 
-@app.route('/delete_workout_plan/<int:id>', methods=['POST'])
+@bp.route('/delete_workout_plan/<int:id>', methods=['POST'])
 @login_required
 def delete_workout_plan(id):
     plan = WorkoutPlan.query.get_or_404(id)
@@ -653,22 +695,267 @@ def delete_workout_plan(id):
     # Make sure the current user owns this workout plan
     if plan.created_by != current_user.id:
         flash('You do not have permission to delete this workout plan', 'danger')
-        return redirect(url_for('workout_plans'))
+        return redirect(url_for('main.workout_plans'))
     
     # Clear the exercise associations
     plan.exercises.clear()
     
+    # Open occurrences go with their series; completed ones stay as history
+    for occurrence in WorkoutPlan.query.filter_by(series_id=plan.id):
+        if occurrence.progress == 100:
+            occurrence.series_id = None
+        else:
+            occurrence.exercises.clear()
+            db.session.delete(occurrence)
+    
     # Delete the workout plan
     db.session.delete(plan)
+    fragment_cache.invalidate(current_user.id, fragment_cache.WORKOUTS)
     db.session.commit()
     
     flash('Workout plan deleted successfully!', 'success')
-    return redirect(url_for('workout_plans'))
+    return redirect(url_for('main.workout_plans'))
+
+@bp.route('/complete_workout_plan/<int:id>', methods=['POST'])
+@login_required
+def complete_workout_plan(id):
+    plan = WorkoutPlan.query.get_or_404(id)
+    
+    # Make sure the current user owns this workout plan
+    if plan.created_by != current_user.id:
+        flash('You do not have permission to update this workout plan', 'danger')
+        return redirect(url_for('main.workout_plans'))
+    
+    if plan.recurrence:
+        # Completes one occurrence: the form's date, or today
+        try:
+            day = datetime.strptime(request.form.get('date') or datetime.now().strftime('%Y-%m-%d'), '%Y-%m-%d').date()
+            schedule.complete_occurrence(plan, day)
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e) if isinstance(e, schedule.ScheduleError) else 'Invalid date', 'danger')
+            return redirect(request.referrer or url_for('main.workout_plans'))
+        fragment_cache.invalidate(current_user.id, fragment_cache.WORKOUTS)
+        db.session.commit()
+        flash('Workout completed! Great job!', 'success')
+    elif plan.progress != 100:
+        plan.progress = 100
+        # Unscheduled plans count for the day they were completed
+        if plan.date is None:
+            plan.date = plan.ends_on = datetime.now().date()
+        leaderboard.record_completion(plan)
+        fragment_cache.invalidate(current_user.id, fragment_cache.WORKOUTS)
+        db.session.commit()
+        flash('Workout completed! Great job!', 'success')
+    
+    return redirect(request.referrer or url_for('main.workout_plans'))
+
+@bp.route('/api/calendar')
+@login_required
+@coalesce
+def workout_calendar():
+    try:
+        start, end = schedule.parse_range(request.args.get('start'), request.args.get('end'))
+    except schedule.ScheduleError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'occurrences': [
+            dict(o._asdict(), date=o.date.isoformat(), series_date=o.series_date and o.series_date.isoformat())
+            for o in schedule.calendar(current_user.id, start, end)
+        ]
+    })
+
+@bp.route('/api/calendar/reschedule', methods=['POST'])
+@login_required
+def reschedule_workouts():
+    # {"moves": [{"plan_id": 3, "date": "2026-10-20", "to": "2026-10-22"}, ...]}
+    # or {"shift": {"start": "2026-10-20", "end": "2026-10-26", "days": 7}}; all or nothing
+    data = request.get_json(silent=True) or {}
+    usage = 'Moves need plan_id, to and an optional date; shifts need start, end and days'
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Send a JSON object with moves or shift'}), 400
+    if 'shift' in data and not isinstance(data['shift'], dict):
+        return jsonify({'error': usage}), 400
+    moves = data.get('moves', [])
+    if 'shift' not in data and not (isinstance(moves, list) and all(isinstance(move, dict) for move in moves)):
+        return jsonify({'error': usage}), 400
+    try:
+        if 'shift' in data:
+            shift = data['shift']
+            start, end = schedule.parse_range(shift.get('start'), shift.get('end'))
+            moved = schedule.shift(current_user.id, start, end, int(shift.get('days', 0)))
+        else:
+            moves = [
+                (int(move['plan_id']),
+                 datetime.strptime(move['date'], '%Y-%m-%d').date() if move.get('date') else None,
+                 datetime.strptime(move['to'], '%Y-%m-%d').date())
+                for move in moves
+            ]
+            moved = schedule.reschedule(current_user.id, moves)
+    except schedule.ScheduleError as e:
+        return jsonify({'error': str(e)}), 400
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return jsonify({'error': usage}), 400
+    return jsonify({'moved': moved})
+
+@bp.route('/leaderboard')
+@login_required
+def leaderboard_page():
+    boards = {
+        board: {
+            'entries': leaderboard.leaderboard_entries(board, 10),
+            'me': leaderboard.my_standing(board, current_user.id)
+        }
+        for board in leaderboard.BOARDS
+    }
+    return render_template('leaderboard.html', boards=boards)
 
-@app.route('/pose-detection')
+@bp.route('/reports')
+@login_required
+def reports_page():
+    query = db.session.query(WeeklyReport, User.name, User.email).join(User, User.id == WeeklyReport.user_id)
+    # Admins see every member's reports, members their own
+    if current_user.role != 'admin':
+        query = query.filter(WeeklyReport.user_id == current_user.id)
+    weeks = {}
+    for report, name, email in query.order_by(WeeklyReport.week_start.desc(), User.name, WeeklyReport.format).limit(500):
+        weeks.setdefault(report.week_start, {}).setdefault(report.user_id, {'name': name or email, 'files': []})['files'].append(report)
+    return render_template('reports.html', weeks=weeks)
+
+@bp.route('/reports/<digest>.<ext>')
+@login_required
+def report_file(digest, ext):
+    query = WeeklyReport.query.filter_by(digest=digest, format=ext)
+    if current_user.role != 'admin':
+        query = query.filter_by(user_id=current_user.id)
+    report = query.first()
+    store = current_app.extensions['report_store']
+    if report is None or not store.exists(digest, ext):
+        return 'Report not found', 404
+    # The name is the content hash, so the file can be cached forever
+    response = send_file(store.path(digest, ext), mimetype=reports.MIMETYPES[ext], as_attachment=ext == 'pdf',
+                         download_name=f'weekly-report-{report.week_start}.{ext}', etag=digest,
+                         max_age=365 * 24 * 3600, conditional=True)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+@bp.route('/api/leaderboard/<board>')
+@login_required
+@coalesce
+def leaderboard_data(board):
+    if board not in leaderboard.BOARDS:
+        return jsonify({'error': 'Unknown leaderboard'}), 404
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    return jsonify({
+        'board': board,
+        'top': leaderboard.leaderboard_entries(board, limit),
+        'me': leaderboard.my_standing(board, current_user.id)
+    })
+
+@bp.route('/api/recommendations')
+@login_required
+@coalesce
+def exercise_recommendations():
+    # Seed with the exercises already in the plan being edited, else the member's recent plans
+    names = [name.strip() for name in request.args.getlist('exercise') if name.strip()]
+    seed_ids = [row.id for row in Exercise.query.filter(Exercise.name.in_(names))] if names else None
+    k = min(request.args.get('k', 10, type=int), 50)
+    recommended = recommendations.recommend_for_user(current_user, seed_ids, request.args.get('level'), k)
+    exercises = {e.id: e for e in Exercise.query.filter(Exercise.id.in_([i for i, _ in recommended]))}
+    return jsonify([{
+        'id': exercise_id,
+        'name': exercises[exercise_id].name,
+        'muscle_group': exercises[exercise_id].muscle_group,
+        'score': round(score, 4)
+    } for exercise_id, score in recommended if exercise_id in exercises])
+
+@bp.route('/pose-detection')
 @login_required
 def pose_detection():
-    return render_template('pose_detection.html')
+    # Stream landmarks to the realtime pose server when one is configured
+    pose_ws_url = current_app.config.get('POSE_WS_URL')
+    pose_ws_token = None
+    if pose_ws_url:
+        pose_ws_token = make_ws_token(current_app.config['SECRET_KEY'], current_user.id, current_user.role)
+    return render_template('pose_detection.html', pose_ws_url=pose_ws_url, pose_ws_token=pose_ws_token)
+
+
+def get_pose_session_or_404(id, write=False):
+    pose_session = PoseSession.query.get_or_404(id)
+    # Members own their sessions; trainers (admins) may review anyone's
+    if pose_session.user_id != current_user.id and (write or current_user.role != 'admin'):
+        return None
+    return pose_session
+
+@bp.route('/api/pose_sessions', methods=['GET', 'POST'])
+@login_required
+def pose_sessions():
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            pose_session = pose_store.create_session(
+                current_user.id,
+                data.get('exercise'),
+                data.get('dtype', 'float16')
+            )
+        except pose_store.PoseBatchError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'id': pose_session.id, 'dtype': pose_session.dtype}), 201
+
+    user_id = request.args.get('user_id', current_user.id, type=int)
+    if user_id != current_user.id and current_user.role != 'admin':
+        return jsonify({'error': 'Forbidden'}), 403
+    sessions = PoseSession.query.filter_by(user_id=user_id).order_by(PoseSession.started_at.desc()).all()
+    return jsonify([{
+        'id': s.id,
+        'exercise': s.exercise,
+        'dtype': s.dtype,
+        'started_at': s.started_at.isoformat(),
+        'num_frames': s.num_frames,
+        'duration_ms': s.duration_ms
+    } for s in sessions])
+
+@bp.route('/api/pose_sessions/<int:id>/frames', methods=['GET', 'POST'])
+@login_required
+def pose_session_frames(id):
+    pose_session = get_pose_session_or_404(id, write=request.method == 'POST')
+    if pose_session is None:
+        return jsonify({'error': 'Forbidden'}), 403
+    base_dir = current_app.config['POSE_SESSION_DIR']
+
+    if request.method == 'POST':
+        try:
+            chunk = pose_store.append_batch(
+                base_dir,
+                pose_session,
+                request.get_data(cache=False),
+                request.headers.get('Content-Encoding')
+            )
+        except pose_store.PoseBatchError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        return jsonify({
+            'frames': chunk.num_frames,
+            'num_frames': pose_session.num_frames,
+            'duration_ms': pose_session.duration_ms
+        })
+
+    # Stream the requested time range straight out of the memory-mapped files
+    timestamps, landmarks = pose_store.read_range(
+        base_dir,
+        pose_session,
+        request.args.get('start_ms', type=int),
+        request.args.get('end_ms', type=int)
+    )
+    return Response(
+        pose_store.iter_frames(timestamps, landmarks),
+        mimetype='application/octet-stream',
+        headers={'X-Pose-Dtype': pose_session.dtype}
+    )
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
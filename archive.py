@@ -0,0 +1,422 @@
+"""Cold-data archival of NutritionLog and Progress history.
+
+``flask archive run`` moves rows older than ``ARCHIVE_HORIZON_DAYS`` out of the
+hot tables. They go into one gzip-compressed JSON-lines file per kind, member
+and year under ``ARCHIVE_DIR``, which keeps the tables that every page
+queries small. Daily rollups of the moved rows stay in the database:
+``NutritionRollup`` per day and meal, ``ProgressRollup`` per day.
+
+Readers never need to know where a row lives. The query functions below
+read both stores:
+
+* ``nutrition_daily``, ``nutrition_totals``, ``nutrition_by_meal`` and
+  ``progress_daily`` aggregate hot rows and rollups in one UNION ALL query,
+  so charts over any range cost one indexed query.
+* ``nutrition_entries`` and ``progress_entries`` return individual rows,
+  merging hot rows with the archive files that overlap the range. Exports
+  use these.
+
+``ArchiveSegment`` records each file and how many of its rows are committed.
+Files are rewritten in full and renamed into place before the transaction
+that deletes the hot rows. If that transaction fails, the extra rows in the
+file are ignored, and the next run rewrites them. ``flask archive restore``
+moves a member's rows back and drops their rollups.
+"""
+import gzip
+import json
+import os
+import time
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func, literal, select, union_all
+
+from db import db, upsert
+import fragment_cache
+from models import ArchiveSegment, NutritionLog, NutritionRollup, Progress, ProgressRollup
+
+NUTRITION = 'nutrition'
+PROGRESS = 'progress'
+DEFAULT_HORIZON_DAYS = 730
+
+NutritionEntry = namedtuple('NutritionEntry', 'id date meal calories protein carbs fats')
+ProgressEntry = namedtuple('ProgressEntry', 'id date weight body_fat_percentage notes')
+
+# kind -> (hot model, entry type, fragment cache scope)
+KINDS = {
+    NUTRITION: (NutritionLog, NutritionEntry, fragment_cache.NUTRITION),
+    PROGRESS: (Progress, ProgressEntry, fragment_cache.PROGRESS),
+}
+
+
+def _archive_dir():
+    return current_app.config['ARCHIVE_DIR']
+
+
+def segment_path(kind, user_id, year):
+    return os.path.join(_archive_dir(), kind, str(user_id), f'{year}.jsonl.gz')
+
+
+def read_segment(kind, user_id, year, rows):
+    """The first ``rows`` entries of a segment file, i.e. the committed ones."""
+    entry_type = KINDS[kind][1]
+    entries = []
+    if not rows:
+        return entries
+    with gzip.open(segment_path(kind, user_id, year), 'rt', encoding='utf-8') as f:
+        for line in f:
+            values = json.loads(line)
+            values[1] = date.fromisoformat(values[1])
+            entries.append(entry_type(*values))
+            if len(entries) == rows:
+                break
+    return entries
+
+
+def write_segment(kind, user_id, year, entries):
+    path = segment_path(kind, user_id, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path + '.tmp', 'wt', encoding='utf-8', compresslevel=9) as f:
+        for entry in entries:
+            f.write(json.dumps([entry.id, entry.date.isoformat(), *entry[2:]]) + '\n')
+    os.replace(path + '.tmp', path)
+
+
+def _add_rollups(kind, user_id, entries):
+    if not entries:
+        return
+    if kind == NUTRITION:
+        totals = defaultdict(lambda: [0.0, 0.0, 0.0, 0.0, 0])
+        for e in entries:
+            total = totals[(e.date, e.meal or '')]
+            for i, value in enumerate((e.calories, e.protein, e.carbs, e.fats)):
+                total[i] += value or 0
+            total[4] += 1
+        stmt = upsert(NutritionRollup)
+        columns = ('calories', 'protein', 'carbs', 'fats', 'entries')
+        rows = [dict(user_id=user_id, date=day, meal=meal, **dict(zip(columns, total)))
+                for (day, meal), total in totals.items()]
+        target = [NutritionRollup.user_id, NutritionRollup.date, NutritionRollup.meal]
+        model = NutritionRollup
+    else:
+        totals = defaultdict(lambda: [0.0, 0, 0.0, 0, 0])
+        for e in entries:
+            total = totals[e.date]
+            if e.weight is not None:
+                total[0] += e.weight
+                total[1] += 1
+            if e.body_fat_percentage is not None:
+                total[2] += e.body_fat_percentage
+                total[3] += 1
+            total[4] += 1
+        stmt = upsert(ProgressRollup)
+        columns = ('weight_sum', 'weight_count', 'body_fat_sum', 'body_fat_count', 'entries')
+        rows = [dict(user_id=user_id, date=day, **dict(zip(columns, total))) for day, total in totals.items()]
+        target = [ProgressRollup.user_id, ProgressRollup.date]
+        model = ProgressRollup
+    # Rows for a day that was archived before (e.g. a backdated entry) add to its rollup
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=target,
+        set_={column: getattr(model, column) + getattr(stmt.excluded, column) for column in columns}
+    ), rows)
+
+
+def archive_user(kind, user_id, cutoff):
+    """Move one member's rows dated before ``cutoff`` into the archive; returns the count moved."""
+    model, entry_type, scope = KINDS[kind]
+    rows = db.session.query(*(getattr(model, field) for field in entry_type._fields)).filter(
+        model.user_id == user_id, model.date < cutoff
+    ).order_by(model.date, model.id).all()
+    if not rows:
+        return 0
+
+    by_year = defaultdict(list)
+    for row in rows:
+        by_year[row.date.year].append(entry_type(*row))
+
+    added = []
+    for year, new_entries in by_year.items():
+        segment = db.session.get(ArchiveSegment, (kind, user_id, year))
+        committed = read_segment(kind, user_id, year, segment.rows if segment else 0)
+        known = {entry.id for entry in committed}
+        fresh = [entry for entry in new_entries if entry.id not in known]
+        entries = committed + fresh
+        write_segment(kind, user_id, year, entries)
+        added += fresh
+
+        if segment is None:
+            segment = ArchiveSegment(kind=kind, user_id=user_id, year=year)
+            db.session.add(segment)
+        segment.rows = len(entries)
+        segment.first_date = min(entry.date for entry in entries)
+        segment.last_date = max(entry.date for entry in entries)
+        segment.archived_at = datetime.utcnow()
+
+    _add_rollups(kind, user_id, added)
+    db.session.query(model).filter(model.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+    fragment_cache.invalidate(user_id, scope)
+    db.session.commit()
+    return len(rows)
+
+
+def restore_user(kind, user_id, year=None):
+    """Move a member's archived rows back into the hot table; returns the count restored."""
+    model, entry_type, scope = KINDS[kind]
+    rollup = NutritionRollup if kind == NUTRITION else ProgressRollup
+    segments = ArchiveSegment.query.filter_by(kind=kind, user_id=user_id)
+    if year is not None:
+        segments = segments.filter_by(year=year)
+    segments = segments.all()
+
+    restored = 0
+    for segment in segments:
+        entries = read_segment(kind, user_id, segment.year, segment.rows)
+        taken = {row.id for row in db.session.query(model.id).filter(model.id.in_([e.id for e in entries]))}
+        rows = []
+        for entry in entries:
+            values = dict(entry._asdict(), user_id=user_id)
+            if entry.id in taken:
+                del values['id']  # Id was reused since archival; take a new one
+            rows.append(values)
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+        # The year's rollups came only from this segment
+        db.session.query(rollup).filter(
+            rollup.user_id == user_id,
+            rollup.date >= date(segment.year, 1, 1),
+            rollup.date <= date(segment.year, 12, 31)
+        ).delete(synchronize_session=False)
+        db.session.delete(segment)
+        restored += len(entries)
+
+    fragment_cache.invalidate(user_id, scope)
+    db.session.commit()
+    for segment in segments:
+        try:
+            os.remove(segment_path(kind, user_id, segment.year))
+        except FileNotFoundError:
+            pass
+    return restored
+
+
+# Query interface: hot rows and archived data behind one set of functions
+
+def _range(query, column, start, end):
+    if start is not None:
+        query = query.where(column >= start)
+    if end is not None:
+        query = query.where(column <= end)
+    return query
+
+
+def _member(query, column, user_id):
+    # No user_id: every member, for batch jobs
+    return query if user_id is None else query.where(column == user_id)
+
+
+def _nutrition_union(user_id, start=None, end=None):
+    hot = _range(_member(select(
+        NutritionLog.user_id, NutritionLog.date, NutritionLog.meal, NutritionLog.calories, NutritionLog.protein,
+        NutritionLog.carbs, NutritionLog.fats, literal(1).label('entries')
+    ), NutritionLog.user_id, user_id), NutritionLog.date, start, end)
+    cold = _range(_member(select(
+        NutritionRollup.user_id, NutritionRollup.date, func.nullif(NutritionRollup.meal, '').label('meal'),
+        NutritionRollup.calories, NutritionRollup.protein, NutritionRollup.carbs, NutritionRollup.fats,
+        NutritionRollup.entries
+    ), NutritionRollup.user_id, user_id), NutritionRollup.date, start, end)
+    return union_all(hot, cold).subquery()
+
+
+def nutrition_daily_query(user_id, start=None, end=None, meal=None, search=None):
+    """Per-day totals; ``meal``/``search`` pick the days, whose totals still cover every meal."""
+    rows = _nutrition_union(user_id, start, end)
+    query = select(
+        rows.c.date,
+        func.sum(rows.c.calories).label('calories'),
+        func.sum(rows.c.protein).label('protein'),
+        func.sum(rows.c.carbs).label('carbs'),
+        func.sum(rows.c.fats).label('fats'),
+        func.sum(rows.c.entries).label('entries')
+    ).group_by(rows.c.date).order_by(rows.c.date)
+    if meal or search:
+        matching = _nutrition_union(user_id, start, end)
+        days = select(matching.c.date)
+        if meal:
+            days = days.where(matching.c.meal == meal)
+        if search:
+            days = days.where(matching.c.meal.ilike(f'%{search}%'))
+        query = query.where(rows.c.date.in_(days))
+    return query
+
+
+def nutrition_daily(user_id, start=None, end=None):
+    return db.session.execute(nutrition_daily_query(user_id, start, end)).all()
+
+
+def nutrition_daily_by_member(start, end):
+    """Per-member, per-day totals of every member in one query, for batch jobs."""
+    rows = _nutrition_union(None, start, end)
+    return db.session.execute(select(
+        rows.c.user_id,
+        rows.c.date,
+        func.sum(rows.c.calories).label('calories'),
+        func.sum(rows.c.protein).label('protein'),
+        func.sum(rows.c.carbs).label('carbs'),
+        func.sum(rows.c.fats).label('fats'),
+        func.sum(rows.c.entries).label('entries')
+    ).group_by(rows.c.user_id, rows.c.date).order_by(rows.c.user_id, rows.c.date)).all()
+
+
+def nutrition_daily_averages(user_id, start=None, meal=None, search=None):
+    """Average daily (calories, protein, carbs, fats) over the days with matching entries."""
+    daily = nutrition_daily_query(user_id, start, None, meal, search).subquery()
+    return tuple(db.session.execute(select(
+        func.avg(daily.c.calories), func.avg(daily.c.protein), func.avg(daily.c.carbs), func.avg(daily.c.fats)
+    )).one())
+
+
+def nutrition_totals(user_id, start=None, end=None):
+    rows = _nutrition_union(user_id, start, end)
+    return db.session.execute(select(
+        func.sum(rows.c.calories).label('total_calories'),
+        func.sum(rows.c.protein).label('total_protein'),
+        func.sum(rows.c.carbs).label('total_carbs'),
+        func.sum(rows.c.fats).label('total_fats')
+    )).one()
+
+
+def nutrition_by_meal(user_id, start=None, end=None):
+    rows = _nutrition_union(user_id, start, end)
+    return db.session.execute(select(
+        rows.c.meal, func.sum(rows.c.calories).label('total_calories')
+    ).group_by(rows.c.meal)).all()
+
+
+def _progress_daily_query(user_id, start, end):
+    hot = _range(_member(select(
+        Progress.user_id,
+        Progress.date,
+        func.coalesce(Progress.weight, 0).label('weight_sum'),
+        (Progress.weight.isnot(None)).cast(db.Integer).label('weight_count'),
+        func.coalesce(Progress.body_fat_percentage, 0).label('body_fat_sum'),
+        (Progress.body_fat_percentage.isnot(None)).cast(db.Integer).label('body_fat_count')
+    ), Progress.user_id, user_id), Progress.date, start, end)
+    cold = _range(_member(select(
+        ProgressRollup.user_id, ProgressRollup.date, ProgressRollup.weight_sum, ProgressRollup.weight_count,
+        ProgressRollup.body_fat_sum, ProgressRollup.body_fat_count
+    ), ProgressRollup.user_id, user_id), ProgressRollup.date, start, end)
+    rows = union_all(hot, cold).subquery()
+    weight_count = func.sum(rows.c.weight_count)
+    body_fat_count = func.sum(rows.c.body_fat_count)
+    return select(
+        rows.c.user_id,
+        rows.c.date,
+        (func.sum(rows.c.weight_sum) / func.nullif(weight_count, 0)).label('weight'),
+        (func.sum(rows.c.body_fat_sum) / func.nullif(body_fat_count, 0)).label('body_fat_percentage')
+    ).group_by(rows.c.user_id, rows.c.date).order_by(rows.c.user_id, rows.c.date)
+
+
+def progress_daily(user_id, start=None, end=None):
+    """Per-day average (weight, body fat %) for long-range trends."""
+    return db.session.execute(_progress_daily_query(user_id, start, end)).all()
+
+
+def progress_daily_by_member(start, end):
+    """Per-member, per-day averages of every member in one query, for batch jobs."""
+    return db.session.execute(_progress_daily_query(None, start, end)).all()
+
+
+def _entries(kind, user_id, start=None, end=None):
+    model, entry_type, _ = KINDS[kind]
+    query = db.session.query(*(getattr(model, field) for field in entry_type._fields)).filter(model.user_id == user_id)
+    if start is not None:
+        query = query.filter(model.date >= start)
+    if end is not None:
+        query = query.filter(model.date <= end)
+    entries = [entry_type(*row) for row in query] + archived_entries(kind, user_id, start, end)
+    entries.sort(key=lambda entry: (entry.date, entry.id), reverse=True)
+    return entries
+
+
+def archived_entries(kind, user_id, start=None, end=None):
+    """The member's archived entries in the range, newest first."""
+    # Only the archive files whose dates overlap the range are opened
+    segments = ArchiveSegment.query.filter_by(kind=kind, user_id=user_id)
+    if start is not None:
+        segments = segments.filter(ArchiveSegment.last_date >= start)
+    if end is not None:
+        segments = segments.filter(ArchiveSegment.first_date <= end)
+    entries = []
+    for segment in segments:
+        entries += [entry for entry in read_segment(kind, user_id, segment.year, segment.rows)
+                    if (start is None or entry.date >= start) and (end is None or entry.date <= end)]
+    entries.sort(key=lambda entry: (entry.date, entry.id), reverse=True)
+    return entries
+
+
+def nutrition_entries(user_id, start=None, end=None):
+    """Every nutrition entry in the range, newest first, wherever it is stored."""
+    return _entries(NUTRITION, user_id, start, end)
+
+
+def progress_entries(user_id, start=None, end=None):
+    """Every progress entry in the range, newest first, wherever it is stored."""
+    return _entries(PROGRESS, user_id, start, end)
+
+
+def init_archive(app):
+    app.config.setdefault('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    app.cli.add_command(archive_cli)
+
+
+archive_cli = AppGroup('archive', help='Cold-data archival of nutrition and progress history.')
+kind_option = click.option('--kind', 'kinds', type=click.Choice(list(KINDS)), multiple=True,
+                           help='Only this kind of data (repeatable; default: all).')
+
+
+@archive_cli.command('run')
+@kind_option
+@click.option('--horizon-days', type=int, help='Archive rows older than this (default: ARCHIVE_HORIZON_DAYS).')
+@click.option('--user', 'user_ids', type=int, multiple=True, help='Only this member (repeatable).')
+def run_command(kinds, horizon_days, user_ids):
+    """Move rows older than the horizon into the archive."""
+    horizon_days = horizon_days or current_app.config.get('ARCHIVE_HORIZON_DAYS', DEFAULT_HORIZON_DAYS)
+    cutoff = date.today() - timedelta(days=horizon_days)
+    for kind in kinds or KINDS:
+        model = KINDS[kind][0]
+        started = time.perf_counter()
+        members = db.session.query(model.user_id).filter(model.date < cutoff, model.user_id.isnot(None))
+        if user_ids:
+            members = members.filter(model.user_id.in_(user_ids))
+        members = [row.user_id for row in members.distinct()]
+        moved = sum(archive_user(kind, user_id, cutoff) for user_id in members)
+        click.echo(f'{kind:<10} archived {moved} rows before {cutoff} for {len(members)} members '
+                   f'in {time.perf_counter() - started:.2f}s')
+
+
+@archive_cli.command('restore')
+@kind_option
+@click.option('--user', 'user_id', type=int, required=True, help='Member to restore.')
+@click.option('--year', type=int, help='Only this year.')
+def restore_command(kinds, user_id, year):
+    """Bring archived rows back into the main tables."""
+    for kind in kinds or KINDS:
+        started = time.perf_counter()
+        restored = restore_user(kind, user_id, year)
+        click.echo(f'{kind:<10} restored {restored} rows in {time.perf_counter() - started:.2f}s')
+
+
+@archive_cli.command('status')
+def status_command():
+    """Archived rows and file sizes per kind."""
+    for kind in KINDS:
+        segments = ArchiveSegment.query.filter_by(kind=kind).all()
+        size = sum(os.path.getsize(segment_path(kind, s.user_id, s.year)) for s in segments
+                   if os.path.exists(segment_path(kind, s.user_id, s.year)))
+        first = min((s.first_date for s in segments), default=None)
+        last = max((s.last_date for s in segments), default=None)
+        click.echo(f'{kind:<10} {sum(s.rows for s in segments)} rows in {len(segments)} files '
+                   f'({size / 1024:.0f} KiB), {first or "-"} .. {last or "-"}')
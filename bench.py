@@ -0,0 +1,363 @@
+"""End-to-end route benchmark.
+
+Drives every route of the app through the Flask test client as seeded members
+(see seed.py) and reports throughput, latency percentiles and SQL queries per
+request. Results can be stored as a baseline and later runs compared to it:
+
+    flask seed-data --users 50 --years 2 --reset
+    flask bench --requests 200 --threads 4 --save-baseline bench_baseline.json
+    flask bench --requests 200 --threads 4 --baseline bench_baseline.json
+"""
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+from datetime import date, timedelta
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+
+from db import db
+import pose_store
+from models import NutritionLog, Progress, User, WeeklyReport, WorkoutPlan
+from seed import SEED_PASSWORD
+
+_local = threading.local()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+
+
+class Scenario:
+    """One benchmarked route: how to build the request for a given member."""
+
+    def __init__(self, name, endpoint, method, url, data=None, setup=None, json=None, content_type=None, after=None):
+        self.name = name
+        self.endpoint = endpoint  # The Flask endpoint it covers, checked against app.url_map
+        self.method = method
+        self.url = url      # callable(member) -> url
+        self.data = data    # callable(member) -> form data or raw body, for POSTs
+        self.json = json    # callable(member) -> JSON body, for POSTs
+        self.content_type = content_type
+        self.setup = setup  # callable(member) run untimed before the request
+        self.after = after  # callable(client, member) run untimed after the request
+
+    def run(self, app, client, member):
+        if self.setup:
+            with app.app_context():
+                self.setup(member)
+        url = self.url(member)
+        data = self.data(member) if self.data else None
+        json_body = self.json(member) if self.json else None
+        _local.queries = 0
+        started = time.perf_counter()
+        response = client.open(url, method=self.method, data=data, json=json_body, content_type=self.content_type)
+        elapsed = time.perf_counter() - started
+        if self.after:
+            self.after(client, member)
+        return elapsed, _local.queries, response.status_code
+
+
+class Member:
+    """A seeded user with ids of rows they own, loaded once up front."""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.email = user.email
+        self.plan_ids = [row.id for row in db.session.query(WorkoutPlan.id).filter_by(created_by=user.id).limit(50)]
+        self.log_ids = [row.id for row in db.session.query(NutritionLog.id).filter_by(user_id=user.id).limit(50)]
+        self.progress_ids = [row.id for row in db.session.query(Progress.id).filter_by(user_id=user.id).limit(50)]
+        report = WeeklyReport.query.filter_by(user_id=user.id).first()
+        self.report_url = f'/reports/{report.digest}.{report.format}' if report else None
+        self.created_log_ids = []
+        self.created_plan_ids = []
+        self.pose_session_ids = []
+        self.recorded_session_id = None
+
+    def plan_id(self):
+        return random.choice(self.plan_ids) if self.plan_ids else 0
+
+    def log_id(self):
+        return random.choice(self.log_ids) if self.log_ids else 0
+
+    def progress_id(self):
+        return random.choice(self.progress_ids) if self.progress_ids else 0
+
+
+def login(client, member):
+    client.post('/', data={'email': member.email, 'password': SEED_PASSWORD})
+
+
+def _new_nutrition_log(member):
+    log = NutritionLog(user_id=member.id, date=date.today(), meal='Snack', calories=100, protein=5, carbs=10, fats=2)
+    db.session.add(log)
+    db.session.commit()
+    member.created_log_ids.append(log.id)
+
+
+def _new_workout_plan(member):
+    plan = WorkoutPlan(title='Bench plan', level='beginner', created_by=member.id)
+    db.session.add(plan)
+    db.session.commit()
+    member.created_plan_ids.append(plan.id)
+
+
+def _new_scheduled_plan(member):
+    plan = WorkoutPlan(title='Bench plan', level='beginner', created_by=member.id,
+                       date=date.today(), ends_on=date.today())
+    db.session.add(plan)
+    db.session.commit()
+    member.created_plan_ids.append(plan.id)
+
+
+def _new_pose_session(member):
+    member.pose_session_ids.append(pose_store.create_session(member.id, 'squat').id)
+
+
+def _recorded_pose_session(member):
+    # One ten-second session per member, recorded on first use
+    if member.recorded_session_id is None:
+        session = pose_store.create_session(member.id, 'squat')
+        pose_store.append_batch(current_app.config['POSE_SESSION_DIR'], session, _pose_batch(300))
+        member.recorded_session_id = session.id
+
+
+def _pose_batch(frames):
+    landmarks = np.random.default_rng(frames).random((frames,) + pose_store.FRAME_SHAPE)
+    return pose_store.encode_batch(np.arange(frames) * 33, landmarks)
+
+
+def _nutrition_form(member):
+    return {'date': date.today().isoformat(), 'meal': 'Lunch', 'calories': '650',
+            'protein': '40', 'carbs': '70', 'fats': '20'}
+
+
+def _workout_form(member):
+    return {'title': 'Bench Legs', 'description': 'Benchmark plan', 'level': 'intermediate', 'duration': '45',
+            'exercise_name[]': ['Squat', 'Lunge'], 'exercise_sets[]': ['4', '3'],
+            'exercise_reps[]': ['8', '12'], 'exercise_notes[]': ['', '']}
+
+
+def build_scenarios(include_writes=True):
+    monday = date.today() - timedelta(days=date.today().weekday())
+    week = f'start={monday}&end={monday + timedelta(days=6)}'
+    scenarios = [
+        Scenario('login_page', 'main.login', 'GET', lambda m: '/'),
+        Scenario('register_page', 'main.register', 'GET', lambda m: '/register'),
+        Scenario('dashboard', 'main.dashboard', 'GET', lambda m: '/dashboard'),
+        Scenario('workout_plans', 'main.workout_plans', 'GET', lambda m: '/workout_plans'),
+        Scenario('workout_plan', 'main.workout_plan', 'GET', lambda m: f'/workout_plans/{m.plan_id()}'),
+        Scenario('progress_logs', 'main.progress_logs', 'GET', lambda m: '/progress_logs'),
+        Scenario('nutrition_logs', 'main.nutrition_logs', 'GET', lambda m: '/nutrition_logs'),
+        Scenario('nutrition_logs_all_time', 'main.nutrition_logs', 'GET', lambda m: '/nutrition_logs?date_range=all'),
+        Scenario('nutrition_logs_filtered', 'main.nutrition_logs', 'GET',
+                 lambda m: '/nutrition_logs?date_range=90&meal_type=Lunch'),
+        Scenario('export_nutrition_logs', 'main.export_nutrition_logs', 'GET',
+                 lambda m: '/export_nutrition_logs?format=csv'),
+        Scenario('export_nutrition_logs_pdf', 'main.export_nutrition_logs', 'GET',
+                 lambda m: '/export_nutrition_logs?format=pdf'),
+        Scenario('nutrition_chart_data', 'main.nutrition_chart_data', 'GET',
+                 lambda m: '/api/nutrition_chart_data?days=30'),
+        Scenario('nutrition_chart_data_year', 'main.nutrition_chart_data', 'GET',
+                 lambda m: '/api/nutrition_chart_data?days=365'),
+        Scenario('add_nutrition_log_page', 'main.add_nutrition_log', 'GET', lambda m: '/add_nutrition_log'),
+        Scenario('edit_nutrition_log_page', 'main.edit_nutrition_log', 'GET',
+                 lambda m: f'/edit_nutrition_log/{m.log_id()}'),
+        Scenario('add_progress_log_page', 'main.add_progress_log', 'GET', lambda m: '/add_progress_log'),
+        Scenario('add_workout_plan_page', 'main.add_workout_plan', 'GET', lambda m: '/add_workout_plan'),
+        Scenario('edit_workout_plan_page', 'main.edit_workout_plan', 'GET',
+                 lambda m: f'/edit_workout_plan/{m.plan_id()}'),
+        Scenario('workout_calendar', 'main.workout_calendar', 'GET', lambda m: f'/api/calendar?{week}'),
+        Scenario('leaderboard', 'main.leaderboard_page', 'GET', lambda m: '/leaderboard'),
+        Scenario('leaderboard_data', 'main.leaderboard_data', 'GET', lambda m: '/api/leaderboard/streak'),
+        Scenario('reports', 'main.reports_page', 'GET', lambda m: '/reports'),
+        # Needs "flask reports generate" first; members without a report get a 404
+        Scenario('report_file', 'main.report_file', 'GET', lambda m: m.report_url or '/reports/none.html'),
+        Scenario('pose_detection', 'main.pose_detection', 'GET', lambda m: '/pose-detection'),
+        Scenario('pose_sessions', 'main.pose_sessions', 'GET', lambda m: '/api/pose_sessions'),
+        Scenario('pose_session_frames', 'main.pose_session_frames', 'GET',
+                 lambda m: f'/api/pose_sessions/{m.recorded_session_id}/frames', setup=_recorded_pose_session),
+        Scenario('recommendations', 'main.exercise_recommendations', 'GET', lambda m: '/api/recommendations'),
+        Scenario('api_users', 'api_v1.users_list', 'GET', lambda m: '/api/v1/users'),
+        Scenario('api_user', 'api_v1.users_detail', 'GET', lambda m: f'/api/v1/users/{m.id}'),
+        Scenario('api_nutrition_logs', 'api_v1.nutrition_logs_list', 'GET',
+                 lambda m: '/api/v1/nutrition-logs?limit=100'),
+        Scenario('api_nutrition_logs_fields', 'api_v1.nutrition_logs_list', 'GET',
+                 lambda m: '/api/v1/nutrition-logs?limit=500&fields=date,calories'),
+        Scenario('api_nutrition_logs_ids', 'api_v1.nutrition_logs_list', 'GET',
+                 lambda m: f'/api/v1/nutrition-logs?ids={",".join(map(str, m.log_ids[:20])) or 0}'),
+        Scenario('api_nutrition_log', 'api_v1.nutrition_logs_detail', 'GET',
+                 lambda m: f'/api/v1/nutrition-logs/{m.log_id()}'),
+        Scenario('api_progress', 'api_v1.progress_list', 'GET', lambda m: '/api/v1/progress?limit=100'),
+        Scenario('api_progress_entry', 'api_v1.progress_detail', 'GET',
+                 lambda m: f'/api/v1/progress/{m.progress_id()}'),
+        Scenario('api_workout_plans', 'api_v1.workout_plans_list', 'GET', lambda m: '/api/v1/workout-plans?limit=20'),
+        Scenario('api_workout_plan', 'api_v1.workout_plans_detail', 'GET',
+                 lambda m: f'/api/v1/workout-plans/{m.plan_id()}'),
+        Scenario('static', 'static', 'GET', lambda m: '/static/css/style.css'),
+    ]
+    if include_writes:
+        scenarios += [
+            Scenario('login', 'main.login', 'POST', lambda m: '/',
+                     lambda m: {'email': m.email, 'password': SEED_PASSWORD}),
+            Scenario('logout', 'main.logout', 'GET', lambda m: '/logout', after=login),
+            Scenario('register', 'main.register', 'POST', lambda m: '/register',
+                     lambda m: {'email': f'bench-{uuid.uuid4().hex}@example.com',
+                                 'password': 'bench', 'name': 'Bench'}),
+            Scenario('add_nutrition_log', 'main.add_nutrition_log', 'POST',
+                     lambda m: '/add_nutrition_log', _nutrition_form),
+            Scenario('edit_nutrition_log', 'main.edit_nutrition_log', 'POST',
+                     lambda m: f'/edit_nutrition_log/{m.log_id()}', _nutrition_form),
+            Scenario('delete_nutrition_log', 'main.delete_nutrition_log', 'POST',
+                     lambda m: f'/delete_nutrition_log/{m.created_log_ids.pop()}', setup=_new_nutrition_log),
+            Scenario('add_progress_log', 'main.add_progress_log', 'POST', lambda m: '/add_progress_log',
+                     lambda m: {'date': date.today().isoformat(), 'weight': '80.5',
+                                'body_fat_percentage': '18', 'notes': 'bench'}),
+            Scenario('add_workout_plan', 'main.add_workout_plan', 'POST', lambda m: '/add_workout_plan', _workout_form),
+            Scenario('edit_workout_plan', 'main.edit_workout_plan', 'POST',
+                     lambda m: f'/edit_workout_plan/{m.created_plan_ids[-1]}', _workout_form, setup=_new_workout_plan),
+            Scenario('complete_workout_plan', 'main.complete_workout_plan', 'POST',
+                     lambda m: f'/complete_workout_plan/{m.created_plan_ids.pop()}', setup=_new_scheduled_plan),
+            Scenario('reschedule_workouts', 'main.reschedule_workouts', 'POST', lambda m: '/api/calendar/reschedule',
+                     json=lambda m: {'moves': [{'plan_id': m.created_plan_ids.pop(),
+                                                'to': (date.today() + timedelta(days=1)).isoformat()}]},
+                     setup=_new_scheduled_plan),
+            Scenario('delete_workout_plan', 'main.delete_workout_plan', 'POST',
+                     lambda m: f'/delete_workout_plan/{m.created_plan_ids.pop()}', setup=_new_workout_plan),
+            Scenario('create_pose_session', 'main.pose_sessions', 'POST', lambda m: '/api/pose_sessions',
+                     json=lambda m: {'exercise': 'squat'}),
+            Scenario('upload_pose_frames', 'main.pose_session_frames', 'POST',
+                     lambda m: f'/api/pose_sessions/{m.pose_session_ids.pop()}/frames', lambda m: _pose_batch(30),
+                     content_type='application/octet-stream', setup=_new_pose_session),
+        ]
+    return scenarios
+
+
+def unbenchmarked(app, scenarios):
+    """(endpoint, method) pairs in app.url_map that no scenario covers."""
+    covered = {(scenario.endpoint, scenario.method) for scenario in scenarios}
+    return sorted((rule.endpoint, method) for rule in app.url_map.iter_rules()
+                  for method in rule.methods - {'HEAD', 'OPTIONS'} if (rule.endpoint, method) not in covered)
+
+
+def _worker(app, scenario, member_ids, count):
+    # Requests must run outside any app context of ours, otherwise Flask reuses
+    # it and every request shares one SQLAlchemy session and identity map
+    with app.app_context():
+        members = [Member(db.session.get(User, member_id)) for member_id in member_ids]
+    clients = []
+    for member in members:
+        client = app.test_client()
+        login(client, member)
+        clients.append(client)
+    samples = []
+    for i in range(count):
+        index = i % len(members)
+        samples.append(scenario.run(app, clients[index], members[index]))
+    return samples
+
+
+def run_benchmark(app, scenarios, member_ids, requests, threads):
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _count_query)
+    results = {}
+    try:
+        for scenario in scenarios:
+            per_thread = [requests // threads + (1 if i < requests % threads else 0) for i in range(threads)]
+            groups = [member_ids[i::threads] or member_ids for i in range(threads)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                futures = [pool.submit(_worker, app, scenario, groups[i], per_thread[i])
+                           for i in range(threads) if per_thread[i]]
+                samples = [sample for future in futures for sample in future.result()]
+            wall = time.perf_counter() - started
+
+            latencies = np.array([s[0] for s in samples]) * 1000
+            queries = np.array([s[1] for s in samples])
+            statuses = sorted({s[2] for s in samples})
+            results[scenario.name] = {
+                'requests': len(samples),
+                'throughput': len(samples) / wall,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'queries': float(queries.mean()),
+                'statuses': statuses,
+            }
+    finally:
+        event.remove(engine, 'before_cursor_execute', _count_query)
+    return results
+
+
+# p99 is reported but too noisy at small request counts to fail a run on
+FLAGGED_METRICS = ('p50_ms', 'p95_ms', 'queries')
+
+
+def compare(results, baseline, tolerance):
+    """Yield (route, metric, old, new, regressed) for every baseline metric."""
+    for name, metrics in results.items():
+        old = baseline.get(name)
+        if not old:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries'):
+            regressed = (metric in FLAGGED_METRICS
+                         and metrics[metric] > old[metric] * (1 + tolerance)
+                         and metrics[metric] - old[metric] > 0.5)
+            yield name, metric, old[metric], metrics[metric], regressed
+
+
+@click.command('bench')
+@click.option('--requests', 'requests_per_route', default=100, show_default=True, help='Requests per route.')
+@click.option('--threads', default=1, show_default=True, help='Concurrent client threads.')
+@click.option('--members', default=10, show_default=True, help='Seeded members to rotate through.')
+@click.option('--route', 'routes', multiple=True, help='Only run these scenarios (repeatable).')
+@click.option('--read-only', is_flag=True, help='Skip routes that write to the database.')
+@click.option('--save-baseline', type=click.Path(dir_okay=False), help='Write results as a JSON baseline.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), help='Compare against a baseline.')
+@click.option('--tolerance', default=0.2, show_default=True, help='Allowed slowdown before flagging.')
+@with_appcontext
+def bench_command(requests_per_route, threads, members, routes, read_only, save_baseline, baseline, tolerance):
+    """Benchmark every route against the current database."""
+    member_ids = [row.id for row in db.session.query(User.id)
+                  .filter(User.email.like('member%@example.com')).order_by(User.id).limit(members)]
+    if not member_ids:
+        raise click.ClickException('No seeded members found; run "flask seed-data" first.')
+
+    scenarios = build_scenarios(include_writes=not read_only)
+    missing = unbenchmarked(current_app, build_scenarios())
+    if missing:
+        click.echo('Routes without a scenario: ' + ', '.join(f'{method} {endpoint}' for endpoint, method in missing))
+    if routes:
+        scenarios = [s for s in scenarios if s.name in routes]
+
+    # Every scenario hammers one route per member, far above the API rate limits
+    current_app.config['RATELIMIT_ENABLED'] = False
+    results = run_benchmark(current_app._get_current_object(), scenarios, member_ids, requests_per_route, threads)
+
+    click.echo(f'{"route":<28}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}  status')
+    for name, r in results.items():
+        click.echo(f'{name:<28}{r["throughput"]:>9.1f}{r["p50_ms"]:>9.2f}{r["p95_ms"]:>9.2f}'
+                   f'{r["p99_ms"]:>9.2f}{r["queries"]:>9.1f}  {",".join(map(str, r["statuses"]))}')
+
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        click.echo(f'Baseline written to {save_baseline}')
+
+    if baseline:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+        regressions = 0
+        click.echo(f'\nComparison with {baseline} (tolerance {tolerance:.0%})')
+        for name, metric, old, new, regressed in compare(results, baseline_results, tolerance):
+            regressions += regressed
+            marker = '  REGRESSION' if regressed else ''
+            click.echo(f'{name:<28}{metric:<9}{old:>10.2f} -> {new:>10.2f} ({(new - old) / max(old, 1e-9):+.0%}){marker}')
+        if regressions:
+            raise click.ClickException(f'{regressions} metric(s) regressed beyond tolerance')
@@ -0,0 +1,158 @@
+"""Memory benchmark for prefork workers.
+
+Starts gunicorn with gunicorn.conf.py once per mode and warms the workers
+with logged-in requests as seeded members (see seed.py), with a full
+collection every ``--collect-every`` requests as long-running workers would
+eventually do. Memory for the master and all its workers is read from
+/proc, so it runs on Linux only. RSS counts shared pages once per process. PSS splits them between the
+processes sharing them, and USS is what each worker alone holds:
+
+    flask seed-data --users 50 --years 1 --reset
+    python bench_workers.py --workers 8 --requests 800
+"""
+import argparse
+import http.cookiejar
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from seed import SEED_PASSWORD
+
+MODES = {
+    'fork': {'WSGI_PRELOAD': '0'},
+    'preload': {'WSGI_PRELOAD': '1', 'WSGI_GC_FREEZE': '0'},
+    'preload+freeze': {'WSGI_PRELOAD': '1', 'WSGI_GC_FREEZE': '1'},
+}
+ROUTES = ('/dashboard', '/workout_plans', '/nutrition_logs', '/progress_logs', '/leaderboard',
+          '/api/nutrition_chart_data?days=30', '/api/recommendations')
+
+
+def memory_kib(pid):
+    """(rss, pss, uss) in KiB from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Rss'], fields['Pss'], fields['Private_Clean'] + fields['Private_Dirty']
+
+
+def children(pid):
+    found = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces, so split after its closing parenthesis
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        found.append(int(entry))
+            except (OSError, IndexError):
+                continue
+    return found
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(process, base_url, workers, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'gunicorn exited with status {process.returncode}')
+        if len(children(process.pid)) >= workers:
+            try:
+                urllib.request.urlopen(base_url + '/', timeout=5).read()
+                return
+            except OSError:
+                pass
+        time.sleep(0.5)
+    raise SystemExit('Timed out waiting for workers')
+
+
+def member_session(base_url, email):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    data = urllib.parse.urlencode({'email': email, 'password': SEED_PASSWORD}).encode()
+    opener.open(base_url + '/', data=data, timeout=30).read()
+    return opener
+
+
+def warm(base_url, requests, threads, members):
+    def run(count):
+        opener = member_session(base_url, f'member{random.randrange(members)}@example.com')
+        for _ in range(count):
+            opener.open(base_url + random.choice(ROUTES), timeout=60).read()
+
+    # New connections land on whichever worker accepts first, so enough requests reach them all
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for future in [pool.submit(run, requests // threads) for _ in range(threads)]:
+            future.result()
+
+
+def measure(mode, args):
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(args.workers),
+               WSGI_GC_COLLECT_EVERY=str(args.collect_every), RATELIMIT_ENABLED='0', **MODES[mode])
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'], env=env,
+                               stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    try:
+        wait_ready(process, base_url, args.workers, args.timeout)
+        startup = time.perf_counter() - started
+        warm(base_url, args.requests, args.threads, args.members)
+        worker_pids = children(process.pid)
+        workers = [memory_kib(pid) for pid in worker_pids]
+        master = memory_kib(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+    return {
+        'startup': startup,
+        'workers': len(workers),
+        'rss': sum(w[0] for w in workers) / 1024,
+        'pss': (master[1] + sum(w[1] for w in workers)) / 1024,
+        'uss': sum(w[2] for w in workers) / len(workers) / 1024,
+        'master_rss': master[0] / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare worker memory with and without preload and gc.freeze()')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=800, help='Warm-up requests per mode')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent warm-up clients')
+    parser.add_argument('--members', type=int, default=10, help='Seeded members to log in as')
+    parser.add_argument('--mode', action='append', choices=list(MODES), help='Only these modes (repeatable)')
+    parser.add_argument('--collect-every', type=int, default=50,
+                        help='Full gc.collect() every N requests per worker, as long-running workers do (0 = never)')
+    parser.add_argument('--timeout', type=float, default=180, help='Seconds to wait for workers to boot')
+    parser.add_argument('--verbose', action='store_true', help='Show gunicorn logs')
+    args = parser.parse_args()
+
+    print(f'{"mode":<16}{"workers":>8}{"boot s":>8}{"RSS MiB":>10}{"PSS MiB":>10}{"USS/worker":>12}{"master RSS":>12}')
+    results = {}
+    for mode in args.mode or list(MODES):
+        r = results[mode] = measure(mode, args)
+        print(f'{mode:<16}{r["workers"]:>8}{r["startup"]:>8.1f}{r["rss"]:>10.0f}{r["pss"]:>10.0f}'
+              f'{r["uss"]:>12.1f}{r["master_rss"]:>12.0f}')
+
+    if 'fork' in results and len(results) > 1:
+        base = results['fork']
+        for mode, r in results.items():
+            if mode != 'fork':
+                print(f'{mode}: PSS {r["pss"] - base["pss"]:+.0f} MiB ({(r["pss"] - base["pss"]) / base["pss"]:+.0%}) vs fork')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""Calorie-burn estimates for workout plans.
+
+Expected burn uses the standard MET formula::
+
+    kcal = MET x body weight (kg) x hours
+
+Each plan's MET is the average of its exercises' METs, weighted by sets. The
+duration is the plan's own ``duration``, or an estimate from sets and reps
+when it is missing. ``User.weight`` is taken to be in kilograms, with
+``DEFAULT_WEIGHT_KG`` for members who have not set it.
+
+Estimates are computed in NumPy batches over many plans at once. Routes never
+estimate inline: they call ``schedule()`` and a background thread recomputes
+the queued plans. ``flask calories recompute --all`` re-estimates every plan
+after the MET table changes or user weights are updated.
+"""
+import json
+import logging
+import queue
+import re
+import threading
+import time
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import update
+
+from db import db
+import fragment_cache
+import leaderboard
+from models import Exercise, User, WorkoutPlan, workout_exercises
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHT_KG = 70.0
+DEFAULT_MET = 5.0
+DEFAULT_SETS = 3
+DEFAULT_REPS = 10
+SECONDS_PER_REP = 3
+REST_SECONDS_PER_SET = 60
+BATCH_SIZE = 5000
+
+# Compendium of Physical Activities values; name keywords are checked before muscle groups
+MET_TABLE = {
+    'names': {
+        'run': 9.8, 'jog': 7.0, 'sprint': 12.0, 'cycl': 7.5, 'bike': 7.5, 'row': 7.0,
+        'jump rope': 11.0, 'skip': 11.0, 'swim': 8.0, 'burpee': 8.0, 'hiit': 8.0,
+        'walk': 3.5, 'yoga': 2.5, 'stretch': 2.3, 'plank': 3.8, 'crunch': 3.8,
+        'squat': 5.0, 'deadlift': 6.0, 'lunge': 4.0, 'push-up': 3.8, 'pushup': 3.8,
+        'pull-up': 4.8, 'pullup': 4.8, 'bench': 5.0, 'press': 5.0, 'curl': 3.5,
+        'raise': 3.5, 'extension': 3.5, 'thrust': 5.0,
+    },
+    'muscle_groups': {
+        'cardio': 8.0, 'legs': 5.0, 'glutes': 5.0, 'hamstrings': 5.0, 'back': 5.0,
+        'chest': 5.0, 'shoulders': 4.0, 'arms': 3.5, 'core': 3.8,
+    },
+}
+
+
+def load_met_table(path=None):
+    """The built-in table, with overrides from a JSON file of the same shape."""
+    table = {key: dict(values) for key, values in MET_TABLE.items()}
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        for key in table:
+            table[key].update({k.lower(): float(v) for k, v in overrides.get(key, {}).items()})
+    return table
+
+
+def exercise_met(name, muscle_group, table):
+    name = (name or '').lower()
+    for keyword, met in table['names'].items():
+        if keyword in name:
+            return met
+    return table['muscle_groups'].get((muscle_group or '').lower(), DEFAULT_MET)
+
+
+def _parse_reps(reps):
+    # Reps is free text ("8", "8-12", "30s"); take the first number
+    match = re.search(r'\d+', reps or '')
+    return int(match.group()) if match else DEFAULT_REPS
+
+
+def estimate(durations, weights, link_plan_index, link_met, link_sets, link_reps):
+    """Vectorized estimate for a batch of plans.
+
+    ``durations`` (minutes, NaN when unknown) and ``weights`` (kg, NaN when
+    unknown) are per plan; the ``link_*`` arrays hold one entry per
+    plan-exercise link, with ``link_plan_index`` pointing into the plan arrays.
+    Returns whole kcal per plan.
+    """
+    n = len(durations)
+    weights = np.where(np.isnan(weights), DEFAULT_WEIGHT_KG, weights)
+
+    # Set-weighted MET per plan; plans without exercises use DEFAULT_MET
+    set_totals = np.bincount(link_plan_index, weights=link_sets, minlength=n)
+    met_totals = np.bincount(link_plan_index, weights=link_met * link_sets, minlength=n)
+    met = np.divide(met_totals, set_totals, out=np.full(n, DEFAULT_MET), where=set_totals > 0)
+
+    # Fill missing durations from the work and rest time of each exercise's sets
+    link_seconds = link_sets * (link_reps * SECONDS_PER_REP + REST_SECONDS_PER_SET)
+    estimated_minutes = np.bincount(link_plan_index, weights=link_seconds, minlength=n) / 60
+    durations = np.where(np.isnan(durations), estimated_minutes, durations)
+
+    return np.rint(met * weights * durations / 60).astype(np.int64)
+
+
+def recompute(plan_ids=None, table=None):
+    """Re-estimate calories for the given plans (all plans if None). Returns the count updated."""
+    table = table or load_met_table(current_app.config.get('MET_TABLE_PATH'))
+    met_cache = {}
+    updated = 0
+    touched_users = set()
+    scored_users = set()
+
+    if plan_ids is None:
+        plan_ids = [row.id for row in db.session.query(WorkoutPlan.id).order_by(WorkoutPlan.id)]
+    plan_ids = list(plan_ids)
+
+    for start in range(0, len(plan_ids), BATCH_SIZE):
+        batch = plan_ids[start:start + BATCH_SIZE]
+        plans = db.session.query(
+            WorkoutPlan.id, WorkoutPlan.duration, WorkoutPlan.created_by, WorkoutPlan.progress,
+            WorkoutPlan.calories, User.weight
+        ).outerjoin(User, User.id == WorkoutPlan.created_by).filter(WorkoutPlan.id.in_(batch)).all()
+        if not plans:
+            continue
+        index = {row.id: i for i, row in enumerate(plans)}
+
+        links = db.session.query(
+            workout_exercises.c.workout_id, Exercise.id, Exercise.name, Exercise.muscle_group,
+            Exercise.sets, Exercise.reps
+        ).join(Exercise, Exercise.id == workout_exercises.c.exercise_id).filter(
+            workout_exercises.c.workout_id.in_(batch)
+        ).all()
+
+        for link in links:
+            if link.id not in met_cache:
+                met_cache[link.id] = exercise_met(link.name, link.muscle_group, table)
+
+        calories = estimate(
+            np.array([np.nan if row.duration is None else row.duration for row in plans], dtype=np.float64),
+            np.array([np.nan if row.weight is None else row.weight for row in plans], dtype=np.float64),
+            np.array([index[link.workout_id] for link in links], dtype=np.int64),
+            np.array([met_cache[link.id] for link in links], dtype=np.float64),
+            np.array([link.sets or DEFAULT_SETS for link in links], dtype=np.float64),
+            np.array([_parse_reps(link.reps) for link in links], dtype=np.float64),
+        )
+
+        db.session.execute(update(WorkoutPlan), [
+            {'id': row.id, 'calories': int(kcal)} for row, kcal in zip(plans, calories)
+        ])
+        touched_users.update(row.created_by for row in plans if row.created_by is not None)
+        # Completed plans count on the calories leaderboard
+        scored_users.update(row.created_by for row, kcal in zip(plans, calories)
+                            if row.progress == 100 and row.created_by is not None and row.calories != int(kcal))
+        updated += len(plans)
+
+    for user_id in touched_users:
+        fragment_cache.invalidate(user_id, fragment_cache.WORKOUTS)
+    leaderboard.refresh_calories(scored_users)
+    db.session.commit()
+    return updated
+
+
+class CalorieRecomputer:
+    """Background thread that re-estimates plans queued by write routes."""
+
+    def __init__(self, app, debounce=1.0):
+        self.app = app
+        self.debounce = debounce
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def schedule(self, *plan_ids):
+        for plan_id in plan_ids:
+            self._queue.put(plan_id)
+        with self._lock:
+            # A thread that died without clearing itself (it never should) is replaced too
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='calorie-recompute', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                plan_ids = {self._queue.get(timeout=30)}
+            except queue.Empty:
+                # Idle. Exit under the lock, after a last look at the queue: schedule() enqueues before
+                # taking the lock, so it either sees the thread gone and starts one, or its ids are seen here
+                with self._lock:
+                    if not self._queue.empty():
+                        continue
+                    self._thread = None
+                    return
+            # Collect whatever else arrives shortly after, then recompute in one batch
+            time.sleep(self.debounce)
+            while True:
+                try:
+                    plan_ids.add(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.app.app_context():
+                try:
+                    recompute(plan_ids)
+                except Exception:
+                    logger.exception('Calorie recompute failed for plans %s', sorted(plan_ids))
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+
+
+def init_calorie_engine(app):
+    app.extensions['calorie_recomputer'] = CalorieRecomputer(app)
+    app.cli.add_command(calories_cli)
+
+
+def schedule(*plan_ids):
+    """Queue plans for background re-estimation; call after the plan is committed."""
+    current_app.extensions['calorie_recomputer'].schedule(*plan_ids)
+
+
+calories_cli = AppGroup('calories', help='Calorie-burn estimation for workout plans.')
+
+
+@calories_cli.command('recompute')
+@click.option('--all', 'all_plans', is_flag=True, help='Re-estimate every plan.')
+@click.option('--user', 'user_ids', type=int, multiple=True, help='Re-estimate this member\'s plans (repeatable).')
+@click.option('--missing', is_flag=True, help='Only plans without an estimate.')
+def recompute_command(all_plans, user_ids, missing):
+    """Re-estimate calories in batch, e.g. after editing the MET table."""
+    query = db.session.query(WorkoutPlan.id)
+    if user_ids:
+        query = query.filter(WorkoutPlan.created_by.in_(user_ids))
+    if missing:
+        query = query.filter(WorkoutPlan.calories.is_(None))
+    if not (all_plans or user_ids or missing):
+        raise click.UsageError('Pass --all, --missing or --user.')
+
+    started = time.perf_counter()
+    count = recompute([row.id for row in query.order_by(WorkoutPlan.id)])
+    click.echo(f'Re-estimated {count} plans in {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,43 @@
+"""Settings for create_app(); pick a class, or pass a dict of overrides."""
+import os
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///fitness_app.db'
+    SECRET_KEY = 'your_secret_key'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    POSE_WS_URL = os.getenv('POSE_WS_URL')  # e.g. ws://localhost:8765, see pose_server.py
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # Upper bound for pose batch uploads
+
+    # Request profiling, see profiling.py
+    PROFILE_ENABLED = os.getenv('PROFILE_ENABLED') == '1'
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.01))  # Fraction run under cProfile
+    PROFILE_SLOW_MS = float(os.getenv('PROFILE_SLOW_MS', 500))  # Always kept above this latency
+    PROFILE_MAX_CAPTURES = 200
+
+    # Nutrition and progress rows older than this move to compressed archive files, see archive.py
+    ARCHIVE_HORIZON_DAYS = int(os.getenv('ARCHIVE_HORIZON_DAYS', 730))
+
+    # Daily targets shown when logging meals and scored in the weekly reports, see reports.py
+    NUTRITION_GOALS = {'calories': 2000, 'protein': 150, 'carbs': 250, 'fats': 70}
+    REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', 0)) or None  # Render processes; None uses every CPU
+
+    # JSON API limits per member and endpoint as (tokens per second, burst), see ratelimit.py;
+    # pages outside /api/ are limited only when listed here
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', '1') != '0'
+    RATELIMIT_STORAGE = os.getenv('RATELIMIT_STORAGE', 'memory')  # 'file' shares buckets between workers
+    RATELIMIT_DEFAULT = (5, 30)
+    RATELIMIT_ENDPOINTS = {
+        'main.nutrition_chart_data': (1, 10),
+        'main.pose_session_frames': (20, 100),  # Batches stream in while recording
+        'main.export_nutrition_logs': (1 / 30, 3),  # A PDF of years of logs renders for seconds
+    }
+
+
+class ProductionConfig(Config):
+    """Used by wsgi.py; secrets and the database come from the environment."""
+    SECRET_KEY = os.getenv('SECRET_KEY', Config.SECRET_KEY)
+    # SQLite or PostgreSQL: upserts use INSERT ... ON CONFLICT (db.upsert); db-maint is SQLite-only
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', Config.SQLALCHEMY_DATABASE_URI)
+    LEADERBOARD_RECONCILE_INTERVAL = int(os.getenv('LEADERBOARD_RECONCILE_INTERVAL', 0)) or None
+    RATELIMIT_STORAGE = os.getenv('RATELIMIT_STORAGE', 'file')
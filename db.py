@@ -1,3 +1,14 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
 
 db = SQLAlchemy()
+
+
+def upsert(model):
+    """An INSERT supporting ``on_conflict_do_update`` for the database in use (SQLite or PostgreSQL)."""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    raise NotImplementedError(f'Upserts need SQLite or PostgreSQL, not {dialect}')
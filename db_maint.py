@@ -0,0 +1,254 @@
+"""SQLite maintenance: online backups, planner statistics, vacuum and integrity checks.
+
+    flask db-maint backup             # consistent copy while the app keeps writing
+    flask db-maint analyze            # PRAGMA optimize, sampled (or full ANALYZE with --full)
+    flask db-maint vacuum             # return free pages to the OS, a few at a time
+    flask db-maint integrity          # integrity_check and foreign_key_check
+    flask db-maint run --every 86400  # all of the above, e.g. nightly
+
+Backups use the SQLite online backup API and copy ``--pages`` pages per
+step. The source is only read-locked during a step, and between steps
+writers proceed normally. A write from another connection makes SQLite
+restart the copy. After ``--max-restarts`` restarts, the backup finishes in
+one step, which holds the read lock for the whole (short) copy.
+
+Incremental vacuum only works with ``auto_vacuum = INCREMENTAL``. Switching
+an existing database over needs one full VACUUM, which blocks while it runs:
+``flask db-maint vacuum --enable-incremental``.
+
+Every step prints its timing. ``run`` can loop with ``--every`` when there is
+no cron.
+"""
+import glob
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from db import db
+
+BUSY_TIMEOUT_MS = 5000
+
+
+def database_path():
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise click.ClickException('db-maint only supports file-based SQLite databases.')
+    return url.database
+
+
+def connect(path):
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    return connection
+
+
+@contextmanager
+def timed(step):
+    """Echo the step's timing, plus any detail the body adds to the yielded dict."""
+    report = {}
+    started = time.perf_counter()
+    try:
+        yield report
+    finally:
+        detail = ', '.join(f'{key} {value}' for key, value in report.items())
+        click.echo(f'{step:<12}{time.perf_counter() - started:>9.3f}s  {detail}')
+
+
+def backup(path, destination, pages=256, sleep=0.005, max_restarts=5):
+    """Copy the live database to ``destination``; returns (pages copied, steps, restarts)."""
+    source = connect(path)
+    target = sqlite3.connect(destination)
+    progress = {'steps': 0, 'restarts': 0, 'remaining': None, 'total': 0}
+
+    class TooManyRestarts(Exception):
+        pass
+
+    def on_progress(status, remaining, total):
+        progress['steps'] += 1
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1  # Another connection wrote to the source
+            if progress['restarts'] > max_restarts:
+                raise TooManyRestarts
+        progress['remaining'] = remaining
+        progress['total'] = total
+
+    try:
+        try:
+            source.backup(target, pages=pages, progress=on_progress, sleep=sleep)
+        except TooManyRestarts:
+            source.backup(target, pages=-1)
+            progress['steps'] += 1
+        (result,) = target.execute('PRAGMA quick_check').fetchone()
+        if result != 'ok':
+            raise click.ClickException(f'Backup failed quick_check: {result}')
+    finally:
+        target.close()
+        source.close()
+    return progress['total'], progress['steps'], progress['restarts']
+
+
+def rotate(directory, stem, keep):
+    backups = sorted(glob.glob(os.path.join(directory, f'{stem}-*.db')))
+    expired = backups[:max(len(backups) - keep, 0)]
+    for old in expired:
+        os.remove(old)
+    return len(expired)
+
+
+def run_backup(directory, pages, sleep, keep, max_restarts):
+    path = database_path()
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    destination = os.path.join(directory, f'{stem}-{datetime.now():%Y%m%d-%H%M%S}.db')
+    with timed('backup') as report:
+        # Written under a temporary name so a partial file never counts as a backup
+        copied, steps, restarts = backup(path, destination + '.part', pages, sleep, max_restarts)
+        os.replace(destination + '.part', destination)
+        report.update({'pages': copied, 'steps': steps, 'restarts': restarts,
+                       'size': f'{os.path.getsize(destination) / 1024 / 1024:.1f} MiB',
+                       'removed': rotate(directory, stem, keep), 'file': destination})
+    return destination
+
+
+def run_analyze(full=False):
+    connection = connect(database_path())
+    try:
+        with timed('analyze' if full else 'optimize') as report:
+            if not full:
+                # Bounded per-index sampling, so the run stays quick on large tables
+                connection.execute('PRAGMA analysis_limit = 1000')
+            if full:
+                connection.execute('ANALYZE')
+            elif sqlite3.sqlite_version_info >= (3, 46):
+                connection.execute('PRAGMA optimize = 0x10002')  # Every table, not just ones this connection used
+            else:
+                # Older optimize only considers tables this (brand new) connection has queried
+                connection.execute('ANALYZE')
+            has_stats = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+            report['stat_rows'] = connection.execute('SELECT count(*) FROM sqlite_stat1').fetchone()[0] if has_stats else 0
+    finally:
+        connection.close()
+
+
+def run_vacuum(pages=None, enable_incremental=False):
+    connection = connect(database_path())
+    try:
+        mode = connection.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2:
+            if not enable_incremental:
+                with timed('vacuum') as report:
+                    report['skipped'] = 'auto_vacuum is not INCREMENTAL (use --enable-incremental once)'
+                return
+            with timed('vacuum-full') as report:
+                connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                connection.execute('VACUUM')
+                report['auto_vacuum'] = 'INCREMENTAL'
+            return
+
+        with timed('vacuum') as report:
+            free_before = connection.execute('PRAGMA freelist_count').fetchone()[0]
+            # Each call frees up to ``pages`` pages in its own short write transaction
+            connection.execute(f'PRAGMA incremental_vacuum({int(pages)})' if pages else 'PRAGMA incremental_vacuum').fetchall()
+            free_after = connection.execute('PRAGMA freelist_count').fetchone()[0]
+            page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+            report.update({'freed_pages': free_before - free_after,
+                           'freed': f'{(free_before - free_after) * page_size / 1024:.0f} KiB',
+                           'free_pages_left': free_after})
+    finally:
+        connection.close()
+
+
+def run_integrity(quick=False):
+    """Returns the list of problems found (empty when the database is healthy)."""
+    connection = connect(database_path())
+    try:
+        with timed('quick_check' if quick else 'integrity') as report:
+            rows = [row[0] for row in connection.execute('PRAGMA quick_check' if quick else 'PRAGMA integrity_check')]
+            problems = [] if rows == ['ok'] else rows
+            problems += [f'foreign key: {table} row {rowid} -> {parent}'
+                         for table, rowid, parent, _ in connection.execute('PRAGMA foreign_key_check')]
+            report['result'] = 'ok' if not problems else f'{len(problems)} problems'
+    finally:
+        connection.close()
+    for problem in problems[:50]:
+        click.echo(f'  {problem}', err=True)
+    return problems
+
+
+def _backup_dir():
+    return current_app.config.get('DB_BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups')
+
+
+db_maint_cli = AppGroup('db-maint', help='SQLite backup and maintenance.')
+
+backup_options = [
+    click.option('--dest', 'directory', type=click.Path(file_okay=False), help='Backup directory.'),
+    click.option('--pages', default=256, show_default=True, help='Pages copied per step.'),
+    click.option('--sleep', default=0.005, show_default=True, help='Seconds between steps, for writers.'),
+    click.option('--keep', default=7, show_default=True, help='Backups to keep.'),
+    click.option('--max-restarts', default=5, show_default=True,
+                 help='Restarts caused by writes before finishing in one step.'),
+]
+
+
+def _with_backup_options(f):
+    for option in reversed(backup_options):
+        f = option(f)
+    return f
+
+
+@db_maint_cli.command('backup')
+@_with_backup_options
+def backup_command(directory, pages, sleep, keep, max_restarts):
+    """Online backup through the SQLite backup API."""
+    run_backup(directory or _backup_dir(), pages, sleep, keep, max_restarts)
+
+
+@db_maint_cli.command('analyze')
+@click.option('--full', is_flag=True, help='Full ANALYZE instead of PRAGMA optimize.')
+def analyze_command(full):
+    """Refresh the query planner's statistics."""
+    run_analyze(full)
+
+
+@db_maint_cli.command('vacuum')
+@click.option('--pages', type=int, help='Free at most this many pages (default: all free pages).')
+@click.option('--enable-incremental', is_flag=True, help='Switch to auto_vacuum=INCREMENTAL with one full VACUUM.')
+def vacuum_command(pages, enable_incremental):
+    """Incremental vacuum of free pages."""
+    run_vacuum(pages, enable_incremental)
+
+
+@db_maint_cli.command('integrity')
+@click.option('--quick', is_flag=True, help='quick_check instead of the full integrity_check.')
+def integrity_command(quick):
+    """Check the database file and foreign keys."""
+    if run_integrity(quick):
+        raise click.ClickException('Integrity check failed')
+
+
+@db_maint_cli.command('run')
+@_with_backup_options
+@click.option('--vacuum-pages', type=int, default=1000, show_default=True, help='Pages freed per run.')
+@click.option('--every', type=float, help='Repeat every N seconds instead of running once.')
+def run_command(directory, pages, sleep, keep, max_restarts, vacuum_pages, every):
+    """Integrity check, statistics, vacuum and backup, in that order."""
+    while True:
+        started = time.perf_counter()
+        click.echo(f'db-maint run at {datetime.now():%Y-%m-%d %H:%M:%S}')
+        if run_integrity(quick=True):
+            # Never rotate a good backup out in favour of a copy of a damaged file
+            raise click.ClickException('Integrity check failed; skipping vacuum and backup')
+        run_analyze()
+        run_vacuum(vacuum_pages)
+        run_backup(directory or _backup_dir(), pages, sleep, keep, max_restarts)
+        click.echo(f'{"total":<12}{time.perf_counter() - started:>9.3f}s')
+        if not every:
+            return
+        time.sleep(max(every - (time.perf_counter() - started), 0))
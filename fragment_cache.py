@@ -0,0 +1,150 @@
+"""Fragment caching for server-rendered templates.
+
+Templates wrap expensive widgets in a cache block::
+
+    {% cache 'recent_workouts', 600, 'workouts' %}
+        {% set recent_workouts = load_recent_workouts() %}
+        ...
+    {% endcache %}
+
+The first argument is the fragment key (any hashable value, e.g. a tuple
+including request filters), the second the TTL in seconds, and the optional
+third the data scope(s) the fragment depends on. The cache key always
+includes the current user and that user's data version for each scope, so a
+write route only has to call ``invalidate(user_id, scope)`` and every
+fragment built from the old data stops matching.
+
+Fragments live in a per-process LRU. Data versions live in the database,
+so every worker sees an invalidation as soon as the write commits.
+Loaders are passed to templates as callables and only run on a miss, so a
+cached widget costs no queries either.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from db import db, upsert
+from models import DataVersion
+
+# Data scopes that write routes invalidate
+NUTRITION = 'nutrition'
+PROGRESS = 'progress'
+WORKOUTS = 'workouts'
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments with per-entry expiry."""
+
+    def __init__(self, max_entries=4096, default_ttl=300):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def data_versions(user_id):
+    # One small indexed query per request, shared by every fragment on the page
+    cache = g.setdefault('_data_versions', {})
+    if user_id not in cache:
+        cache[user_id] = dict(
+            db.session.query(DataVersion.scope, DataVersion.version).filter_by(user_id=user_id).all()
+        )
+    return cache[user_id]
+
+
+def invalidate(user_id, *scopes):
+    """Bump the user's data version for each scope; committed with the caller's transaction."""
+    for scope in scopes:
+        stmt = upsert(DataVersion).values(user_id=user_id, scope=scope, version=1)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[DataVersion.user_id, DataVersion.scope],
+            set_={'version': DataVersion.version + 1}
+        ))
+    g.pop('_data_versions', None)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        for _ in range(2):  # Optional ttl and scopes
+            if parser.stream.skip_if('comma'):
+                args.append(parser.parse_expression())
+            else:
+                args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.ContextReference()] + args), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, context, key, ttl, scopes, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        user = context.get('current_user')
+        user_id = user.id if user is not None and user.is_authenticated else None
+        versions = data_versions(user_id) if user_id is not None else {}
+        if scopes is None:
+            version_key = tuple(sorted(versions.items()))
+        else:
+            scopes = (scopes,) if isinstance(scopes, str) else tuple(scopes)
+            version_key = tuple(versions.get(scope, 0) for scope in scopes)
+
+        cache_key = (context.name, key, user_id, version_key)
+        html = cache.get(cache_key)
+        if html is None:
+            html = str(caller())
+            cache.set(cache_key, html, ttl)
+        return Markup(html)
+
+
+def init_fragment_cache(app):
+    """Install the {% cache %} tag and precompile every template."""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config.get('FRAGMENT_CACHE_ENABLED', True):
+        app.jinja_env.fragment_cache = FragmentCache(
+            max_entries=app.config.get('FRAGMENT_CACHE_MAX_ENTRIES', 4096),
+            default_ttl=app.config.get('FRAGMENT_CACHE_DEFAULT_TTL', 300)
+        )
+
+    # Compile all templates now instead of on each first request
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
@@ -0,0 +1,37 @@
+"""gunicorn settings for wsgi.py; see its docstring.
+
+WSGI_PRELOAD=0 and WSGI_GC_FREEZE=0 switch off preloading and freezing, which
+is how bench_workers.py measures the baseline.
+"""
+import gc
+import os
+
+bind = os.getenv('BIND', '127.0.0.1:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', 8))
+wsgi_app = 'wsgi:application'
+preload_app = os.getenv('WSGI_PRELOAD', '1') != '0'
+gc_freeze = preload_app and os.getenv('WSGI_GC_FREEZE', '1') != '0'
+
+# Full collection every N requests per worker; bench_workers.py uses it to
+# reach the state a long-running worker gets to on its own
+gc_collect_every = int(os.getenv('WSGI_GC_COLLECT_EVERY', 0))
+
+
+def pre_fork(server, worker):
+    # Objects from the preload move to the permanent generation, so collections
+    # in workers never write to their headers and the pages stay shared
+    if gc_freeze:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    # Threads do not survive a fork, so each worker starts its own; with
+    # WSGI_PRELOAD=0 this import is where the worker loads the app
+    import leaderboard
+    import wsgi
+    leaderboard.start_reconciler(wsgi.application)
+
+
+def post_request(worker, req, environ, resp):
+    if gc_collect_every and worker.nr % gc_collect_every == 0:
+        gc.collect()
@@ -0,0 +1,357 @@
+"""Gym-wide streak and calories-burned leaderboards.
+
+Scores are kept in the ``LeaderboardScore`` table and mirrored in memory as
+one ``SortedList`` per board, so top-N and "my rank" queries take logarithmic
+time instead of aggregating ``WorkoutPlan`` for every member on each view.
+
+* When a workout reaches ``progress == 100``, ``record_completion()`` updates
+  that member's rows: the plan's calories are added, and the streak is
+  recomputed from the member's own completed days. The calories are added in
+  SQL, so completions in concurrent workers do not overwrite each other. When calorie_engine.py
+  re-estimates completed plans, ``refresh_calories()`` recomputes their
+  owners' totals.
+* Score changes reach this process's in-memory boards only once the
+  transaction writing them commits; a rollback leaves the boards untouched.
+* Each worker process keeps its own sorted copy. Before answering, it pulls
+  rows changed since its last sync (``updated_at`` is indexed), at most once
+  per ``SYNC_INTERVAL``. ``updated_at`` is stamped before commit, so a row
+  committed long after it was stamped can slip under the watermark; a full
+  reload every ``RELOAD_INTERVAL`` bounds how long such a score stays stale.
+* ``reconcile()`` rebuilds every score from ``WorkoutPlan``. It runs from
+  ``flask leaderboard reconcile`` (e.g. nightly from cron) and optionally every
+  ``LEADERBOARD_RECONCILE_INTERVAL`` seconds in-process. Scores that no
+  longer exist are not deleted but set to 0 with a fresh ``updated_at``, so
+  the other workers' syncs see them go.
+
+A streak counts consecutive days with a completed workout, ending today or
+yesterday, so it does not drop to zero before today's session.
+"""
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from itertools import groupby
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sortedcontainers import SortedList
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from db import db, upsert
+from models import LeaderboardScore, User, WorkoutPlan
+
+logger = logging.getLogger(__name__)
+
+STREAK = 'streak'
+CALORIES = 'calories'
+BOARDS = (STREAK, CALORIES)
+
+SYNC_INTERVAL = 1.0
+SYNC_OVERLAP = timedelta(seconds=2)  # Re-read recent rows in case of commits with equal timestamps
+RELOAD_INTERVAL = 60.0  # Full reload, for rows committed more than SYNC_OVERLAP after their updated_at
+
+
+class Board:
+    """Scores for one board, ordered by (-score, user_id)."""
+
+    def __init__(self):
+        self._sorted = SortedList()
+        self._scores = {}
+
+    def set(self, user_id, score):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._sorted.remove((-old, user_id))
+        if score > 0:
+            self._scores[user_id] = score
+            self._sorted.add((-score, user_id))
+
+    def score(self, user_id):
+        return self._scores.get(user_id, 0)
+
+    def rank(self, user_id):
+        # Competition ranking: 1 + number of members with a strictly higher score
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self._sorted.bisect_left((-score, -1)) + 1
+
+    def top(self, limit):
+        return [(user_id, -negative) for negative, user_id in self._sorted.islice(0, limit)]
+
+    def __len__(self):
+        return len(self._sorted)
+
+
+def _effective_streak(streak, last_date, today):
+    return streak if last_date is not None and last_date >= today - timedelta(days=1) else 0
+
+
+class Leaderboards:
+    def __init__(self):
+        self.boards = {board: Board() for board in BOARDS}
+        self._last_dates = {}  # user_id -> last completed day, for expiring streaks
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._watermark = None
+        self._last_sync = 0.0
+        self._last_load = 0.0
+        self._day = None
+
+    def _apply(self, board, user_id, score, last_date, today):
+        if board == STREAK:
+            self._last_dates[user_id] = (score, last_date)
+            score = _effective_streak(score, last_date, today)
+        self.boards[board].set(user_id, score)
+
+    def _apply_rows(self, rows, today):
+        for row in rows:
+            self._apply(row.board, row.user_id, row.score, row.last_date, today)
+            if self._watermark is None or row.updated_at > self._watermark:
+                self._watermark = row.updated_at
+
+    def refresh(self, force=False):
+        """Load or sync from the score table, and expire broken streaks at day rollover."""
+        today = date.today()
+        with self._lock:
+            if not self._loaded or force or time.monotonic() - self._last_load >= RELOAD_INTERVAL:
+                self.boards = {board: Board() for board in BOARDS}
+                self._last_dates = {}
+                self._watermark = None
+                self._apply_rows(LeaderboardScore.query.all(), today)
+                self._loaded = True
+                self._last_sync = self._last_load = time.monotonic()
+                self._day = today
+                return
+
+            if time.monotonic() - self._last_sync >= SYNC_INTERVAL:
+                query = LeaderboardScore.query
+                if self._watermark is not None:
+                    query = query.filter(LeaderboardScore.updated_at >= self._watermark - SYNC_OVERLAP)
+                self._apply_rows(query.all(), today)
+                self._last_sync = time.monotonic()
+
+            if self._day != today:
+                # Once a day: streaks whose last workout is now too old drop out
+                for user_id, (streak, last_date) in list(self._last_dates.items()):
+                    self.boards[STREAK].set(user_id, _effective_streak(streak, last_date, today))
+                self._day = today
+
+    def top(self, board, limit=10):
+        self.refresh()
+        with self._lock:
+            return self.boards[board].top(limit)
+
+    def standing(self, board, user_id):
+        self.refresh()
+        with self._lock:
+            return self.boards[board].rank(user_id), self.boards[board].score(user_id)
+
+    def update(self, board, user_id, score, last_date=None):
+        with self._lock:
+            self._apply(board, user_id, score, last_date, date.today())
+
+
+def _defer_update(board, user_id, score, last_date=None):
+    # Applied to the in-memory boards by _apply_pending once the transaction commits
+    pending = db.session.info.setdefault('leaderboard_updates', [])
+    pending.append((current_app.extensions['leaderboards'], board, user_id, score, last_date))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_pending(session):
+    for leaderboards, board, user_id, score, last_date in session.info.pop('leaderboard_updates', ()):
+        leaderboards.update(board, user_id, score, last_date)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop('leaderboard_updates', None)
+
+
+def _store(board, user_id, score, last_date=None):
+    stmt = upsert(LeaderboardScore).values(
+        board=board, user_id=user_id, score=score, last_date=last_date, updated_at=datetime.utcnow()
+    )
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[LeaderboardScore.board, LeaderboardScore.user_id],
+        set_={'score': stmt.excluded.score, 'last_date': stmt.excluded.last_date,
+              'updated_at': stmt.excluded.updated_at}
+    ))
+
+
+def _streak_from_days(days, today):
+    # days: distinct completed days, most recent first
+    streak = 0
+    last_date = None
+    expected = None
+    for day in days:
+        if expected is None:
+            if day < today - timedelta(days=1):
+                break
+            last_date = expected = day
+        if day != expected:
+            break
+        streak += 1
+        expected -= timedelta(days=1)
+    return streak, last_date
+
+
+def user_streak(user_id, today=None):
+    today = today or date.today()
+    days = db.session.query(WorkoutPlan.date).filter(
+        WorkoutPlan.created_by == user_id,
+        WorkoutPlan.progress == 100,
+        WorkoutPlan.date <= today
+    ).distinct().order_by(WorkoutPlan.date.desc())
+    return _streak_from_days((row.date for row in days), today)
+
+
+def record_completion(plan):
+    """Update the plan owner's scores; call before committing the plan's progress == 100."""
+    user_id = plan.created_by
+    db.session.flush()
+
+    # Added in the UPDATE itself: a read-then-write would lose one of two concurrent completions
+    stmt = upsert(LeaderboardScore).values(
+        board=CALORIES, user_id=user_id, score=plan.calories or 0, updated_at=datetime.utcnow()
+    )
+    calories = db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[LeaderboardScore.board, LeaderboardScore.user_id],
+        set_={'score': LeaderboardScore.score + stmt.excluded.score, 'updated_at': stmt.excluded.updated_at}
+    ).returning(LeaderboardScore.score)).scalar_one()
+    streak, last_date = user_streak(user_id)
+    _store(STREAK, user_id, streak, last_date)
+    _defer_update(CALORIES, user_id, calories)
+    _defer_update(STREAK, user_id, streak, last_date)
+
+
+def refresh_calories(user_ids):
+    """Recompute the members' calorie totals, e.g. after their completed plans were re-estimated.
+
+    Like record_completion(), this writes in the caller's transaction.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    totals = dict(db.session.query(
+        WorkoutPlan.created_by, func.sum(func.coalesce(WorkoutPlan.calories, 0))
+    ).filter(WorkoutPlan.progress == 100, WorkoutPlan.created_by.in_(user_ids)).group_by(WorkoutPlan.created_by))
+    for user_id in user_ids:
+        calories = int(totals.get(user_id) or 0)
+        _store(CALORIES, user_id, calories)
+        _defer_update(CALORIES, user_id, calories)
+
+
+def reconcile(today=None):
+    """Recompute every score from WorkoutPlan. Returns the number of scores that had drifted."""
+    today = today or date.today()
+    fresh = {}
+
+    calories = db.session.query(
+        WorkoutPlan.created_by, func.sum(func.coalesce(WorkoutPlan.calories, 0))
+    ).filter(WorkoutPlan.progress == 100, WorkoutPlan.created_by.isnot(None)).group_by(WorkoutPlan.created_by)
+    for user_id, total in calories:
+        fresh[(CALORIES, user_id)] = (int(total), None)
+
+    # Only members who completed a workout today or yesterday can have a live streak
+    active = db.session.query(WorkoutPlan.created_by).filter(
+        WorkoutPlan.progress == 100,
+        WorkoutPlan.date <= today,
+        WorkoutPlan.date >= today - timedelta(days=1)
+    )
+    completed_days = db.session.query(WorkoutPlan.created_by, WorkoutPlan.date).filter(
+        WorkoutPlan.progress == 100,
+        WorkoutPlan.date <= today,
+        WorkoutPlan.created_by.in_(active)
+    ).distinct().order_by(WorkoutPlan.created_by, WorkoutPlan.date.desc())
+    for user_id, days in groupby(completed_days, key=lambda row: row.created_by):
+        fresh[(STREAK, user_id)] = _streak_from_days((row.date for row in days), today)
+
+    existing = {(row.board, row.user_id): (row.score, row.last_date) for row in LeaderboardScore.query.all()}
+    drifted = sum(1 for key in fresh.keys() | existing.keys()
+                  if fresh.get(key, (0, None))[0] != existing.get(key, (0, None))[0])
+
+    # Only changed rows are written. Vanished scores become 0 rather than being deleted, so their
+    # updated_at moves past every worker's watermark and the next sync removes them everywhere
+    now = datetime.utcnow()
+    changed = [
+        {'board': board, 'user_id': user_id, 'score': score, 'last_date': last_date, 'updated_at': now}
+        for (board, user_id), (score, last_date) in (
+            (key, fresh.get(key, (0, None))) for key in fresh.keys() | existing.keys()
+        ) if (score, last_date) != existing.get((board, user_id))
+    ]
+    if changed:
+        stmt = upsert(LeaderboardScore)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[LeaderboardScore.board, LeaderboardScore.user_id],
+            set_={column: stmt.excluded[column] for column in ('score', 'last_date', 'updated_at')}
+        ), changed)
+    db.session.commit()
+    current_app.extensions['leaderboards'].refresh(force=True)
+    return drifted
+
+
+def leaderboard_entries(board, limit=10):
+    """Top entries with member names, for templates and the JSON API."""
+    top = current_app.extensions['leaderboards'].top(board, limit)
+    names = dict(db.session.query(User.id, User.name).filter(User.id.in_([user_id for user_id, _ in top])))
+    entries = []
+    rank = 0
+    previous = None
+    for position, (user_id, score) in enumerate(top, start=1):
+        if score != previous:
+            rank, previous = position, score
+        entries.append({'rank': rank, 'user_id': user_id, 'name': names.get(user_id), 'score': score})
+    return entries
+
+
+def my_standing(board, user_id):
+    rank, score = current_app.extensions['leaderboards'].standing(board, user_id)
+    return {'rank': rank, 'score': score}
+
+
+def _reconcile_periodically(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                drifted = reconcile()
+                if drifted:
+                    logger.info('Leaderboard reconcile corrected %d scores', drifted)
+            except Exception:
+                logger.exception('Leaderboard reconcile failed')
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def start_reconciler(app):
+    """Reconcile every LEADERBOARD_RECONCILE_INTERVAL seconds in a thread of this process.
+
+    Called per worker by gunicorn.conf.py's post_fork hook: a thread started in
+    a preloading master would not survive the fork.
+    """
+    interval = app.config.get('LEADERBOARD_RECONCILE_INTERVAL')
+    if interval:
+        threading.Thread(target=_reconcile_periodically, args=(app, interval),
+                         name='leaderboard-reconcile', daemon=True).start()
+
+
+def init_leaderboards(app):
+    app.extensions['leaderboards'] = Leaderboards()
+    app.cli.add_command(leaderboard_cli)
+
+
+leaderboard_cli = AppGroup('leaderboard', help='Gym-wide leaderboards.')
+
+
+@leaderboard_cli.command('reconcile')
+def reconcile_command():
+    """Rebuild leaderboard scores from workout history."""
+    started = time.perf_counter()
+    drifted = reconcile()
+    click.echo(f'Reconciled leaderboards in {time.perf_counter() - started:.2f}s; {drifted} scores corrected')
@@ -37,9 +37,17 @@ class WorkoutPlan(db.Model):
     date = db.Column(db.Date, nullable=True)  # Add date field for scheduling workouts
     progress = db.Column(db.Integer, default=0)  # Add progress field (0-100)
     calories = db.Column(db.Integer, nullable=True)  # Add calories field
+    # Recurring plans: RRULE subset starting at ``date``, e.g. FREQ=WEEKLY;BYDAY=MO;COUNT=12 (see schedule.py)
+    recurrence = db.Column(db.String(100), nullable=True)
+    # Occurrences of a recurring plan that were completed or moved are stored as their own plans
+    series_id = db.Column(db.Integer, db.ForeignKey('workout_plan.id'), nullable=True, index=True)
+    series_date = db.Column(db.Date, nullable=True)  # The occurrence's date in the series
+    ends_on = db.Column(db.Date, nullable=True)  # Last day the plan appears on the calendar
 
     exercises = db.relationship('Exercise', secondary=workout_exercises, backref='plans')
 
+    __table_args__ = (db.Index('ix_workout_plan_calendar', 'created_by', 'ends_on'),)
+
 
 class Exercise(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -71,4 +79,91 @@ class Progress(db.Model):
     date = db.Column(db.Date)
     weight = db.Column(db.Float)
     body_fat_percentage = db.Column(db.Float)
-    notes = db.Column(db.Text)
\ No newline at end of file
+    notes = db.Column(db.Text)
+
+
+class PoseSession(db.Model):
+    # Index row for a recorded pose session; landmark data lives on disk (see pose_store.py)
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    exercise = db.Column(db.String(50))
+    dtype = db.Column(db.String(10), default='float16')  # 'float16' or 'float32'
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    num_frames = db.Column(db.Integer, default=0)
+    duration_ms = db.Column(db.Integer, default=0)
+
+    chunks = db.relationship('PoseChunk', backref='session', lazy=True,
+                             order_by='PoseChunk.frame_offset', cascade='all, delete-orphan')
+
+
+class PoseChunk(db.Model):
+    # One uploaded batch of frames: where it sits in the session file and the time span it covers
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('pose_session.id'), nullable=False)
+    frame_offset = db.Column(db.Integer, nullable=False)
+    num_frames = db.Column(db.Integer, nullable=False)
+    start_ms = db.Column(db.Integer, nullable=False)
+    end_ms = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (db.Index('ix_pose_chunk_session_time', 'session_id', 'start_ms', 'end_ms'),)
+
+
+class DataVersion(db.Model):
+    # Per-user change counter for each data scope; keys the template fragment cache
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    scope = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LeaderboardScore(db.Model):
+    # Persisted leaderboard score per board and member (see leaderboard.py)
+    board = db.Column(db.String(20), primary_key=True)  # 'streak' or 'calories'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    score = db.Column(db.Integer, nullable=False, default=0)
+    last_date = db.Column(db.Date, nullable=True)  # Last completed workout day, for streaks
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class NutritionRollup(db.Model):
+    # Daily per-meal totals of NutritionLog rows moved to the archive (see archive.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    meal = db.Column(db.String(100), primary_key=True)  # '' for entries without a meal
+    calories = db.Column(db.Float, nullable=False, default=0)
+    protein = db.Column(db.Float, nullable=False, default=0)
+    carbs = db.Column(db.Float, nullable=False, default=0)
+    fats = db.Column(db.Float, nullable=False, default=0)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ProgressRollup(db.Model):
+    # Daily sums of archived Progress rows; averages are sum / count
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    weight_sum = db.Column(db.Float, nullable=False, default=0)
+    weight_count = db.Column(db.Integer, nullable=False, default=0)
+    body_fat_sum = db.Column(db.Float, nullable=False, default=0)
+    body_fat_count = db.Column(db.Integer, nullable=False, default=0)
+    entries = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ArchiveSegment(db.Model):
+    # One compressed archive file per kind, member and year; only its first ``rows`` rows are committed
+    kind = db.Column(db.String(20), primary_key=True)  # 'nutrition' or 'progress'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    first_date = db.Column(db.Date)
+    last_date = db.Column(db.Date)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class WeeklyReport(db.Model):
+    # A generated weekly report per member, week and format; the file is in the content-addressed store (see reports.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)  # Monday
+    format = db.Column(db.String(10), primary_key=True)  # 'html' or 'pdf'
+    digest = db.Column(db.String(64), nullable=False, index=True)  # sha256 of the file
+    source_digest = db.Column(db.String(64), nullable=False)  # sha256 of the report data; unchanged weeks are skipped
+    size = db.Column(db.Integer, nullable=False, default=0)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
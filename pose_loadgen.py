@@ -0,0 +1,101 @@
+"""Local load generator for pose_server.py.
+
+Simulates N concurrent camera clients streaming landmark packets at a fixed
+frame rate and reports feedback latency percentiles and drop counts:
+
+    python pose_server.py --workers 4 &
+    python pose_loadgen.py --clients 50 --fps 30 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+
+import numpy as np
+import websockets
+
+from pose_rules import LANDMARK_FIELDS, NUM_LANDMARKS
+from pose_server import encode_landmarks, make_ws_token
+
+
+def synthetic_squat(t, rng):
+    # Standing pose whose knee bends and straightens once every two seconds
+    landmarks = rng.uniform(0.3, 0.7, size=(NUM_LANDMARKS, LANDMARK_FIELDS)).astype(np.float32)
+    landmarks[:, 3] = 1.0
+    bend = (1 - math.cos(math.pi * t)) / 2
+    landmarks[12, :2] = (0.5, 0.2)                       # Shoulder
+    landmarks[24, :2] = (0.5, 0.5)                       # Hip
+    landmarks[26, :2] = (0.5 + 0.2 * bend, 0.7 - 0.1 * bend)  # Knee
+    landmarks[28, :2] = (0.5, 0.9)                       # Ankle
+    landmarks[32, :2] = (0.6, 0.9)                       # Foot index
+    return landmarks
+
+
+async def run_client(url, token, fps, duration, latencies, stats, float16, compress):
+    rng = np.random.default_rng()
+    async with websockets.connect(url, max_size=None) as websocket:
+        await websocket.send(json.dumps({'type': 'hello', 'token': token, 'exercise': 'squat'}))
+
+        async def receive():
+            async for message in websocket:
+                reply = json.loads(message)
+                if 'sent_at' in reply:
+                    latencies.append(time.time() - reply['sent_at'])
+                    stats['received'] += 1
+
+        receiver = asyncio.ensure_future(receive())
+        start = time.monotonic()
+        seq = 0
+        interval = 1.0 / fps
+        while time.monotonic() - start < duration:
+            t = time.monotonic() - start
+            await websocket.send(encode_landmarks(synthetic_squat(t, rng), seq,
+                                                  float16=float16, compress=compress))
+            stats['sent'] += 1
+            seq += 1
+            await asyncio.sleep(max(0.0, start + seq * interval - time.monotonic()))
+
+        # Give in-flight feedback a moment to arrive
+        await asyncio.sleep(0.5)
+        receiver.cancel()
+
+
+async def run(args):
+    token = make_ws_token(os.getenv('SECRET_KEY', 'your_secret_key'), 0, 'user')
+    latencies = []
+    stats = {'sent': 0, 'received': 0}
+    await asyncio.gather(*(
+        run_client(args.url, token, args.fps, args.duration, latencies, stats, args.float16, args.compress)
+        for _ in range(args.clients)
+    ))
+    return latencies, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the pose feedback server')
+    parser.add_argument('--url', default='ws://127.0.0.1:8765')
+    parser.add_argument('--clients', type=int, default=10)
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--float16', action='store_true', help='send float16 landmarks')
+    parser.add_argument('--compress', action='store_true', help='zlib-compress packets')
+    args = parser.parse_args()
+
+    latencies, stats = asyncio.run(run(args))
+    if not latencies:
+        print('No feedback received.')
+        return
+
+    latencies_ms = np.array(latencies) * 1000
+    dropped = stats['sent'] - stats['received']
+    print(f"clients={args.clients} fps={args.fps} duration={args.duration}s")
+    print(f"sent={stats['sent']} feedback={stats['received']} "
+          f"dropped={dropped} ({100.0 * dropped / max(stats['sent'], 1):.1f}%)")
+    print(f"latency p50={np.percentile(latencies_ms, 50):.1f}ms "
+          f"p99={np.percentile(latencies_ms, 99):.1f}ms max={latencies_ms.max():.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
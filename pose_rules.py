@@ -0,0 +1,242 @@
+"""Server-side port of the form-analysis rules in pose_detection.html.
+
+The browser and the realtime pose server must give the same feedback for the
+same landmarks, so keep the thresholds here in step with analyzePose() in
+templates/pose_detection.html.
+"""
+import numpy as np
+
+NUM_LANDMARKS = 33
+LANDMARK_FIELDS = 4  # x, y, z, visibility
+
+# (a, b, c) landmark triplets for every angle the rules use, angle measured at b
+ANGLE_TRIPLETS = {
+    'kneeAngle': (24, 26, 28),       # Left hip, left knee, left ankle
+    'backAngle': (12, 24, 26),       # Left shoulder, left hip, left knee
+    'kneeTracking': (26, 28, 32),    # Left knee, left ankle, left foot index
+    'hipDepth': (24, 26, 28),        # Left hip, left knee, left ankle
+    'shoulderAngle': (12, 14, 24),   # Left shoulder, left elbow, left hip
+    'bodyAngle': (12, 24, 26),       # Left shoulder, left hip, left knee
+    'elbowAngle': (12, 14, 16),      # Left shoulder, left elbow, left wrist
+    'backKneeAngle': (23, 25, 27),   # Right hip, right knee, right ankle
+}
+
+_ANGLE_NAMES = list(ANGLE_TRIPLETS)
+_A, _B, _C = (np.array(idx) for idx in zip(*ANGLE_TRIPLETS.values()))
+
+EXERCISES = (
+    'squat', 'pushup', 'deadlift', 'lunge', 'shoulder_press', 'bicep_curl',
+    'tricep_extension', 'lateral_raise', 'romanian_deadlift', 'hip_thrust',
+)
+
+# Single-angle exercises: (angle, [(threshold test, score, feedback)...], rep up test, rep reset test)
+_SIMPLE_RULES = {
+    'deadlift': ('backAngle', [
+        (lambda a: a > 160, 100, 'Perfect form! Keep your back straight and chest up.'),
+        (lambda a: a > 140, 80, 'Good form! Focus on keeping your back straight.'),
+        (lambda a: True, 60, 'Keep your back straight! Engage your core.'),
+    ], None, None),
+    'shoulder_press': ('elbowAngle', [
+        (lambda a: a > 160, 100, 'Perfect form! Keep your core tight and shoulders stable.'),
+        (lambda a: a > 120, 80, 'Good form! Try to fully extend your arms.'),
+        (lambda a: True, 60, 'Extend your arms fully! Keep your core engaged.'),
+    ], lambda a: a > 160, lambda a: a < 120),
+    'bicep_curl': ('elbowAngle', [
+        (lambda a: a < 45, 100, 'Perfect form! Keep your elbows close to your body.'),
+        (lambda a: a < 90, 80, 'Good form! Focus on keeping your elbows stationary.'),
+        (lambda a: True, 60, "Keep your elbows close to your body! Don't swing."),
+    ], lambda a: a > 160, lambda a: a < 120),
+    'tricep_extension': ('elbowAngle', [
+        (lambda a: a < 45, 100, 'Perfect form! Keep your upper arms still.'),
+        (lambda a: a < 90, 80, 'Good form! Focus on moving only your forearms.'),
+        (lambda a: True, 60, 'Keep your upper arms still! Only move your forearms.'),
+    ], lambda a: a > 160, lambda a: a < 120),
+    'lateral_raise': ('elbowAngle', [
+        (lambda a: 80 < a < 100, 100, 'Perfect form! Keep your arms parallel to the ground.'),
+        (lambda a: 60 < a < 120, 80, 'Good form! Focus on keeping your arms level.'),
+        (lambda a: True, 60, 'Raise your arms to shoulder height! Keep them straight.'),
+    ], lambda a: 80 < a < 100, lambda a: a < 60),
+    'romanian_deadlift': ('backAngle', [
+        (lambda a: a > 150, 100, 'Perfect form! Keep your back straight and chest up.'),
+        (lambda a: a > 120, 80, 'Good form! Focus on keeping your back straight.'),
+        (lambda a: True, 60, 'Keep your back straight! Push your hips back.'),
+    ], lambda a: a > 170, lambda a: a < 150),
+    'hip_thrust': ('backAngle', [
+        (lambda a: a > 170, 100, 'Perfect form! Squeeze your glutes at the top.'),
+        (lambda a: a > 150, 80, 'Good form! Focus on full hip extension.'),
+        (lambda a: True, 60, 'Push your hips higher! Squeeze your glutes.'),
+    ], lambda a: a > 170, lambda a: a < 150),
+}
+
+
+def compute_angles(landmarks):
+    """Return every rule angle (degrees) for a (33, >=2) landmark array."""
+    points = np.asarray(landmarks, dtype=np.float64)[:, :2]
+    a, b, c = points[_A], points[_B], points[_C]
+    radians = (np.arctan2(c[:, 1] - b[:, 1], c[:, 0] - b[:, 0])
+               - np.arctan2(a[:, 1] - b[:, 1], a[:, 0] - b[:, 0]))
+    angles = np.abs(np.degrees(radians))
+    angles = np.where(angles > 180.0, 360.0 - angles, angles)
+    return dict(zip(_ANGLE_NAMES, angles.tolist()))
+
+
+def _count_rep(up, reset, is_counting, reps):
+    if up and not is_counting:
+        return True, reps + 1
+    if reset:
+        return False, reps
+    return is_counting, reps
+
+
+def _analyze_squat(angles, is_counting, reps):
+    feedback = ''
+    form_score = 100
+    hip_depth = angles['hipDepth']
+    back = angles['backAngle']
+    tracking = abs(angles['kneeTracking'] - 90)
+
+    if hip_depth < 90:
+        feedback += 'Good depth! '
+    elif hip_depth < 120:
+        feedback += 'Go deeper! '
+        form_score -= 20
+    else:
+        feedback += 'Not deep enough! '
+        form_score -= 40
+
+    if back > 160:
+        feedback += 'Back is straight. '
+    elif back > 140:
+        feedback += 'Keep your chest up! '
+        form_score -= 15
+    else:
+        feedback += 'Back is rounding! '
+        form_score -= 30
+
+    if tracking < 10:
+        feedback += 'Knees tracking well. '
+    elif tracking < 20:
+        feedback += 'Watch knee alignment! '
+        form_score -= 10
+    else:
+        feedback += 'Knees caving in! '
+        form_score -= 20
+
+    if form_score < 100:
+        if hip_depth >= 120:
+            feedback += 'Try to get your thighs parallel to the ground. '
+        if back <= 140:
+            feedback += 'Keep your chest up and core tight. '
+        if tracking >= 20:
+            feedback += 'Push your knees out over your toes. '
+    else:
+        feedback = 'Perfect form! Keep your chest up and knees tracking over toes.'
+
+    knee = angles['kneeAngle']
+    is_counting, reps = _count_rep(knee > 160, knee < 120, is_counting, reps)
+    return feedback, form_score, is_counting, reps
+
+
+def _analyze_pushup(angles, is_counting, reps):
+    feedback = ''
+    form_score = 100
+    elbow = angles['elbowAngle']
+    body = abs(angles['bodyAngle'] - 180)
+    shoulder = angles['shoulderAngle']
+
+    if elbow < 90:
+        feedback += 'Good depth! '
+    elif elbow < 120:
+        feedback += 'Go lower! '
+        form_score -= 20
+    else:
+        feedback += 'Not deep enough! '
+        form_score -= 40
+
+    if body < 10:
+        feedback += 'Body is straight. '
+    elif body < 20:
+        feedback += 'Keep your body straight! '
+        form_score -= 15
+    else:
+        feedback += 'Body is sagging! '
+        form_score -= 30
+
+    if shoulder > 45:
+        feedback += 'Shoulders are stable. '
+    elif shoulder > 30:
+        feedback += 'Keep shoulders back! '
+        form_score -= 10
+    else:
+        feedback += 'Shoulders are rounding! '
+        form_score -= 20
+
+    if body < 10:
+        feedback += 'Core is engaged. '
+    elif body < 20:
+        feedback += 'Engage your core! '
+        form_score -= 10
+    else:
+        feedback += 'Core is not engaged! '
+        form_score -= 20
+
+    if form_score < 100:
+        if elbow >= 120:
+            feedback += 'Try to get your chest closer to the ground. '
+        if body >= 20:
+            feedback += 'Keep your body in a straight line from head to heels. '
+        if shoulder <= 30:
+            feedback += 'Keep your shoulders back and down. '
+        if body >= 20:
+            feedback += 'Brace your core and keep your hips level. '
+    else:
+        feedback = 'Perfect form! Keep your body straight and core tight.'
+
+    is_counting, reps = _count_rep(elbow > 160, elbow < 120, is_counting, reps)
+    return feedback, form_score, is_counting, reps
+
+
+def _analyze_lunge(angles, is_counting, reps):
+    front = angles['kneeAngle']
+    back = angles['backKneeAngle']
+    if front < 90 and back < 90:
+        feedback, form_score = 'Perfect form! Keep your chest up and core engaged.', 100
+    elif front < 90:
+        feedback, form_score = 'Good depth! Focus on getting your back knee lower.', 80
+    else:
+        feedback, form_score = 'Go deeper! Try to get both knees to 90 degrees.', 60
+    is_counting, reps = _count_rep(front > 160, front < 120, is_counting, reps)
+    return feedback, form_score, is_counting, reps
+
+
+def analyze_pose(exercise, landmarks, is_counting=False, reps=0):
+    """Score one frame of landmarks for an exercise.
+
+    Rep counting is a small state machine, so the caller passes the previous
+    ``is_counting``/``reps`` in and keeps the values returned in the result.
+    """
+    angles = compute_angles(landmarks)
+
+    if exercise == 'squat':
+        feedback, form_score, is_counting, reps = _analyze_squat(angles, is_counting, reps)
+    elif exercise == 'pushup':
+        feedback, form_score, is_counting, reps = _analyze_pushup(angles, is_counting, reps)
+    elif exercise == 'lunge':
+        feedback, form_score, is_counting, reps = _analyze_lunge(angles, is_counting, reps)
+    elif exercise in _SIMPLE_RULES:
+        name, levels, up, reset = _SIMPLE_RULES[exercise]
+        angle = angles[name]
+        form_score, feedback = next((score, text) for test, score, text in levels if test(angle))
+        if up is not None:
+            is_counting, reps = _count_rep(up(angle), reset(angle), is_counting, reps)
+    else:
+        feedback, form_score = 'Unknown exercise.', 0
+
+    return {
+        'feedback': feedback,
+        'isGoodForm': form_score == 100,
+        'formScore': form_score,
+        'reps': reps,
+        'isCounting': is_counting,
+        'angles': {key: round(value, 1) for key, value in angles.items()},
+    }
@@ -0,0 +1,375 @@
+"""Optional realtime pose-feedback WebSocket service.
+
+Runs next to the Flask app (``python pose_server.py``). Members stream either
+landmark packets (when the browser runs MediaPipe itself) or compressed camera
+frames (for devices too weak to run the model) and get form feedback back.
+Trainers can watch a member's live feedback stream.
+
+Wire protocol
+-------------
+Text messages are JSON control messages:
+
+* ``{"type": "hello", "token": ..., "exercise": "squat"}`` - first message from
+  a member. ``token`` is issued by the Flask ``/pose-detection`` page.
+* ``{"type": "watch", "token": ..., "member_id": 3}`` - first message from a
+  trainer (admin role) who wants to follow a member.
+* ``{"type": "exercise", "exercise": "pushup"}`` - switch exercise, resets reps.
+
+A control message that is not a JSON object of the expected shape closes the
+connection with code 4400; a missing or bad token closes it with 4401.
+
+Binary messages are packets: a ``PACKET_HEADER`` (kind, flags, seq, sent_at)
+followed by the payload. ``KIND_LANDMARKS`` carries 33x4 float32 values
+(float16 with ``FLAG_FLOAT16``), optionally zlib-compressed (``FLAG_ZLIB``).
+``KIND_FRAME`` carries a JPEG/WebP image.
+
+Each feedback message echoes ``seq`` and ``sent_at`` so clients can measure
+end-to-end latency.
+
+Load handling: every connection keeps only the newest unprocessed packet.
+Packets that arrive while an older one waits replace it, and packets older than
+``max_frame_age`` when a worker is free are dropped rather than processed.
+Trainer streams use small bounded queues that discard the oldest message.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import websockets
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from pose_rules import EXERCISES, LANDMARK_FIELDS, NUM_LANDMARKS, analyze_pose
+
+logger = logging.getLogger('pose_server')
+
+PACKET_HEADER = struct.Struct('<BBId')  # kind, flags, seq, sent_at (client clock, seconds)
+KIND_LANDMARKS = 1
+KIND_FRAME = 2
+FLAG_ZLIB = 0x01
+FLAG_FLOAT16 = 0x02
+
+TOKEN_SALT = 'pose-ws'
+TOKEN_MAX_AGE = 12 * 60 * 60
+
+MAX_MESSAGE_BYTES = 512 * 1024  # Largest accepted frame
+WATCHER_QUEUE_SIZE = 8
+
+
+def make_ws_token(secret_key, user_id, role):
+    # Signed with the Flask SECRET_KEY so the pose server needs no DB access
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).dumps({'uid': user_id, 'role': role})
+
+
+def load_ws_token(secret_key, token, max_age=TOKEN_MAX_AGE):
+    return URLSafeTimedSerializer(secret_key, salt=TOKEN_SALT).loads(token, max_age=max_age)
+
+
+def encode_landmarks(landmarks, seq, sent_at=None, float16=False, compress=False):
+    """Pack a (33, 4) landmark array into a binary packet."""
+    flags = 0
+    array = np.asarray(landmarks, dtype=np.float16 if float16 else np.float32)
+    payload = array.tobytes()
+    if float16:
+        flags |= FLAG_FLOAT16
+    if compress:
+        payload = zlib.compress(payload, 1)
+        flags |= FLAG_ZLIB
+    sent_at = time.time() if sent_at is None else sent_at
+    return PACKET_HEADER.pack(KIND_LANDMARKS, flags, seq, sent_at) + payload
+
+
+def decode_packet(data):
+    """Split a binary packet into (kind, seq, sent_at, payload).
+
+    Landmark payloads are returned as a (33, 4) float32 array, frame payloads
+    as raw image bytes. Raises ValueError on malformed packets.
+    """
+    if len(data) < PACKET_HEADER.size:
+        raise ValueError('packet too short')
+    kind, flags, seq, sent_at = PACKET_HEADER.unpack_from(data)
+    payload = bytes(data[PACKET_HEADER.size:])
+    if flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        try:
+            payload = decompressor.decompress(payload, MAX_MESSAGE_BYTES)
+        except zlib.error as e:
+            raise ValueError(f'bad compressed payload: {e}')
+        if decompressor.unconsumed_tail:
+            raise ValueError('decompressed payload too large')
+
+    if kind == KIND_LANDMARKS:
+        dtype = np.float16 if flags & FLAG_FLOAT16 else np.float32
+        expected = NUM_LANDMARKS * LANDMARK_FIELDS * np.dtype(dtype).itemsize
+        if len(payload) != expected:
+            raise ValueError(f'expected {expected} landmark bytes, got {len(payload)}')
+        landmarks = np.frombuffer(payload, dtype=dtype).reshape(NUM_LANDMARKS, LANDMARK_FIELDS)
+        return kind, seq, sent_at, landmarks.astype(np.float32)
+    if kind == KIND_FRAME:
+        return kind, seq, sent_at, payload
+    raise ValueError(f'unknown packet kind {kind}')
+
+
+# --- Worker-side inference (runs in the process pool) ---
+
+_pose_model = None
+
+
+def _init_inference_worker():
+    global _pose_model
+    import mediapipe as mp
+    _pose_model = mp.solutions.pose.Pose(static_image_mode=False, model_complexity=1)
+
+
+def infer_landmarks(image_bytes):
+    """Decode an image and run MediaPipe Pose; returns a (33, 4) array or None."""
+    import cv2
+    if _pose_model is None:
+        _init_inference_worker()
+    image = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    results = _pose_model.process(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if not results.pose_landmarks:
+        return None
+    return np.array([[lm.x, lm.y, lm.z, lm.visibility] for lm in results.pose_landmarks.landmark],
+                    dtype=np.float32)
+
+
+def analyze_frame(exercise, image_bytes, is_counting, reps):
+    landmarks = infer_landmarks(image_bytes)
+    if landmarks is None:
+        return None
+    return analyze_pose(exercise, landmarks, is_counting, reps)
+
+
+def parse_control(message):
+    """A JSON control message as a dict; raises ValueError when it is not one."""
+    control = json.loads(message)
+    if not isinstance(control, dict):
+        raise ValueError('control messages must be JSON objects')
+    return control
+
+
+class Watcher:
+    """A trainer following one member; bounded queue, oldest message dropped."""
+
+    def __init__(self, websocket, member_id):
+        self.websocket = websocket
+        self.member_id = member_id
+        self.queue = asyncio.Queue(maxsize=WATCHER_QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def pump(self):
+        while True:
+            message = await self.queue.get()
+            await self.websocket.send(message)
+
+
+class MemberSession:
+    """State for one member connection: newest pending packet and rep counter."""
+
+    def __init__(self, server, websocket, user_id, exercise):
+        self.server = server
+        self.websocket = websocket
+        self.user_id = user_id
+        self.exercise = exercise
+        self.is_counting = False
+        self.reps = 0
+        self.pending = None  # Newest unprocessed (kind, seq, sent_at, payload, received_at)
+        self.wakeup = asyncio.Event()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def submit(self, packet):
+        self.received += 1
+        if self.pending is not None:
+            # A newer packet supersedes the one still waiting: drop, don't queue
+            self.dropped += 1
+        self.pending = packet + (time.monotonic(),)
+        self.wakeup.set()
+
+    def set_exercise(self, exercise):
+        self.exercise = exercise
+        self.is_counting = False
+        self.reps = 0
+
+    async def process_loop(self):
+        server = self.server
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if self.pending is None:
+                continue
+
+            # Wait for a free worker slot, then take whatever is newest by then
+            async with server.slots:
+                packet, self.pending = self.pending, None
+                if packet is None:
+                    continue
+                kind, seq, sent_at, payload, received_at = packet
+                if time.monotonic() - received_at > server.max_frame_age:
+                    self.dropped += 1
+                    continue
+
+                exercise = self.exercise
+                loop = asyncio.get_running_loop()
+                try:
+                    if kind == KIND_FRAME:
+                        result = await loop.run_in_executor(
+                            server.inference_pool, analyze_frame, exercise, payload, self.is_counting, self.reps)
+                    else:
+                        result = await loop.run_in_executor(
+                            server.rules_pool, analyze_pose, exercise, payload, self.is_counting, self.reps)
+                except Exception:
+                    # One bad frame must not silence the session; skip it and wait for the next
+                    logger.exception('member %s: analysing packet %d failed', self.user_id, seq)
+                    self.dropped += 1
+                    continue
+
+            if result is None:
+                message = {'type': 'no_pose', 'seq': seq, 'sent_at': sent_at}
+            else:
+                # Ignore the counter result if the exercise changed mid-flight
+                if exercise == self.exercise:
+                    self.is_counting = result.pop('isCounting')
+                    self.reps = result['reps']
+                message = dict(result, type='feedback', seq=seq, sent_at=sent_at,
+                               exercise=exercise, dropped=self.dropped)
+            self.processed += 1
+
+            encoded = json.dumps(message)
+            await self.websocket.send(encoded)
+            for watcher in server.watchers.get(self.user_id, ()):
+                watcher.offer(encoded)
+
+
+class PoseServer:
+    def __init__(self, secret_key, workers=2, max_frame_age=0.25, max_in_flight=None):
+        self.secret_key = secret_key
+        self.max_frame_age = max_frame_age
+        self.workers = workers
+        self.inference_pool = ProcessPoolExecutor(max_workers=workers)
+        self.rules_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pose-rules')
+        self.max_in_flight = max_in_flight or workers * 2
+        self.slots = None
+        self.watchers = {}  # member_id -> set of Watcher
+
+    async def handler(self, websocket, path=None):
+        try:
+            hello = parse_control(await asyncio.wait_for(websocket.recv(), timeout=10))
+        except asyncio.TimeoutError:
+            await websocket.close(code=4401, reason='authentication required')
+            return
+        except (ValueError, TypeError):
+            await websocket.close(code=4400, reason='malformed hello')
+            return
+        try:
+            claims = load_ws_token(self.secret_key, hello.get('token', ''))
+            if not isinstance(claims, dict) or 'uid' not in claims:
+                raise BadSignature('token carries no member')
+        except (ValueError, TypeError, BadSignature):
+            await websocket.close(code=4401, reason='authentication required')
+            return
+
+        try:
+            if hello.get('type') == 'watch':
+                await self._serve_watcher(websocket, claims, hello)
+            else:
+                await self._serve_member(websocket, claims, hello)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.info('closing connection after a malformed message: %s', e)
+            await websocket.close(code=4400, reason='malformed message')
+
+    async def _serve_member(self, websocket, claims, hello):
+        exercise = hello.get('exercise', 'squat')
+        if exercise not in EXERCISES:
+            exercise = 'squat'
+        session = MemberSession(self, websocket, claims['uid'], exercise)
+        worker = asyncio.ensure_future(session.process_loop())
+        try:
+            async for message in websocket:
+                if isinstance(message, str):
+                    control = parse_control(message)
+                    if control.get('type') == 'exercise' and control.get('exercise') in EXERCISES:
+                        session.set_exercise(control['exercise'])
+                    continue
+                try:
+                    session.submit(decode_packet(message))
+                except ValueError as e:
+                    await websocket.send(json.dumps({'type': 'error', 'error': str(e)}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            worker.cancel()
+            logger.info('member %s disconnected: received=%d processed=%d dropped=%d',
+                        session.user_id, session.received, session.processed, session.dropped)
+
+    async def _serve_watcher(self, websocket, claims, hello):
+        if claims.get('role') != 'admin':
+            await websocket.close(code=4403, reason='trainer access required')
+            return
+        member_id = hello.get('member_id')
+        if isinstance(member_id, bool) or not isinstance(member_id, (int, str)):
+            raise ValueError('member_id must be an integer')
+        watcher = Watcher(websocket, int(member_id))
+        self.watchers.setdefault(watcher.member_id, set()).add(watcher)
+        pump = asyncio.ensure_future(watcher.pump())
+        try:
+            await websocket.wait_closed()
+        finally:
+            pump.cancel()
+            watchers = self.watchers.get(watcher.member_id)
+            watchers.discard(watcher)
+            if not watchers:
+                del self.watchers[watcher.member_id]
+
+    async def serve(self, host, port):
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        # max_queue bounds the per-connection buffer of unread incoming messages
+        async with websockets.serve(self.handler, host, port, max_size=MAX_MESSAGE_BYTES,
+                                    max_queue=4, compression=None):
+            logger.info('pose server listening on ws://%s:%d', host, port)
+            await asyncio.Future()
+
+    def close(self):
+        self.inference_pool.shutdown(cancel_futures=True)
+        self.rules_pool.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Realtime pose-feedback WebSocket server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2,
+                        help='worker processes for frame inference')
+    parser.add_argument('--max-frame-age', type=float, default=0.25,
+                        help='seconds after which an unprocessed packet is dropped')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = PoseServer(os.getenv('SECRET_KEY', 'your_secret_key'), workers=args.workers,
+                        max_frame_age=args.max_frame_age)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
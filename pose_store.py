@@ -0,0 +1,207 @@
+"""On-disk storage for recorded pose sessions.
+
+Each session is two append-only files under ``POSE_SESSION_DIR/<user_id>/``:
+
+* ``<session_id>.lm`` - landmarks, ``(frames, 33, 4)`` in the session dtype
+* ``<session_id>.ts`` - per-frame timestamps, uint32 milliseconds since start
+
+Only a small ``PoseChunk`` index row per uploaded batch goes into the
+database. Reads map the files with ``numpy.memmap`` and return views, so a
+range query copies nothing until the caller touches the data.
+
+Upload batch format (little-endian, optionally gzip/deflate compressed)::
+
+    uint32 frame_count
+    uint32 timestamps_ms[frame_count]
+    dtype  landmarks[frame_count][33][4]
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+from sqlalchemy import or_, update
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db import db
+from models import PoseChunk, PoseSession
+from pose_rules import LANDMARK_FIELDS, NUM_LANDMARKS
+
+DTYPES = {'float16': np.float16, 'float32': np.float32}
+FRAME_SHAPE = (NUM_LANDMARKS, LANDMARK_FIELDS)
+MAX_BATCH_FRAMES = 30 * 60  # One minute at 30 fps
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+STREAM_CHUNK_FRAMES = 4096  # Frames per bytes chunk when streaming a range out
+
+_COUNT = struct.Struct('<I')
+
+
+class PoseBatchError(ValueError):
+    pass
+
+
+def session_paths(base_dir, session):
+    user_dir = os.path.join(base_dir, str(session.user_id))
+    return (os.path.join(user_dir, f'{session.id}.lm'),
+            os.path.join(user_dir, f'{session.id}.ts'))
+
+
+def decompress_body(body, content_encoding):
+    content_encoding = (content_encoding or '').lower()
+    if content_encoding in ('', 'identity'):
+        return body
+    if content_encoding not in ('gzip', 'deflate'):
+        raise PoseBatchError(f'unsupported Content-Encoding {content_encoding}')
+    # wbits=47 auto-detects zlib and gzip headers
+    decompressor = zlib.decompressobj(47)
+    try:
+        data = decompressor.decompress(body, MAX_BATCH_BYTES)
+    except zlib.error as e:
+        raise PoseBatchError(f'bad compressed body: {e}')
+    if decompressor.unconsumed_tail:
+        raise PoseBatchError('batch too large')
+    return data
+
+
+def parse_batch(data, dtype):
+    """Split a batch into (timestamps, landmarks) arrays without copying."""
+    if len(data) < _COUNT.size:
+        raise PoseBatchError('batch too short')
+    (count,) = _COUNT.unpack_from(data)
+    if count == 0 or count > MAX_BATCH_FRAMES:
+        raise PoseBatchError(f'frame count must be between 1 and {MAX_BATCH_FRAMES}')
+    itemsize = np.dtype(dtype).itemsize
+    expected = _COUNT.size + count * 4 + count * NUM_LANDMARKS * LANDMARK_FIELDS * itemsize
+    if len(data) != expected:
+        raise PoseBatchError(f'expected {expected} bytes for {count} frames, got {len(data)}')
+
+    timestamps = np.frombuffer(data, dtype='<u4', count=count, offset=_COUNT.size)
+    landmarks = np.frombuffer(data, dtype=dtype, offset=_COUNT.size + count * 4).reshape((count,) + FRAME_SHAPE)
+    if np.any(np.diff(timestamps.astype(np.int64)) < 0):
+        raise PoseBatchError('timestamps must be non-decreasing')
+    return timestamps, landmarks
+
+
+def batch_header(count):
+    return _COUNT.pack(count)
+
+
+def encode_batch(timestamps, landmarks, dtype='float16'):
+    timestamps = np.asarray(timestamps, dtype='<u4')
+    landmarks = np.asarray(landmarks, dtype=DTYPES[dtype])
+    return batch_header(len(timestamps)) + timestamps.tobytes() + landmarks.tobytes()
+
+
+def append_batch(base_dir, session, body, content_encoding=None):
+    """Append an uploaded batch to a session and index it. Returns the new PoseChunk."""
+    dtype = DTYPES[session.dtype]
+    timestamps, landmarks = parse_batch(decompress_body(body, content_encoding), dtype)
+    if session.num_frames and int(timestamps[0]) < session.duration_ms:
+        raise PoseBatchError('batch overlaps frames already stored')
+
+    # The page uploads a session's batches one at a time, in order (pose_detection.html), but
+    # nothing stops another client from racing two. Reserving the frames with one conditional
+    # UPDATE takes the database write lock: the next upload waits here until this one has written
+    # its frames and committed, and can then only follow this batch, never overwrite it.
+    count = len(timestamps)
+    try:
+        reserved = db.session.execute(
+            update(PoseSession)
+            .where(PoseSession.id == session.id,
+                   or_(PoseSession.num_frames == 0, PoseSession.duration_ms <= int(timestamps[0])))
+            .values(num_frames=PoseSession.num_frames + count, duration_ms=int(timestamps[-1]))
+            .returning(PoseSession.num_frames)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if reserved is None:
+            raise PoseBatchError('batch overlaps frames already stored')
+        offset = reserved - count
+
+        landmark_path, timestamp_path = session_paths(base_dir, session)
+        os.makedirs(os.path.dirname(landmark_path), exist_ok=True)
+        # Truncate to the indexed length first so a half-written earlier batch can't shift offsets
+        frame_bytes = np.dtype(dtype).itemsize * NUM_LANDMARKS * LANDMARK_FIELDS
+        for path, size in ((landmark_path, offset * frame_bytes), (timestamp_path, offset * 4)):
+            with open(path, 'ab') as f:
+                f.truncate(size)
+
+        with open(landmark_path, 'ab') as f:
+            f.write(landmarks.tobytes())
+        with open(timestamp_path, 'ab') as f:
+            f.write(timestamps.tobytes())
+
+        chunk = PoseChunk(
+            session_id=session.id,
+            frame_offset=offset,
+            num_frames=count,
+            start_ms=int(timestamps[0]),
+            end_ms=int(timestamps[-1])
+        )
+        db.session.add(chunk)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    # The object was loaded before the UPDATE; bring it up to date without another query
+    set_committed_value(session, 'num_frames', reserved)
+    set_committed_value(session, 'duration_ms', int(timestamps[-1]))
+    return chunk
+
+
+def open_session(base_dir, session):
+    """Memory-map a session; returns (timestamps, landmarks) views or empty arrays."""
+    dtype = DTYPES[session.dtype]
+    if not session.num_frames:
+        return np.empty(0, dtype='<u4'), np.empty((0,) + FRAME_SHAPE, dtype=dtype)
+    landmark_path, timestamp_path = session_paths(base_dir, session)
+    timestamps = np.memmap(timestamp_path, dtype='<u4', mode='r', shape=(session.num_frames,))
+    landmarks = np.memmap(landmark_path, dtype=dtype, mode='r',
+                          shape=(session.num_frames,) + FRAME_SHAPE)
+    return timestamps, landmarks
+
+
+def iter_frames(timestamps, landmarks, chunk_frames=STREAM_CHUNK_FRAMES):
+    """A range from read_range() in the batch format, as ``bytes`` chunks for a streaming response."""
+    yield batch_header(len(timestamps))
+    yield timestamps.tobytes()
+    for start in range(0, len(landmarks), chunk_frames):
+        yield landmarks[start:start + chunk_frames].tobytes()
+
+
+def read_range(base_dir, session, start_ms=None, end_ms=None):
+    """Frames with start_ms <= t <= end_ms as zero-copy memmap views.
+
+    The chunk index narrows the search to the overlapping batches, then a
+    binary search inside that span finds the exact frame bounds.
+    """
+    timestamps, landmarks = open_session(base_dir, session)
+    if not len(timestamps):
+        return timestamps, landmarks
+    start_ms = 0 if start_ms is None else start_ms
+    end_ms = session.duration_ms if end_ms is None else end_ms
+
+    span = db.session.query(
+        db.func.min(PoseChunk.frame_offset),
+        db.func.max(PoseChunk.frame_offset + PoseChunk.num_frames)
+    ).filter(
+        PoseChunk.session_id == session.id,
+        PoseChunk.end_ms >= start_ms,
+        PoseChunk.start_ms <= end_ms
+    ).first()
+    if span[0] is None:
+        return timestamps[:0], landmarks[:0]
+
+    first, last = span
+    window = timestamps[first:last]
+    lo = first + int(np.searchsorted(window, start_ms, side='left'))
+    hi = first + int(np.searchsorted(window, end_ms, side='right'))
+    return timestamps[lo:hi], landmarks[lo:hi]
+
+
+def create_session(user_id, exercise, dtype='float16'):
+    if dtype not in DTYPES:
+        raise PoseBatchError(f'dtype must be one of {", ".join(DTYPES)}')
+    session = PoseSession(user_id=user_id, exercise=exercise, dtype=dtype)
+    db.session.add(session)
+    db.session.commit()
+    return session
@@ -0,0 +1,326 @@
+"""Opt-in request profiling that keeps captures of slow requests.
+
+Enabled with ``PROFILE_ENABLED`` (see config.py). While a request runs, a
+background thread samples its stack every ``PROFILE_INTERVAL_MS``. This is
+cheap enough to do for every request, so a request that ends up slower than
+``PROFILE_SLOW_MS`` is always captured. A random ``PROFILE_SAMPLE_RATE``
+fraction of requests additionally runs under cProfile, which gives exact
+call counts.
+
+Each capture is a group of files in ``PROFILE_DIR`` sharing one base name,
+tagged with endpoint and user id:
+
+* ``.json``: endpoint, user, path, status, duration and why it was kept
+* ``.collapsed``: sampled stacks, one ``frame;frame;frame count`` line per
+  stack. flamegraph.pl and speedscope read this format directly.
+* ``.prof``: pstats data, only for cProfile-sampled requests
+
+The directory is a ring buffer: a background writer keeps the newest
+``PROFILE_MAX_CAPTURES`` captures and deletes older ones. Inspect the
+captures with ``flask profile list``, ``flask profile top`` and
+``flask profile flamegraph``.
+"""
+import cProfile
+import glob
+import json
+import logging
+import os
+import pstats
+import queue
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+SLOW = 'slow'
+SAMPLED = 'sampled'
+
+
+def _frame_label(code):
+    # Last two path components keep labels short but tell app.py from site-packages
+    path = '/'.join(code.co_filename.replace('\\', '/').rsplit('/', 2)[-2:])
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'.replace(';', ':')
+
+
+def collapse(frame):
+    """Collapsed-stack line for a frame, outermost call first."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """One daemon thread sampling the stacks of every thread that is being profiled."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._active = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self, ident):
+        with self._lock:
+            self._active[ident] = Counter()
+            # Threads do not survive a fork, so each worker starts its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='profile-sampler', daemon=True).start()
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                idents = list(self._active)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            stacks = {ident: collapse(frames[ident]) for ident in idents if ident in frames}
+            with self._lock:
+                for ident, stack in stacks.items():
+                    counter = self._active.get(ident)
+                    if counter is not None:
+                        counter[stack] += 1
+
+
+class CaptureWriter:
+    """Writes captures off the request path and trims the ring buffer."""
+
+    def __init__(self, directory, max_captures):
+        self.directory = directory
+        self.max_captures = max_captures
+        self._queue = queue.Queue(maxsize=100)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, meta, stacks, profile):
+        try:
+            self._queue.put_nowait((meta, stacks, profile))
+        except queue.Full:
+            logger.warning('Profile writer is behind; dropping capture of %s', meta['endpoint'])
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='profile-writer', daemon=True).start()
+
+    def _run(self):
+        while True:
+            meta, stacks, profile = self._queue.get()
+            try:
+                self.write(meta, stacks, profile)
+            except Exception:
+                logger.exception('Failed to write profile capture')
+
+    def write(self, meta, stacks, profile):
+        endpoint = re.sub(r'[^\w.-]', '_', meta['endpoint'] or 'none')
+        base = os.path.join(self.directory,
+                            f'{time.time_ns()}-{os.getpid()}-{endpoint}-u{meta["user_id"] or 0}')
+        if profile is not None:
+            profile.dump_stats(base + '.prof')
+            meta['cprofile'] = True
+        with open(base + '.collapsed', 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+        # Metadata last: captures are listed by their .json, so a listed capture is complete
+        with open(base + '.json', 'w') as f:
+            json.dump(meta, f)
+        self.trim()
+
+    def trim(self):
+        captures = sorted(glob.glob(os.path.join(self.directory, '*.json')))
+        for path in captures[:max(len(captures) - self.max_captures, 0)]:
+            for suffix in ('.json', '.collapsed', '.prof'):
+                try:
+                    os.remove(path[:-len('.json')] + suffix)
+                except FileNotFoundError:
+                    pass  # Another worker trimmed it first
+
+
+class RequestProfiler:
+    def __init__(self, app):
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.01)
+        self.slow_ms = app.config.get('PROFILE_SLOW_MS', 500)
+        self.sampler = StackSampler(app.config.get('PROFILE_INTERVAL_MS', 5) / 1000)
+        self.writer = CaptureWriter(app.config['PROFILE_DIR'], app.config.get('PROFILE_MAX_CAPTURES', 200))
+        self._cprofile_lock = threading.Lock()  # One cProfile at a time; Python 3.12+ allows no more
+
+    def before_request(self):
+        g._profile_started = time.perf_counter()
+        g._profile = None
+        if random.random() < self.sample_rate and self._cprofile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                g._profile = profile
+            except ValueError:
+                self._cprofile_lock.release()
+        self.sampler.start(threading.get_ident())
+
+    def teardown_request(self, exc):
+        started = g.pop('_profile_started', None)
+        if started is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        profile = g.pop('_profile', None)
+        if profile is not None:
+            profile.disable()
+            self._cprofile_lock.release()
+        stacks = self.sampler.stop(threading.get_ident())
+
+        reason = SLOW if duration_ms >= self.slow_ms else SAMPLED if profile is not None else None
+        if reason is None:
+            return
+        user_id = current_user.id if current_user and current_user.is_authenticated else None
+        self.writer.submit({
+            'endpoint': request.endpoint,
+            'user_id': user_id,
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': getattr(g, '_profile_status', None),
+            'error': repr(exc) if exc is not None else None,
+            'duration_ms': round(duration_ms, 2),
+            'reason': reason,
+            'samples': sum(stacks.values()),
+            'captured_at': datetime.utcnow().isoformat(timespec='seconds'),
+        }, stacks, profile)
+
+
+def _record_status(response):
+    g._profile_status = response.status_code
+    return response
+
+
+def init_profiling(app):
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.cli.add_command(profile_cli)
+    if not app.config.get('PROFILE_ENABLED'):
+        return
+    os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+    profiler = app.extensions['request_profiler'] = RequestProfiler(app)
+    # Registered first, so the timing covers the other hooks as well
+    app.before_request_funcs.setdefault(None, []).insert(0, profiler.before_request)
+    app.after_request(_record_status)
+    app.teardown_request(profiler.teardown_request)
+
+
+def load_captures(directory, endpoint=None, user_id=None, reason=None):
+    """Metadata of stored captures, oldest first, each with its file base path."""
+    captures = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue  # Trimmed while listing
+        if endpoint and meta['endpoint'] != endpoint:
+            continue
+        if user_id is not None and meta['user_id'] != user_id:
+            continue
+        if reason and meta['reason'] != reason:
+            continue
+        meta['base'] = path[:-len('.json')]
+        captures.append(meta)
+    return captures
+
+
+def read_collapsed(base):
+    stacks = Counter()
+    try:
+        with open(base + '.collapsed') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                stacks[stack] += int(count)
+    except FileNotFoundError:
+        pass
+    return stacks
+
+
+def hot_functions(captures):
+    """(total samples, Counter of self samples, Counter of inclusive samples) per frame."""
+    own, inclusive = Counter(), Counter()
+    total = 0
+    for capture in captures:
+        for stack, count in read_collapsed(capture['base']).items():
+            frames = stack.split(';')
+            total += count
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+    return total, own, inclusive
+
+
+profile_cli = AppGroup('profile', help='Stored request profiles.')
+
+
+def _filters(f):
+    f = click.option('--endpoint', help='Only captures of this endpoint, e.g. main.dashboard.')(f)
+    f = click.option('--user', 'user_id', type=int, help='Only captures of this member.')(f)
+    f = click.option('--reason', type=click.Choice([SLOW, SAMPLED]), help='Only slow or only sampled captures.')(f)
+    return f
+
+
+@profile_cli.command('list')
+@_filters
+def list_command(endpoint, user_id, reason):
+    """List stored captures, newest last."""
+    captures = load_captures(current_app.config['PROFILE_DIR'], endpoint, user_id, reason)
+    click.echo(f'{"captured (UTC)":<21}{"endpoint":<32}{"user":>6}{"ms":>10}{"status":>7}  reason')
+    for c in captures:
+        click.echo(f'{c["captured_at"]:<21}{c["endpoint"] or "-":<32}{c["user_id"] or "-":>6}'
+                   f'{c["duration_ms"]:>10.1f}{c["status"] or "-":>7}  {c["reason"]}'
+                   f'{" +cProfile" if c.get("cprofile") else ""}')
+    click.echo(f'{len(captures)} captures')
+
+
+@profile_cli.command('top')
+@_filters
+@click.option('--limit', default=20, show_default=True, help='Number of functions to show.')
+@click.option('--cprofile', is_flag=True, help='Aggregate the cProfile data instead of the sampled stacks.')
+@click.option('--sort', default='tottime', show_default=True, help='pstats sort key, with --cprofile.')
+def top_command(endpoint, user_id, reason, limit, cprofile, sort):
+    """Hottest functions across all matching captures."""
+    captures = load_captures(current_app.config['PROFILE_DIR'], endpoint, user_id, reason)
+    if cprofile:
+        paths = [c['base'] + '.prof' for c in captures if os.path.exists(c['base'] + '.prof')]
+        if not paths:
+            raise click.ClickException('No cProfile captures match.')
+        stats = pstats.Stats(*paths, stream=sys.stdout)
+        stats.sort_stats(sort).print_stats(limit)
+        return
+
+    total, own, inclusive = hot_functions(captures)
+    if not total:
+        raise click.ClickException('No stack samples in the matching captures.')
+    click.echo(f'{total} samples from {len(captures)} captures\n')
+    click.echo(f'{"self %":>7}{"total %":>9}  function')
+    for frame, count in own.most_common(limit):
+        click.echo(f'{count / total:>7.1%}{inclusive[frame] / total:>9.1%}  {frame}')
+
+
+@profile_cli.command('flamegraph')
+@_filters
+@click.argument('output', type=click.Path(dir_okay=False))
+def flamegraph_command(endpoint, user_id, reason, output):
+    """Merge matching captures into one collapsed-stack file for flamegraph.pl or speedscope."""
+    merged = Counter()
+    captures = load_captures(current_app.config['PROFILE_DIR'], endpoint, user_id, reason)
+    for capture in captures:
+        merged.update(read_collapsed(capture['base']))
+    with open(output, 'w') as f:
+        f.writelines(f'{stack} {count}\n' for stack, count in merged.most_common())
+    click.echo(f'Wrote {len(merged)} stacks from {len(captures)} captures to {output}')
@@ -0,0 +1,235 @@
+"""Token-bucket rate limiting and request coalescing for the JSON APIs.
+
+Every ``/api/`` request, and every request to another endpoint listed in
+``RATELIMIT_ENDPOINTS`` (such as the PDF export), takes one token from a
+bucket keyed by member and endpoint. Anonymous requests are keyed by client address instead. A bucket
+holds up to ``burst`` tokens and refills at ``rate`` tokens per second. An
+empty bucket answers 429 with ``Retry-After``. Limits come from
+``RATELIMIT_DEFAULT`` and the per-endpoint ``RATELIMIT_ENDPOINTS`` (see
+config.py).
+
+There are two bucket stores, chosen with ``RATELIMIT_STORAGE``:
+
+* ``memory``: a dict in the process. It is the fastest, but each worker
+  counts separately, so N workers allow N times the rate.
+* ``file``: a small SQLite file (``RATELIMIT_FILE``) that all workers on the
+  host share. Each check is one short ``BEGIN IMMEDIATE`` transaction. It
+  takes the place of a local Redis, which this deployment does not run.
+
+Coalescing is separate from limiting. ``@coalesce`` views run once for
+concurrent identical GET requests: same endpoint, same member and same
+query string. The other requests wait for that single run and receive a
+copy of its response, marked with ``X-Coalesced: 1``. Coalescing happens
+within a worker process.
+"""
+import functools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = (5.0, 30)  # tokens per second, burst
+
+
+def refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBackend:
+    """Buckets in a dict; per process."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token; returns (allowed, tokens left, seconds until one is available)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = burst if bucket is None else refill(bucket[0], bucket[1], now, rate, burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if bucket is None and len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            self._buckets[key] = [tokens, now]
+        return allowed, tokens, 0 if allowed else (1 - tokens) / rate
+
+    def _prune(self, now):
+        # Buckets idle for a minute are full again in all but the slowest limits
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > 60]:
+            del self._buckets[key]
+
+
+class FileBackend:
+    """Buckets in a SQLite file shared by every worker on the host."""
+
+    BUSY_TIMEOUT_MS = 1000
+    CLEANUP_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._calls = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = self._connect()
+        try:
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket ('
+                               'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID')
+        finally:
+            connection.close()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, isolation_level=None, timeout=self.BUSY_TIMEOUT_MS / 1000)
+        connection.execute('PRAGMA synchronous = OFF')  # Losing a few token counts in a crash is fine
+        return connection
+
+    def _connection(self):
+        # One connection per thread, reopened after a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = self._connect()
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def take(self, key, rate, burst, now=None):
+        now = time.time() if now is None else now  # Wall clock: shared across processes
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens = burst if row is None else refill(row[0], row[1], now, rate, burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            self._calls += 1
+            if self._calls % self.CLEANUP_EVERY == 0:
+                connection.execute('DELETE FROM bucket WHERE updated < ?', (now - 3600,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, tokens, 0 if allowed else (1 - tokens) / rate
+
+
+class RateLimiter:
+    def __init__(self, app):
+        storage = app.config.get('RATELIMIT_STORAGE', 'memory')
+        if storage == 'memory':
+            self.backend = MemoryBackend()
+        elif storage == 'file':
+            self.backend = FileBackend(app.config['RATELIMIT_FILE'])
+        else:
+            raise ValueError(f'Unknown RATELIMIT_STORAGE {storage!r}; use "memory" or "file"')
+        self.default = tuple(app.config.get('RATELIMIT_DEFAULT', DEFAULT_LIMIT))
+        # None as an endpoint's limit exempts it
+        self.endpoints = {endpoint: limit and tuple(limit)
+                          for endpoint, limit in app.config.get('RATELIMIT_ENDPOINTS', {}).items()}
+
+    def limit_for(self, endpoint):
+        return self.endpoints.get(endpoint, self.default)
+
+    def before_request(self):
+        if not current_app.config.get('RATELIMIT_ENABLED', True):
+            return None
+        if not request.path.startswith('/api/') and request.endpoint not in self.endpoints:
+            return None
+        limit = self.limit_for(request.endpoint)
+        if limit is None:
+            return None
+        rate, burst = limit
+        who = f'u{current_user.id}' if current_user.is_authenticated else f'ip{request.remote_addr}'
+        try:
+            allowed, tokens, retry_after = self.backend.take(f'{who}:{request.endpoint}', rate, burst)
+        except sqlite3.Error:
+            # A busy or broken limiter store must not take the API down with it
+            logger.exception('Rate limiter store failed; letting the request through')
+            return None
+        if allowed:
+            return None
+        response = jsonify({'error': 'Too many requests', 'retry_after': round(retry_after, 2)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        response.headers['X-RateLimit-Limit'] = str(burst)
+        response.headers['X-RateLimit-Remaining'] = str(int(tokens))
+        return response
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its result."""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.failed = False
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Returns (result, shared): whether this caller reused another caller's run."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            # A failed or stuck leader does not fail its followers; they run it themselves
+            if call.done.wait(self.timeout) and not call.failed:
+                return call.result, True
+            return fn(), False
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException:
+            call.failed = True
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+_flights = SingleFlight()
+
+
+def coalesce(view):
+    """Share one run of a GET view between concurrent identical requests of one member."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        key = (request.endpoint, current_user.get_id(), tuple(sorted(kwargs.items())),
+               tuple(sorted(request.args.items(multi=True))))
+
+        def run():
+            # Frozen to bytes so every waiter can build its own response object
+            response = current_app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        (body, status, headers), shared = _flights.do(key, run)
+        response = current_app.response_class(body, status=status, headers=headers)
+        if shared:
+            response.headers['X-Coalesced'] = '1'
+        return response
+    return wrapper
+
+
+def init_rate_limiting(app):
+    app.config.setdefault('RATELIMIT_FILE', os.path.join(app.instance_path, 'ratelimit.db'))
+    limiter = app.extensions['rate_limiter'] = RateLimiter(app)
+    app.before_request(limiter.before_request)
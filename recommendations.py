@@ -0,0 +1,465 @@
+"""Exercise recommendations from precomputed similarity matrices.
+
+``flask recommend build`` builds a snapshot from the exercise catalog and plan history:
+
+* **Co-occurrence.** Exercises that appear in the same plans (``workout_exercises``)
+  are scored by cosine similarity of their plan sets.
+* **Features.** Exercises are compared by cosine similarity of TF-IDF weighted
+  name/description words, plus their muscle group.
+* **Level affinity.** For each exercise, the share of its plans at each ``WorkoutPlan.level``.
+* **Goal affinity.** How well each muscle group serves each goal in ``GOAL_PROFILES``.
+
+Both similarity matrices are sparse, and each row is cut to its best
+``MAX_NEIGHBORS`` entries. They are written as plain ``.npy`` arrays, which
+every worker opens with ``mmap_mode='r'``. A lookup only slices a few rows,
+so it takes well under a millisecond, and the OS page cache shares the
+arrays between processes.
+
+Exercises with the same name (``add_workout_plan`` creates a new row for each
+unknown name) are merged into one item, and the item's lowest id stands for it.
+
+Plans created after a snapshot are applied incrementally. Each worker reads
+links for plan ids above its watermark, at most once per ``SYNC_INTERVAL``, and
+adds them to an in-memory co-occurrence delta. After ``RECOMMENDATION_REBUILD_AFTER``
+new plans, a background thread writes a fresh snapshot and swaps the
+``CURRENT`` pointer. Exercises that are new since the snapshot, and edits to
+existing plans, are only picked up by the next build.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+import click
+import numpy as np
+import scipy.sparse as sp
+from flask import current_app
+from flask.cli import AppGroup
+
+from db import db
+from models import Exercise, WorkoutPlan, workout_exercises
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ('beginner', 'intermediate', 'advanced')
+GOALS = ('weight loss', 'muscle gain', 'endurance', 'general fitness')
+
+# Free-text User.goals keywords -> goal
+GOAL_KEYWORDS = {
+    'weight loss': ('weight loss', 'lose weight', 'fat loss', 'lose fat', 'lean', 'cut'),
+    'muscle gain': ('muscle', 'strength', 'strong', 'bulk', 'mass', 'hypertrophy'),
+    'endurance': ('endurance', 'stamina', 'cardio', 'marathon', 'run'),
+    'general fitness': ('general', 'fitness', 'health', 'maintain'),
+}
+
+# How well each muscle group serves each goal (0..1); unlisted groups get DEFAULT_GOAL_AFFINITY
+GOAL_PROFILES = {
+    'weight loss': {'cardio': 1.0, 'legs': 0.8, 'glutes': 0.7, 'hamstrings': 0.7, 'back': 0.6,
+                    'core': 0.6, 'chest': 0.5, 'shoulders': 0.4, 'arms': 0.3},
+    'muscle gain': {'legs': 1.0, 'back': 1.0, 'chest': 1.0, 'glutes': 0.9, 'hamstrings': 0.9,
+                    'shoulders': 0.9, 'arms': 0.8, 'core': 0.5, 'cardio': 0.2},
+    'endurance': {'cardio': 1.0, 'legs': 0.7, 'core': 0.6, 'glutes': 0.5, 'hamstrings': 0.5,
+                  'back': 0.4, 'shoulders': 0.3, 'chest': 0.3, 'arms': 0.2},
+    'general fitness': {'cardio': 0.8, 'legs': 0.8, 'back': 0.8, 'chest': 0.8, 'core': 0.8,
+                        'glutes': 0.7, 'hamstrings': 0.7, 'shoulders': 0.7, 'arms': 0.6},
+}
+DEFAULT_GOAL_AFFINITY = 0.5
+
+MAX_NEIGHBORS = 50
+COOCCURRENCE_WEIGHT = 0.7
+FEATURE_WEIGHT = 0.3
+POPULARITY_WEIGHT = 0.01    # Tie-breaker, and the whole score for members without history
+GROUP_FEATURE_WEIGHT = 0.5  # Share of the feature vector given to the muscle group
+RECENT_PLANS = 5
+SYNC_INTERVAL = 1.0
+BLOCK_ROWS = 1024
+
+STOPWORDS = frozenset('a an and the to of on off in with for from at by or'.split())
+ARRAYS = ('item_ids', 'exercise_ids', 'exercise_items', 'plan_counts', 'level_affinity', 'goal_affinity',
+          'cooc_indptr', 'cooc_indices', 'cooc_scores', 'feature_indptr', 'feature_indices', 'feature_scores')
+
+
+def _tokens(text):
+    return [word for word in re.findall(r'[a-z]+', (text or '').lower()) if word not in STOPWORDS]
+
+
+def parse_goals(text):
+    """Weights over GOALS for a free-text User.goals value."""
+    text = (text or '').lower()
+    weights = np.array([any(keyword in text for keyword in GOAL_KEYWORDS[goal]) for goal in GOALS], dtype=np.float32)
+    if not weights.any():
+        weights[GOALS.index('general fitness')] = 1.0
+    return weights / weights.sum()
+
+
+def _top_neighbors(matrix, limit):
+    """CSR with each row cut to its ``limit`` best entries, sorted best first."""
+    matrix = matrix.tocsr()
+    indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+    indices, scores = [], []
+    for row in range(matrix.shape[0]):
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        order = np.argsort(-matrix.data[start:end], kind='stable')[:limit]
+        indices.append(matrix.indices[start:end][order])
+        scores.append(matrix.data[start:end][order])
+        indptr[row + 1] = indptr[row] + len(order)
+    return (indptr,
+            np.concatenate(indices).astype(np.int32) if indices else np.zeros(0, np.int32),
+            np.concatenate(scores).astype(np.float32) if scores else np.zeros(0, np.float32))
+
+
+def _feature_similarity(names, groups, descriptions, limit):
+    # TF-IDF over name and description words, plus a one-hot muscle group
+    docs = [_tokens(name) + _tokens(description) for name, description in zip(names, descriptions)]
+    vocabulary = {}
+    rows, cols = [], []
+    for row, words in enumerate(docs):
+        for word in words:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(word, len(vocabulary)))
+    n = len(docs)
+    text = sp.csr_matrix((np.ones(len(rows), np.float32), (rows, cols)), shape=(n, len(vocabulary)))
+    text.sum_duplicates()
+    idf = np.log((1 + n) / (1 + np.bincount(text.indices, minlength=len(vocabulary)))) + 1
+    text = sp.csr_matrix(text.multiply(idf))
+
+    group_names = sorted({group for group in groups if group})
+    group_index = {group: i for i, group in enumerate(group_names)}
+    group_rows = [i for i, group in enumerate(groups) if group]
+    group = sp.csr_matrix((np.ones(len(group_rows), np.float32),
+                           (group_rows, [group_index[groups[i]] for i in group_rows])),
+                          shape=(n, len(group_names)))
+
+    def normalized(matrix):
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        return sp.diags(np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)) @ matrix
+
+    features = normalized(sp.hstack([normalized(text) * np.sqrt(1 - GROUP_FEATURE_WEIGHT),
+                                     normalized(group) * np.sqrt(GROUP_FEATURE_WEIGHT)]).tocsr())
+
+    # Dense products one block of rows at a time, keeping only each row's best entries
+    blocks = []
+    for start in range(0, n, BLOCK_ROWS):
+        block = (features[start:start + BLOCK_ROWS] @ features.T).toarray()
+        block[np.arange(len(block)), np.arange(start, start + len(block))] = 0
+        if block.shape[1] > limit:
+            cutoff = np.partition(block, -limit, axis=1)[:, -limit][:, None]
+            block[block < cutoff] = 0
+        blocks.append(sp.csr_matrix(block))
+    similarity = sp.vstack(blocks) if blocks else sp.csr_matrix((0, 0), dtype=np.float32)
+    return _top_neighbors(similarity, limit)
+
+
+def build(directory):
+    """Write a new snapshot under ``directory`` and point CURRENT at it. Returns its metadata."""
+    started = time.perf_counter()
+    exercises = db.session.query(
+        Exercise.id, Exercise.name, Exercise.muscle_group, Exercise.description
+    ).order_by(Exercise.id).all()
+
+    # One item per distinct exercise name, represented by its lowest id
+    item_of_name = {}
+    names, groups, descriptions, item_ids = [], [], [], []
+    exercise_items = np.zeros(len(exercises), dtype=np.int32)
+    for i, row in enumerate(exercises):
+        key = (row.name or '').strip().lower()
+        item = item_of_name.get(key)
+        if item is None:
+            item = item_of_name[key] = len(item_ids)
+            item_ids.append(row.id)
+            names.append(row.name)
+            groups.append((row.muscle_group or '').lower() or None)
+            descriptions.append(row.description)
+        else:
+            groups[item] = groups[item] or (row.muscle_group or '').lower() or None
+            descriptions[item] = descriptions[item] or row.description
+        exercise_items[i] = item
+    exercise_ids = np.array([row.id for row in exercises], dtype=np.int64)
+    n = len(item_ids)
+
+    links = db.session.query(
+        workout_exercises.c.workout_id, workout_exercises.c.exercise_id, WorkoutPlan.level
+    ).join(WorkoutPlan, WorkoutPlan.id == workout_exercises.c.workout_id).all()
+    watermark = db.session.query(db.func.max(WorkoutPlan.id)).scalar() or 0
+
+    link_plans = np.array([link.workout_id for link in links], dtype=np.int64)
+    link_exercises = np.searchsorted(exercise_ids, np.array([link.exercise_id for link in links], dtype=np.int64))
+    link_exercises = np.minimum(link_exercises, max(len(exercise_ids) - 1, 0))
+    plan_ids, plan_rows = np.unique(link_plans, return_inverse=True)
+    link_levels = np.array([LEVELS.index(link.level) if link.level in LEVELS else -1 for link in links], dtype=np.int64)
+
+    # Plan x item incidence; C = B^T B counts the plans each pair shares
+    incidence = sp.csr_matrix((np.ones(len(links), np.float32), (plan_rows, exercise_items[link_exercises])),
+                              shape=(len(plan_ids), n))
+    incidence.sum_duplicates()
+    incidence.data[:] = 1
+    plan_counts = np.asarray(incidence.sum(axis=0)).ravel().astype(np.float32)
+
+    cooccurrence = (incidence.T @ incidence).tocoo()
+    off_diagonal = cooccurrence.row != cooccurrence.col
+    rows, cols = cooccurrence.row[off_diagonal], cooccurrence.col[off_diagonal]
+    cosine = cooccurrence.data[off_diagonal] / np.sqrt(plan_counts[rows] * plan_counts[cols])
+    cooc_indptr, cooc_indices, cooc_scores = _top_neighbors(sp.csr_matrix((cosine, (rows, cols)), shape=(n, n)),
+                                                            MAX_NEIGHBORS)
+
+    feature_indptr, feature_indices, feature_scores = _feature_similarity(names, groups, descriptions, MAX_NEIGHBORS)
+
+    # Share of each item's plans at each level, smoothed and scaled so "no preference" is 1
+    plan_levels = np.full(len(plan_ids), -1, dtype=np.int64)
+    plan_levels[plan_rows] = link_levels
+    leveled = np.flatnonzero(plan_levels >= 0)
+    level_onehot = sp.csr_matrix((np.ones(len(leveled), np.float32), (leveled, plan_levels[leveled])),
+                                 shape=(len(plan_ids), len(LEVELS)))
+    level_counts = (incidence.T @ level_onehot).toarray()
+    level_affinity = (level_counts + 1) / (level_counts.sum(axis=1, keepdims=True) + len(LEVELS)) * len(LEVELS)
+
+    goal_affinity = np.array([[GOAL_PROFILES[goal].get(group, DEFAULT_GOAL_AFFINITY) for goal in GOALS]
+                              for group in groups], dtype=np.float32).reshape(n, len(GOALS))
+
+    name = datetime.utcnow().strftime('snapshot-%Y%m%d%H%M%S%f')
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    arrays = {
+        'item_ids': np.array(item_ids, dtype=np.int64),
+        'exercise_ids': exercise_ids,
+        'exercise_items': exercise_items,
+        'plan_counts': plan_counts,
+        'level_affinity': level_affinity.astype(np.float32),
+        'goal_affinity': goal_affinity,
+        'cooc_indptr': cooc_indptr, 'cooc_indices': cooc_indices, 'cooc_scores': cooc_scores,
+        'feature_indptr': feature_indptr, 'feature_indices': feature_indices, 'feature_scores': feature_scores,
+    }
+    for key, array in arrays.items():
+        np.save(os.path.join(path, f'{key}.npy'), array)
+    meta = {
+        'name': name, 'built_at': datetime.utcnow().isoformat(), 'plan_watermark': int(watermark),
+        'items': n, 'exercises': len(exercises), 'plans': len(plan_ids), 'links': len(links),
+        'bytes': sum(array.nbytes for array in arrays.values()),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # Atomic swap, then drop all but the previous snapshot (open mmaps stay valid on POSIX)
+    pointer = os.path.join(directory, 'CURRENT')
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+    snapshots = sorted(entry for entry in os.listdir(directory) if entry.startswith('snapshot-'))
+    for old in snapshots[:-2]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return meta
+
+
+class Snapshot:
+    """Read-only, memory-mapped arrays of one build."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        for key in ARRAYS:
+            setattr(self, key, np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r'))
+        self.size = len(self.item_ids)
+        # Small and touched on every request, so kept in memory
+        self.popularity = np.log1p(np.asarray(self.plan_counts))
+        if self.size and self.popularity.max() > 0:
+            self.popularity /= self.popularity.max()
+
+    def items_for(self, exercise_ids):
+        ids = np.asarray(list(exercise_ids), dtype=np.int64)
+        positions = np.searchsorted(self.exercise_ids, ids)
+        positions = np.minimum(positions, max(len(self.exercise_ids) - 1, 0))
+        found = self.exercise_ids[positions] == ids if len(self.exercise_ids) else np.zeros(len(ids), bool)
+        return np.unique(self.exercise_items[positions[found]])
+
+    def neighbors(self, kind, item, limit=MAX_NEIGHBORS):
+        indptr = getattr(self, f'{kind}_indptr')
+        start, end = indptr[item], min(indptr[item + 1], indptr[item] + limit)
+        return getattr(self, f'{kind}_indices')[start:end], getattr(self, f'{kind}_scores')[start:end]
+
+
+class Recommender:
+    """Serves a snapshot plus a co-occurrence delta from plans created since it was built."""
+
+    def __init__(self, app):
+        self.app = app
+        self.directory = app.config['RECOMMENDATION_DIR']
+        self.rebuild_after = app.config.get('RECOMMENDATION_REBUILD_AFTER', 1000)
+        self.snapshot = None
+        self._snapshot_name = None
+        self._lock = threading.RLock()
+        self._last_sync = 0.0
+        self._building = threading.Lock()
+        self._reset_delta(0)
+
+    def _reset_delta(self, watermark):
+        self._watermark = watermark
+        self._delta = {}  # item -> {item: shared new plans}
+        self._delta_counts = {}  # item -> new plans
+        self.pending_plans = 0
+
+    def load(self):
+        """Open the current snapshot if it changed; False when none has been built yet."""
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return False
+        if name != self._snapshot_name:
+            self.snapshot = Snapshot(os.path.join(self.directory, name))
+            self._snapshot_name = name
+            self._reset_delta(self.snapshot.meta['plan_watermark'])
+        return True
+
+    def sync(self, force=False):
+        """Pick up a newer snapshot and apply plans created since the last sync."""
+        with self._lock:
+            if not force and time.monotonic() - self._last_sync < SYNC_INTERVAL:
+                return
+            self._last_sync = time.monotonic()
+            if not self.load():
+                self.rebuild_in_background()
+                return
+
+            # Primary-key range first, so the common "nothing new" case never scans the link table
+            new_plans = [row.id for row in db.session.query(WorkoutPlan.id)
+                         .filter(WorkoutPlan.id > self._watermark).order_by(WorkoutPlan.id)]
+            if not new_plans:
+                return
+            links = db.session.query(workout_exercises.c.workout_id, workout_exercises.c.exercise_id).filter(
+                workout_exercises.c.workout_id.in_(new_plans)).all()
+            by_plan = {}
+            for link in links:
+                by_plan.setdefault(link.workout_id, []).append(link.exercise_id)
+            for exercise_ids in by_plan.values():
+                items = self.snapshot.items_for(exercise_ids).tolist()
+                for item in items:
+                    self._delta_counts[item] = self._delta_counts.get(item, 0) + 1
+                    row = self._delta.setdefault(item, {})
+                    for other in items:
+                        if other != item:
+                            row[other] = row.get(other, 0) + 1
+            self._watermark = new_plans[-1]
+            self.pending_plans += len(new_plans)
+
+        if self.rebuild_after and self.pending_plans >= self.rebuild_after:
+            self.rebuild_in_background()
+
+    def rebuild_in_background(self):
+        if not self._building.acquire(blocking=False):
+            return
+        threading.Thread(target=self._rebuild, name='recommendation-build', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                try:
+                    meta = build(self.directory)
+                    logger.info('Built recommendation snapshot %s in %.2fs', meta['name'], meta['seconds'])
+                except Exception:
+                    logger.exception('Recommendation build failed')
+                finally:
+                    db.session.remove()
+        finally:
+            self._building.release()
+
+    def recommend(self, seed_exercise_ids=(), level=None, goals=None, k=10):
+        """Top-k (exercise_id, score) for members working with the seed exercises."""
+        self.sync()
+        with self._lock:
+            snapshot = self.snapshot
+            if snapshot is None or not snapshot.size:
+                return []
+            seeds = snapshot.items_for(seed_exercise_ids)
+            scores = POPULARITY_WEIGHT * snapshot.popularity
+
+            for seed in seeds.tolist():
+                for kind, weight in (('cooc', COOCCURRENCE_WEIGHT), ('feature', FEATURE_WEIGHT)):
+                    indices, values = snapshot.neighbors(kind, seed)
+                    np.add.at(scores, indices, weight * values / len(seeds))
+                delta = self._delta.get(seed)
+                if delta:
+                    others = np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))
+                    shared = np.fromiter(delta.values(), dtype=np.float64, count=len(delta))
+                    counts = snapshot.plan_counts[others] + [self._delta_counts.get(o, 0) for o in others.tolist()]
+                    seed_count = snapshot.plan_counts[seed] + self._delta_counts.get(seed, 0)
+                    # Approximation: the delta's cosine is added on top of the snapshot's
+                    np.add.at(scores, others, COOCCURRENCE_WEIGHT * shared / np.sqrt(seed_count * counts) / len(seeds))
+
+        if level in LEVELS:
+            scores = scores * snapshot.level_affinity[:, LEVELS.index(level)]
+        goal_weights = goals if isinstance(goals, np.ndarray) else parse_goals(goals)
+        scores = scores * (0.5 + snapshot.goal_affinity @ goal_weights)
+        scores[seeds] = -np.inf
+
+        k = min(k, snapshot.size - len(seeds))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(snapshot.item_ids[item]), float(scores[item])) for item in top]
+
+    def similar(self, exercise_id, k=10, kind='cooc'):
+        """Nearest exercises by one precomputed matrix, straight from the memory map."""
+        self.sync()
+        with self._lock:
+            snapshot = self.snapshot
+            if snapshot is None:
+                return []
+            items = snapshot.items_for([exercise_id])
+            if not len(items):
+                return []
+            indices, values = snapshot.neighbors(kind, items[0], k)
+            return [(int(snapshot.item_ids[i]), float(v)) for i, v in zip(indices, values)]
+
+
+def init_recommendations(app):
+    # Created by the first build(); load() treats a missing directory as no snapshot yet
+    app.config.setdefault('RECOMMENDATION_DIR', os.path.join(app.instance_path, 'recommendations'))
+    app.extensions['recommender'] = Recommender(app)
+    app.cli.add_command(recommend_cli)
+
+
+def recommend_for_user(user, seed_exercise_ids=None, level=None, k=10):
+    """Recommendations for a member: seeded by their recent plans unless seeds are given."""
+    if seed_exercise_ids is None:
+        recent = db.session.query(WorkoutPlan.id, WorkoutPlan.level).filter(
+            WorkoutPlan.created_by == user.id).order_by(WorkoutPlan.id.desc()).limit(RECENT_PLANS).all()
+        seed_exercise_ids = [row.exercise_id for row in db.session.query(workout_exercises.c.exercise_id).filter(
+            workout_exercises.c.workout_id.in_([plan.id for plan in recent]))]
+        level = level or next((plan.level for plan in recent if plan.level), None)
+    return current_app.extensions['recommender'].recommend(seed_exercise_ids, level=level, goals=user.goals, k=k)
+
+
+recommend_cli = AppGroup('recommend', help='Exercise recommendation snapshots.')
+
+
+@recommend_cli.command('build')
+def build_command():
+    """Build the similarity matrices and swap in the new snapshot."""
+    meta = build(current_app.config['RECOMMENDATION_DIR'])
+    click.echo(f'Built {meta["name"]}: {meta["items"]} exercises from {meta["plans"]} plans '
+               f'({meta["bytes"] / 1024:.0f} KiB) in {meta["seconds"]:.2f}s')
+
+
+@recommend_cli.command('similar')
+@click.argument('name')
+@click.option('-k', default=10, show_default=True, help='Number of neighbours.')
+@click.option('--kind', type=click.Choice(['cooc', 'feature']), default='cooc', show_default=True)
+def similar_command(name, k, kind):
+    """Show the nearest exercises to NAME."""
+    exercise = Exercise.query.filter_by(name=name).order_by(Exercise.id).first()
+    if exercise is None:
+        raise click.ClickException(f'No exercise named {name!r}')
+    recommender = current_app.extensions['recommender']
+    started = time.perf_counter()
+    neighbors = recommender.similar(exercise.id, k, kind)
+    elapsed = (time.perf_counter() - started) * 1000
+    names = dict(db.session.query(Exercise.id, Exercise.name).filter(Exercise.id.in_([i for i, _ in neighbors])))
+    for exercise_id, score in neighbors:
+        click.echo(f'{score:6.3f}  {names.get(exercise_id)}')
+    click.echo(f'({elapsed:.3f} ms)')
@@ -0,0 +1,407 @@
+"""Weekly member reports, generated for everyone in one batch.
+
+    flask reports generate                      # last full week, HTML and PDF, every member
+    flask reports generate --week 2026-10-12 --workers 8
+    flask reports gc                            # delete old files no report points at any more
+
+A report covers one Monday-to-Sunday week:
+* nutrition adherence against ``NUTRITION_GOALS``
+* workouts scheduled and completed
+* weight trend
+
+Reading is done in four bulk queries for all members together: members,
+daily nutrition totals (archive.py, so archived weeks work too), calendar
+occurrences (schedule.py) and daily weights. Each member's data is hashed.
+A member whose data has not changed since the last run keeps the files they
+have. Everyone else is rendered in a process pool: HTML from
+templates/reports/weekly.html, PDF with fpdf2.
+
+Files go into a content-addressed store under ``REPORT_DIR``, at
+``objects/<first two hex digits>/<sha256>.<ext>``. A file is written once
+and never changed. ``WeeklyReport`` rows point each member and week at
+their files, and downloads are plain static responses with immutable
+caching headers.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import click
+import jinja2
+from flask import current_app
+from flask.cli import AppGroup
+from fpdf import FPDF
+
+from db import db, upsert
+import archive
+import schedule
+from models import User, WeeklyReport
+
+FORMATS = ('html', 'pdf')
+MIMETYPES = {'html': 'text/html', 'pdf': 'application/pdf'}
+NUTRIENTS = ('calories', 'protein', 'carbs', 'fats')
+WEIGHT_LOOKBACK_DAYS = 28  # How far back the week's starting weight may come from
+ON_TARGET = 0.1  # A day is on target within 10% of the calorie goal
+GC_GRACE_SECONDS = 24 * 3600  # gc keeps newer files: a running generate may not have committed their rows yet
+
+
+def week_of(day):
+    """Monday of the week containing ``day``."""
+    return day - timedelta(days=day.weekday())
+
+
+def last_full_week(today=None):
+    return week_of((today or date.today()) - timedelta(days=7))
+
+
+# Data
+
+def _nutrition_section(days, goals):
+    logged = [day for day in days if day['logged']]
+    averages = {key: round(sum(day[key] for day in logged) / len(logged), 1) if logged else 0 for key in NUTRIENTS}
+    return {
+        'days_logged': len(logged),
+        'averages': averages,
+        'adherence': {key: round(averages[key] / goals[key] * 100) if goals.get(key) else None for key in NUTRIENTS},
+        'on_target_days': sum(1 for day in logged if abs(day['calories'] - goals['calories']) <= goals['calories'] * ON_TARGET),
+    }
+
+
+def _workout_section(occurrences):
+    done = [o for o in occurrences if o.completed]
+    return {
+        'scheduled': len(occurrences),
+        'completed': len(done),
+        'minutes': sum(o.duration or 0 for o in done),
+        'calories': sum(o.calories or 0 for o in done),
+        'items': [{'date': o.date.isoformat(), 'title': o.title, 'completed': o.completed} for o in occurrences],
+    }
+
+
+def _weight_section(points, week_start):
+    before = [p for p in points if p.date < week_start and p.weight is not None]
+    during = [p for p in points if p.date >= week_start and p.weight is not None]
+    start = before[-1].weight if before else during[0].weight if during else None
+    end = during[-1].weight if during else None
+    body_fat = [p.body_fat_percentage for p in points if p.date >= week_start and p.body_fat_percentage is not None]
+    return {
+        'start': round(start, 1) if start is not None else None,
+        'end': round(end, 1) if end is not None else None,
+        'change': round(end - start, 1) if start is not None and end is not None else None,
+        'body_fat': round(body_fat[-1], 1) if body_fat else None,
+        'points': [{'date': p.date.isoformat(), 'weight': round(p.weight, 1)} for p in during],
+    }
+
+
+def collect(week_start, user_ids=None):
+    """{member id: report data} for the week, as JSON-ready dicts."""
+    week_end = week_start + timedelta(days=6)
+    goals = dict(current_app.config['NUTRITION_GOALS'])
+    members = db.session.query(User.id, User.name, User.email)
+    if user_ids:
+        members = members.filter(User.id.in_(user_ids))
+
+    nutrition = defaultdict(dict)
+    for row in archive.nutrition_daily_by_member(week_start, week_end):
+        nutrition[row.user_id][row.date] = row
+    workouts = schedule.calendars(week_start, week_end)
+    weights = defaultdict(list)
+    for row in archive.progress_daily_by_member(week_start - timedelta(days=WEIGHT_LOOKBACK_DAYS), week_end):
+        weights[row.user_id].append(row)
+
+    reports = {}
+    for member in members:
+        days = []
+        for offset in range(7):
+            day = week_start + timedelta(days=offset)
+            row = nutrition[member.id].get(day)
+            days.append(dict({key: round(getattr(row, key) or 0, 1) if row else 0 for key in NUTRIENTS},
+                             date=day.isoformat(), label=f'{day:%a %d}', logged=row is not None))
+        reports[member.id] = {
+            'member': {'id': member.id, 'name': member.name or member.email, 'email': member.email},
+            'week_start': week_start.isoformat(),
+            'week_end': week_end.isoformat(),
+            'goals': goals,
+            'days': days,
+            'nutrition': _nutrition_section(days, goals),
+            'workouts': _workout_section(workouts.get(member.id, [])),
+            'weight': _weight_section(weights.get(member.id, []), week_start),
+        }
+    return reports
+
+
+def source_digest(report):
+    return hashlib.sha256(json.dumps(report, sort_keys=True).encode()).hexdigest()
+
+
+# Rendering; runs in the pool's worker processes, which never touch the database
+
+def _latin1(text):
+    # The PDF core fonts only cover Latin-1
+    return str(text).encode('latin-1', 'replace').decode('latin-1')
+
+
+def _pdf(title, subtitle, created):
+    pdf = FPDF(format='A4')
+    pdf.set_creation_date(created)  # Fixed, so identical reports hash identically
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+    pdf.set_title(_latin1(title))
+    pdf.set_font('Helvetica', 'B', 18)
+    pdf.cell(0, 10, _latin1(title), new_x='LMARGIN', new_y='NEXT')
+    pdf.set_font('Helvetica', '', 10)
+    pdf.set_text_color(110)
+    pdf.cell(0, 6, _latin1(subtitle), new_x='LMARGIN', new_y='NEXT')
+    pdf.set_text_color(0)
+    pdf.ln(4)
+    return pdf
+
+
+def _pdf_heading(pdf, text):
+    pdf.ln(3)
+    pdf.set_font('Helvetica', 'B', 13)
+    pdf.cell(0, 8, _latin1(text), new_x='LMARGIN', new_y='NEXT')
+    pdf.set_font('Helvetica', '', 10)
+
+
+def _pdf_table(pdf, header, rows, widths):
+    pdf.set_font('Helvetica', 'B', 9)
+    pdf.set_fill_color(235)
+    for text, width in zip(header, widths):
+        pdf.cell(width, 7, _latin1(text), border=1, fill=True)
+    pdf.ln()
+    pdf.set_font('Helvetica', '', 9)
+    for row in rows:
+        for text, width in zip(row, widths):
+            pdf.cell(width, 6, _latin1(text), border=1)
+        pdf.ln()
+
+
+def render_pdf(report):
+    week_end = date.fromisoformat(report['week_end'])
+    pdf = _pdf(f'Weekly report: {report["member"]["name"]}',
+               f'{report["week_start"]} to {report["week_end"]}', datetime(week_end.year, week_end.month, week_end.day))
+    goals, nutrition = report['goals'], report['nutrition']
+
+    _pdf_heading(pdf, 'Nutrition')
+    pdf.cell(0, 6, f'{nutrition["days_logged"]} of 7 days logged, {nutrition["on_target_days"]} within '
+                   f'{ON_TARGET:.0%} of the {goals["calories"]} kcal goal', new_x='LMARGIN', new_y='NEXT')
+    pdf.ln(2)
+    rows = [[day['label'], f'{day["calories"]:.0f}', f'{day["protein"]:.0f}', f'{day["carbs"]:.0f}',
+             f'{day["fats"]:.0f}'] if day['logged'] else [day['label'], '-', '-', '-', '-'] for day in report['days']]
+    rows.append(['Average', *(f'{nutrition["averages"][key]:.0f}' for key in NUTRIENTS)])
+    rows.append(['Goal', *(str(goals[key]) for key in NUTRIENTS)])
+    rows.append(['Adherence', *(f'{nutrition["adherence"][key]}%' for key in NUTRIENTS)])
+    _pdf_table(pdf, ['Day', 'Calories', 'Protein (g)', 'Carbs (g)', 'Fats (g)'], rows, [40, 35, 35, 35, 35])
+
+    # Calories per day against the goal line
+    pdf.ln(4)
+    top = pdf.get_y()
+    scale = 40 / max([goals['calories'] * 1.5] + [day['calories'] for day in report['days']])
+    for i, day in enumerate(report['days']):
+        height = day['calories'] * scale
+        on_target = abs(day['calories'] - goals['calories']) <= goals['calories'] * ON_TARGET
+        pdf.set_fill_color(*((76, 175, 80) if on_target else (255, 152, 0)))
+        pdf.rect(20 + i * 24, top + 40 - height, 16, height, style='F')
+        pdf.set_xy(16 + i * 24, top + 41)
+        pdf.cell(24, 5, day['label'][:3], align='C')
+    pdf.set_draw_color(200, 0, 0)
+    pdf.line(15, top + 40 - goals['calories'] * scale, 190, top + 40 - goals['calories'] * scale)
+    pdf.set_draw_color(0)
+    pdf.set_y(top + 48)
+
+    workouts = report['workouts']
+    _pdf_heading(pdf, 'Workouts')
+    pdf.cell(0, 6, f'{workouts["completed"]} of {workouts["scheduled"]} scheduled workouts completed, '
+                   f'{workouts["minutes"]} minutes, {workouts["calories"]} kcal burned', new_x='LMARGIN', new_y='NEXT')
+    if workouts['items']:
+        pdf.ln(2)
+        _pdf_table(pdf, ['Date', 'Workout', 'Status'],
+                   [[item['date'], item['title'], 'Completed' if item['completed'] else 'Missed']
+                    for item in workouts['items']], [35, 110, 35])
+
+    weight = report['weight']
+    _pdf_heading(pdf, 'Weight')
+    if weight['end'] is None:
+        pdf.cell(0, 6, 'No weight logged this week', new_x='LMARGIN', new_y='NEXT')
+    else:
+        change = f'{weight["change"]:+.1f} kg' if weight['change'] is not None else 'no earlier weight to compare'
+        pdf.cell(0, 6, f'{weight["end"]:.1f} kg at the end of the week ({change})'
+                       + (f', body fat {weight["body_fat"]:.1f}%' if weight['body_fat'] is not None else ''),
+                 new_x='LMARGIN', new_y='NEXT')
+    return bytes(pdf.output())
+
+
+def render_html(report, env):
+    return env.get_template('reports/weekly.html').render(report=report, on_target=ON_TARGET).encode('utf-8')
+
+
+class ReportStore:
+    """Write-once files named by the sha256 of their content."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest, ext):
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.{ext}')
+
+    def exists(self, digest, ext):
+        return os.path.exists(self.path(digest, ext))
+
+    def put(self, content, ext):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.path(digest, ext)
+        try:
+            # Reused content counts as new for gc's grace period, like a fresh write
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(content)
+            os.replace(tmp, path)
+        return digest, len(content)
+
+    def gc(self, referenced, grace=GC_GRACE_SECONDS):
+        """Delete files whose digest is not in ``referenced``; returns how many went.
+
+        Files modified within the last ``grace`` seconds stay, referenced or not:
+        they may be half-written ``.tmp`` files, or belong to reports a running
+        generate() has stored but not committed yet.
+        """
+        cutoff = time.time() - grace
+        removed = 0
+        for directory, _, files in os.walk(os.path.join(self.root, 'objects')):
+            for name in files:
+                path = os.path.join(directory, name)
+                if not name.endswith('.tmp') and name.split('.', 1)[0] in referenced:
+                    continue
+                try:
+                    if os.stat(path).st_mtime >= cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Renamed into place or removed by someone else meanwhile
+                    continue
+                removed += 1
+        return removed
+
+
+_worker = {}
+
+
+def _init_worker(template_dir, store_root):
+    _worker['env'] = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+    _worker['store'] = ReportStore(store_root)
+
+
+def _render_job(job):
+    user_id, source, report, formats = job
+    results = {}
+    for fmt in formats:
+        content = render_html(report, _worker['env']) if fmt == 'html' else render_pdf(report)
+        results[fmt] = _worker['store'].put(content, fmt)
+    return user_id, source, results
+
+
+def generate(week_start, formats=FORMATS, workers=None, user_ids=None, force=False):
+    """Render the week's reports for every member whose data changed; returns counts and timings."""
+    started = time.perf_counter()
+    store = ReportStore(current_app.config['REPORT_DIR'])
+    reports = collect(week_start, user_ids)
+    collected = time.perf_counter()
+
+    existing = {(row.user_id, row.format): row for row in WeeklyReport.query.filter_by(week_start=week_start)}
+    jobs = []
+    for user_id, report in reports.items():
+        source = source_digest(report)
+        todo = [fmt for fmt in formats
+                if force or (user_id, fmt) not in existing
+                or existing[(user_id, fmt)].source_digest != source
+                or not store.exists(existing[(user_id, fmt)].digest, fmt)]
+        if todo:
+            jobs.append((user_id, source, report, todo))
+
+    workers = workers or current_app.config.get('REPORT_WORKERS') or os.cpu_count() or 1
+    initargs = (os.path.join(current_app.root_path, current_app.template_folder), store.root)
+    if workers > 1 and len(jobs) > 1:
+        # spawn: the app's background threads make forking unsafe, and workers need no app state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            results = list(pool.map(_render_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        _init_worker(*initargs)
+        results = [_render_job(job) for job in jobs]
+    rendered = time.perf_counter()
+
+    rows = [{'user_id': user_id, 'week_start': week_start, 'format': fmt, 'digest': digest,
+             'source_digest': source, 'size': size, 'generated_at': datetime.utcnow()}
+            for user_id, source, files in results for fmt, (digest, size) in files.items()]
+    if rows:
+        stmt = upsert(WeeklyReport)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[WeeklyReport.user_id, WeeklyReport.week_start, WeeklyReport.format],
+            set_={column: stmt.excluded[column] for column in ('digest', 'source_digest', 'size', 'generated_at')}
+        ), rows)
+        db.session.commit()
+    return {
+        'members': len(reports),
+        'rendered': len(jobs),
+        'files': len(rows),
+        'unchanged': len(reports) - len(jobs),
+        'workers': workers if len(jobs) > 1 else 1,
+        'collect_s': collected - started,
+        'render_s': rendered - collected,
+        'total_s': time.perf_counter() - started,
+    }
+
+
+def nutrition_log_pdf(member_name, entries, generated):
+    """The nutrition log export as a PDF table, newest first."""
+    pdf = _pdf(f'Nutrition log: {member_name}', f'{len(entries)} entries, exported {generated:%Y-%m-%d}', generated)
+    _pdf_table(pdf, ['Date', 'Meal', 'Calories', 'Protein (g)', 'Carbs (g)', 'Fats (g)'],
+               [[entry.date.strftime('%Y-%m-%d'), entry.meal or '', f'{entry.calories or 0:.0f}',
+                 f'{entry.protein or 0:.1f}', f'{entry.carbs or 0:.1f}', f'{entry.fats or 0:.1f}']
+                for entry in entries], [28, 52, 25, 25, 25, 25])
+    return bytes(pdf.output())
+
+
+def init_reports(app):
+    app.config.setdefault('REPORT_DIR', os.path.join(app.instance_path, 'reports'))
+    app.extensions['report_store'] = ReportStore(app.config['REPORT_DIR'])
+    app.cli.add_command(reports_cli)
+
+
+reports_cli = AppGroup('reports', help='Weekly member reports.')
+
+
+@reports_cli.command('generate')
+@click.option('--week', 'week', type=click.DateTime(['%Y-%m-%d']),
+              help='Any day of the week to report (default: last full week).')
+@click.option('--format', 'formats', type=click.Choice(FORMATS), multiple=True, help='Only this format (repeatable).')
+@click.option('--workers', type=int, help='Render processes (default: REPORT_WORKERS or the CPU count).')
+@click.option('--user', 'user_ids', type=int, multiple=True, help='Only this member (repeatable).')
+@click.option('--force', is_flag=True, help='Re-render reports whose data has not changed.')
+def generate_command(week, formats, workers, user_ids, force):
+    """Generate the week's reports for every member."""
+    week_start = week_of(week.date()) if week else last_full_week()
+    stats = generate(week_start, formats or FORMATS, workers, user_ids, force)
+    click.echo(f'Week of {week_start}: {stats["members"]} members, {stats["rendered"]} rendered '
+               f'({stats["files"]} files), {stats["unchanged"]} unchanged')
+    click.echo(f'collect {stats["collect_s"]:.2f}s, render {stats["render_s"]:.2f}s on {stats["workers"]} '
+               f'worker(s), total {stats["total_s"]:.2f}s')
+
+
+@reports_cli.command('gc')
+@click.option('--grace', type=int, default=GC_GRACE_SECONDS, show_default=True,
+              help='Keep unreferenced files modified within this many seconds.')
+def gc_command(grace):
+    """Delete stored files that no report points at."""
+    referenced = {row.digest for row in db.session.query(WeeklyReport.digest).distinct()}
+    removed = current_app.extensions['report_store'].gc(referenced, grace)
+    click.echo(f'Removed {removed} unreferenced files; {len(referenced)} in use')
@@ -0,0 +1,323 @@
+"""Recurring workout plans and the workout calendar.
+
+A plan's ``recurrence`` holds a small subset of the iCalendar RRULE syntax,
+with the plan's ``date`` as the first day of the series:
+
+    FREQ=WEEKLY;BYDAY=MO;COUNT=12          legs every Monday for 12 weeks
+    FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,TH     every other week, Tuesday and Thursday
+    FREQ=DAILY;INTERVAL=3;UNTIL=20270101   every third day until the new year
+
+Occurrences are never stored up front. ``occurrences()`` expands a rule
+lazily, and it jumps straight to the requested range instead of walking
+from the first day. An occurrence is only stored once it is completed or
+moved. It then becomes a plan of its own: a copy of the series with
+``series_id`` and ``series_date`` pointing back at it, so that streaks,
+weekly stats and leaderboards count it like any other completed plan.
+Later edits to the series do not change occurrences stored before.
+
+Every plan keeps ``ends_on``, the last day it can appear on:
+* a one-off plan: its own date
+* a series: its last occurrence, or ``FOREVER``
+* a stored occurrence: the later of its date and its series date
+
+``calendar()`` therefore fetches everything a date range needs in one query
+on the (created_by, ends_on) index.
+"""
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+from sqlalchemy import func, or_
+
+from db import db
+import fragment_cache
+import leaderboard
+from models import WorkoutPlan
+
+DAILY = 'DAILY'
+WEEKLY = 'WEEKLY'
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+FOREVER = date(9999, 12, 31)  # ends_on of a series without COUNT or UNTIL
+MAX_COUNT = 1000
+MAX_RANGE_DAYS = 366
+
+Rule = namedtuple('Rule', 'freq interval weekdays count until')
+Occurrence = namedtuple('Occurrence', 'plan_id series_id title date series_date recurring completed progress duration calories')
+
+
+class ScheduleError(ValueError):
+    """Raised for an invalid rule, range or reschedule; the message is safe to show."""
+
+
+def parse_rule(text):
+    parts = {}
+    for part in text.upper().split(';'):
+        key, _, value = part.strip().partition('=')
+        if key:
+            parts[key] = value
+    freq = parts.pop('FREQ', None)
+    if freq not in (DAILY, WEEKLY):
+        raise ScheduleError('Only daily and weekly schedules are supported')
+    try:
+        interval = int(parts.pop('INTERVAL', 1))
+        weekdays = tuple(sorted(WEEKDAYS.index(day) for day in parts.pop('BYDAY').split(','))) if 'BYDAY' in parts else ()
+        count = int(parts.pop('COUNT')) if 'COUNT' in parts else None
+        until = datetime.strptime(parts.pop('UNTIL')[:8], '%Y%m%d').date() if 'UNTIL' in parts else None
+    except ValueError:
+        raise ScheduleError(f'Invalid schedule: {text}')
+    if parts:
+        raise ScheduleError(f'Unsupported schedule parts: {", ".join(sorted(parts))}')
+    if not 1 <= interval <= 52:
+        raise ScheduleError('Repeat interval must be between 1 and 52')
+    if count is not None and not 1 <= count <= MAX_COUNT:
+        raise ScheduleError(f'Number of workouts must be between 1 and {MAX_COUNT}')
+    if count is not None and until is not None:
+        raise ScheduleError('Use either a number of workouts or an end date, not both')
+    if weekdays and freq != WEEKLY:
+        raise ScheduleError('Weekdays only apply to weekly schedules')
+    return Rule(freq, interval, weekdays, count, until)
+
+
+def format_rule(rule):
+    parts = [f'FREQ={rule.freq}']
+    if rule.interval != 1:
+        parts.append(f'INTERVAL={rule.interval}')
+    if rule.weekdays:
+        parts.append('BYDAY=' + ','.join(WEEKDAYS[day] for day in rule.weekdays))
+    if rule.count is not None:
+        parts.append(f'COUNT={rule.count}')
+    if rule.until is not None:
+        parts.append(f'UNTIL={rule.until:%Y%m%d}')
+    return ';'.join(parts)
+
+
+def describe_rule(text):
+    """Short human-readable form, e.g. 'Weekly on Mon, Thu, 12 times'."""
+    rule = parse_rule(text)
+    unit = 'day' if rule.freq == DAILY else 'week'
+    words = [('Daily' if rule.freq == DAILY else 'Weekly') if rule.interval == 1 else f'Every {rule.interval} {unit}s']
+    if rule.weekdays:
+        words[0] += ' on ' + ', '.join(date(2024, 1, 1 + day).strftime('%a') for day in rule.weekdays)
+    if rule.count is not None:
+        words.append(f'{rule.count} times')
+    if rule.until is not None:
+        words.append(f'until {rule.until:%b %d, %Y}')
+    return ', '.join(words)
+
+
+def schedule_from_form(form):
+    """(first date or None, recurrence text or None) from the schedule fields of the workout plan forms."""
+    try:
+        first = datetime.strptime(form['date'], '%Y-%m-%d').date() if form.get('date') else None
+        freq = form.get('repeat', '').upper()
+        if freq not in (DAILY, WEEKLY):
+            return first, None
+        interval = int(form.get('repeat_interval') or 1)
+        count = int(form['repeat_count']) if form.get('repeat_ends') == 'count' else None
+        until = (datetime.strptime(form['repeat_until'], '%Y-%m-%d').date()
+                 if form.get('repeat_ends') == 'until' else None)
+    except (KeyError, ValueError):
+        raise ScheduleError('Invalid schedule settings')
+    weekdays = tuple(sorted(WEEKDAYS.index(day) for day in form.getlist('repeat_days') if day in WEEKDAYS))
+    rule = format_rule(Rule(freq, interval, weekdays if freq == WEEKLY else (), count, until))
+    parse_rule(rule)  # Validates the ranges
+    return first, rule
+
+
+def occurrences(rule, first, start, end):
+    """Occurrence dates of a series beginning on ``first`` within [start, end], in order.
+
+    Jumps to the first period that can reach ``start``. COUNT is not applied
+    here: callers bound ``end`` by the series' ``ends_on``.
+    """
+    start = max(start, first)
+    if rule.until is not None:
+        end = min(end, rule.until)
+    if start > end:
+        return
+    if rule.freq == DAILY:
+        step = (start - first).days
+        day = first + timedelta(days=-(-step // rule.interval) * rule.interval)
+        while day <= end:
+            yield day
+            day += timedelta(days=rule.interval)
+        return
+
+    weekdays = rule.weekdays or (first.weekday(),)
+    first_monday = first - timedelta(days=first.weekday())
+    week = (start - first_monday).days // 7
+    week = -(-week // rule.interval) * rule.interval  # Round up to a week the series repeats in
+    while True:
+        monday = first_monday + timedelta(weeks=week)
+        if monday > end:
+            return
+        for weekday in weekdays:
+            day = monday + timedelta(days=weekday)
+            if day > end:
+                return
+            if day >= start:
+                yield day
+        week += rule.interval
+
+
+def series_end(rule, first):
+    """ends_on of a series: its last occurrence, or FOREVER."""
+    if rule.count is not None:
+        last = None
+        for last in islice(occurrences(rule, first, first, FOREVER), rule.count):
+            pass
+        return last or first
+    if rule.until is not None:
+        return max(rule.until, first)
+    return FOREVER
+
+
+def is_occurrence(plan, day):
+    rule = parse_rule(plan.recurrence)
+    return day <= plan.ends_on and next(occurrences(rule, plan.date, day, day), None) == day
+
+
+def set_schedule(plan, first, recurrence):
+    """Schedule a plan on ``first``, repeating per ``recurrence`` (RRULE text or None)."""
+    if plan.series_id is not None and recurrence:
+        raise ScheduleError('A single occurrence of a series cannot repeat')
+    if recurrence and first is None:
+        raise ScheduleError('A repeating workout needs a start date')
+    if plan.progress == 100 and (recurrence or first != plan.date):
+        raise ScheduleError('A completed workout cannot be rescheduled')
+    plan.date = first
+    plan.recurrence = recurrence
+    if recurrence:
+        plan.ends_on = series_end(parse_rule(recurrence), first)
+    elif plan.series_date is not None and first is not None:
+        plan.ends_on = max(first, plan.series_date)
+    else:
+        plan.ends_on = first
+
+
+def parse_range(start, end):
+    try:
+        start = datetime.strptime(start, '%Y-%m-%d').date()
+        end = datetime.strptime(end, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ScheduleError('start and end must be dates as YYYY-MM-DD')
+    if end < start:
+        raise ScheduleError('end is before start')
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ScheduleError(f'Ranges are limited to {MAX_RANGE_DAYS} days')
+    return start, end
+
+
+def _calendar_rows(start, end, user_id=None):
+    query = db.session.query(
+        WorkoutPlan.created_by, WorkoutPlan.id, WorkoutPlan.title, WorkoutPlan.date, WorkoutPlan.recurrence,
+        WorkoutPlan.ends_on, WorkoutPlan.series_id, WorkoutPlan.series_date, WorkoutPlan.progress,
+        WorkoutPlan.duration, WorkoutPlan.calories
+    ).filter(
+        WorkoutPlan.ends_on >= start,
+        # A moved occurrence spans its old and new day, so either can bring it into range
+        or_(WorkoutPlan.date <= end, WorkoutPlan.series_date <= end)
+    )
+    if user_id is not None:
+        query = query.filter(WorkoutPlan.created_by == user_id)
+    return query.all()
+
+
+def _expand(rows, start, end):
+    stored = {(row.series_id, row.series_date) for row in rows if row.series_id is not None}
+    found = []
+    for row in rows:
+        if not row.recurrence:
+            if start <= row.date <= end:
+                found.append(Occurrence(row.id, row.series_id, row.title, row.date, row.series_date,
+                                        row.series_id is not None, row.progress == 100, row.progress or 0,
+                                        row.duration, row.calories))
+            continue
+        for day in occurrences(parse_rule(row.recurrence), row.date, start, min(end, row.ends_on)):
+            if (row.id, day) not in stored:
+                found.append(Occurrence(row.id, row.id, row.title, day, day, True, False, 0,
+                                        row.duration, row.calories))
+    found.sort(key=lambda o: (o.date, o.plan_id))
+    return found
+
+
+def calendar(user_id, start, end):
+    """Every occurrence of the member's plans in [start, end], ordered by date."""
+    return _expand(_calendar_rows(start, end, user_id), start, end)
+
+
+def calendars(start, end):
+    """{member id: occurrences} for every member with plans in [start, end], in one query."""
+    by_member = defaultdict(list)
+    for row in _calendar_rows(start, end):
+        by_member[row.created_by].append(row)
+    return {user_id: _expand(rows, start, end) for user_id, rows in by_member.items()}
+
+
+def materialize(series, day):
+    """The stored plan for the series' occurrence on ``day``, created if needed (not committed)."""
+    plan = WorkoutPlan.query.filter_by(series_id=series.id, series_date=day).first()
+    if plan is not None:
+        return plan
+    if not is_occurrence(series, day):
+        raise ScheduleError(f'{series.title} is not scheduled on {day:%Y-%m-%d}')
+    plan = WorkoutPlan(
+        title=series.title, level=series.level, description=series.description, duration=series.duration,
+        calories=series.calories, created_by=series.created_by, created_at=datetime.now(),
+        date=day, series_id=series.id, series_date=day, ends_on=day, progress=0,
+        exercises=list(series.exercises)
+    )
+    db.session.add(plan)
+    return plan
+
+
+def complete_occurrence(series, day):
+    """Mark the series' occurrence on ``day`` completed; returns its plan (not committed)."""
+    plan = materialize(series, day)
+    if plan.progress != 100:
+        plan.progress = 100
+        leaderboard.record_completion(plan)
+    return plan
+
+
+def _move(user_id, plan_id, day, to):
+    plan = db.session.get(WorkoutPlan, plan_id)
+    if plan is None or plan.created_by != user_id:
+        raise ScheduleError(f'Workout plan {plan_id} not found')
+    if plan.recurrence:
+        if day is None:
+            raise ScheduleError(f'Moving an occurrence of {plan.title} needs its date')
+        plan = materialize(plan, day)
+    elif day is not None and plan.date != day:
+        raise ScheduleError(f'{plan.title} is not scheduled on {day:%Y-%m-%d}')
+    if plan.progress == 100:
+        raise ScheduleError(f'{plan.title} on {plan.date:%Y-%m-%d} is already completed')
+    plan.date = to
+    plan.ends_on = max(to, plan.series_date) if plan.series_date else to
+
+
+def reschedule(user_id, moves):
+    """Apply (plan_id, date or None, new date) moves in one transaction; all or nothing.
+
+    For a series, ``date`` picks the occurrence; for other plans it is optional
+    and only checked. Returns the number of occurrences moved.
+    """
+    try:
+        for plan_id, day, to in moves:
+            _move(user_id, plan_id, day, to)
+            db.session.flush()  # Two moves of one occurrence must see each other
+        fragment_cache.invalidate(user_id, fragment_cache.WORKOUTS)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(moves)
+
+
+def shift(user_id, start, end, days):
+    """Move every open occurrence in [start, end] by ``days`` days, in one transaction."""
+    if not -MAX_RANGE_DAYS <= days <= MAX_RANGE_DAYS:
+        raise ScheduleError(f'Shifts are limited to {MAX_RANGE_DAYS} days')
+    moves = [(o.plan_id, o.date, o.date + timedelta(days=days))
+             for o in calendar(user_id, start, end) if not o.completed]
+    return reschedule(user_id, moves)
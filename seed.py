@@ -0,0 +1,177 @@
+"""Synthetic data generator for local testing and benchmarks.
+
+    flask seed-data --users 200 --years 3 --reset
+
+Every seeded user gets the password ``password`` and an email of the form
+``member<N>@example.com``. Rows are written with executemany bulk inserts in
+large batches, so a few hundred thousand rows take seconds, not minutes.
+"""
+import random
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, text
+from werkzeug.security import generate_password_hash
+
+from db import db
+from models import Exercise, NutritionLog, Progress, User, WorkoutPlan, workout_exercises
+
+SEED_PASSWORD = 'password'
+BATCH_SIZE = 10000
+
+MEALS = ['Breakfast', 'Lunch', 'Dinner', 'Snack', 'Pre-workout', 'Post-workout']
+LEVELS = ['beginner', 'intermediate', 'advanced']
+GOALS = ['weight loss', 'muscle gain', 'endurance', 'general fitness']
+
+# (name, muscle group, description)
+EXERCISE_CATALOG = [
+    ('Squat', 'legs', 'Barbell back squat to parallel'),
+    ('Lunge', 'legs', 'Alternating forward lunges'),
+    ('Leg Press', 'legs', 'Machine leg press'),
+    ('Romanian Deadlift', 'hamstrings', 'Hip hinge with a slight knee bend'),
+    ('Deadlift', 'back', 'Conventional barbell deadlift'),
+    ('Hip Thrust', 'glutes', 'Barbell hip thrust off a bench'),
+    ('Bench Press', 'chest', 'Flat barbell bench press'),
+    ('Push-up', 'chest', 'Bodyweight push-up'),
+    ('Incline Dumbbell Press', 'chest', 'Dumbbell press on an incline bench'),
+    ('Pull-up', 'back', 'Bodyweight pull-up'),
+    ('Barbell Row', 'back', 'Bent-over barbell row'),
+    ('Lat Pulldown', 'back', 'Cable lat pulldown'),
+    ('Shoulder Press', 'shoulders', 'Standing overhead press'),
+    ('Lateral Raise', 'shoulders', 'Dumbbell lateral raise'),
+    ('Bicep Curl', 'arms', 'Dumbbell bicep curl'),
+    ('Tricep Extension', 'arms', 'Overhead tricep extension'),
+    ('Plank', 'core', 'Front plank hold'),
+    ('Crunch', 'core', 'Floor crunch'),
+    ('Running', 'cardio', 'Steady-state run'),
+    ('Cycling', 'cardio', 'Stationary bike intervals'),
+    ('Rowing', 'cardio', 'Rowing machine'),
+    ('Jump Rope', 'cardio', 'Skipping rope intervals'),
+]
+
+
+def bulk_insert(table, rows):
+    # executemany in large batches; returns the number of rows written
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(table), rows[start:start + BATCH_SIZE])
+    return len(rows)
+
+
+def seed(users=50, years=1, meals_per_day=4, plans_per_week=4, max_streak=14, rng=None, today=None):
+    """Populate the current database and return row counts per table."""
+    rng = rng or random.Random()
+    today = today or date.today()
+    days = int(365 * years)
+    counts = {}
+
+    # Catalog exercises shared by every plan
+    exercise_ids = [row.id for row in Exercise.query.filter(Exercise.workout_plan_id.is_(None)).all()]
+    if not exercise_ids:
+        counts['exercise'] = bulk_insert(Exercise, [
+            {'name': name, 'muscle_group': group, 'description': description,
+             'sets': rng.randint(3, 5), 'reps': str(rng.choice([5, 8, 10, 12, 15]))}
+            for name, group, description in EXERCISE_CATALOG
+        ])
+        exercise_ids = [row.id for row in Exercise.query.filter(Exercise.workout_plan_id.is_(None)).all()]
+
+    first_index = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    password = generate_password_hash(SEED_PASSWORD)  # Hashing is slow; every seeded user shares one hash
+    now = datetime.utcnow()
+    counts['user'] = bulk_insert(User, [{
+        'email': f'member{first_index + i}@example.com',
+        'password': password,
+        'name': f'Member {first_index + i}',
+        'age': rng.randint(18, 65),
+        'gender': rng.choice(['male', 'female']),
+        'height': round(rng.uniform(150, 200), 1),
+        'weight': round(rng.uniform(50, 120), 1),
+        'role': 'user',
+        'goals': rng.choice(GOALS),
+        'created_at': now - timedelta(days=days),
+    } for i in range(users)])
+    user_ids = [row.id for row in db.session.query(User.id).filter(User.id >= first_index).all()]
+
+    nutrition, progress, plans = [], [], []
+    for user_id in user_ids:
+        weight = rng.uniform(60, 110)
+        trend = rng.uniform(-0.03, 0.02)
+        streak = rng.randint(0, max_streak)
+        for offset in range(days):
+            day = today - timedelta(days=offset)
+            for meal in rng.sample(MEALS, k=min(meals_per_day, len(MEALS))):
+                calories = rng.uniform(150, 900)
+                nutrition.append({
+                    'user_id': user_id, 'date': day, 'meal': meal,
+                    'calories': round(calories, 1),
+                    'protein': round(calories * rng.uniform(0.05, 0.1), 1),
+                    'carbs': round(calories * rng.uniform(0.08, 0.15), 1),
+                    'fats': round(calories * rng.uniform(0.02, 0.05), 1),
+                })
+            if offset % 7 == 0:
+                progress.append({
+                    'user_id': user_id, 'date': day,
+                    'weight': round(weight - trend * offset + rng.uniform(-0.5, 0.5), 1),
+                    'body_fat_percentage': round(rng.uniform(10, 30), 1),
+                    'notes': '',
+                })
+            # Every day of the current streak has a completed plan and the day before it has none
+            if offset < streak or (offset > streak and rng.random() < plans_per_week / 7):
+                duration = rng.choice([30, 45, 60, 75, 90])
+                plans.append({
+                    'title': f'{rng.choice(["Push", "Pull", "Legs", "Full Body", "Cardio"])} Day',
+                    'level': rng.choice(LEVELS),
+                    'description': 'Seeded workout',
+                    'duration': duration,
+                    'created_by': user_id,
+                    'created_at': datetime.combine(day, datetime.min.time()),
+                    'date': day,
+                    'ends_on': day,
+                    'progress': 100 if offset < streak or rng.random() < 0.8 else rng.choice([0, 50]),
+                    'calories': None,
+                })
+
+    counts['nutrition_log'] = bulk_insert(NutritionLog, nutrition)
+    counts['progress'] = bulk_insert(Progress, progress)
+
+    first_plan = (db.session.query(db.func.max(WorkoutPlan.id)).scalar() or 0) + 1
+    counts['workout_plan'] = bulk_insert(WorkoutPlan, plans)
+    plan_ids = [row.id for row in db.session.query(WorkoutPlan.id).filter(WorkoutPlan.id >= first_plan).all()]
+    links = [{'workout_id': plan_id, 'exercise_id': exercise_id}
+             for plan_id in plan_ids
+             for exercise_id in rng.sample(exercise_ids, k=min(rng.randint(3, 6), len(exercise_ids)))]
+    counts['workout_exercises'] = bulk_insert(workout_exercises, links)
+
+    db.session.commit()
+    return counts
+
+
+@click.command('seed-data')
+@click.option('--users', default=50, show_default=True, help='Number of members to create.')
+@click.option('--years', default=1.0, show_default=True, help='Years of daily history per member.')
+@click.option('--meals-per-day', default=4, show_default=True)
+@click.option('--plans-per-week', default=4, show_default=True)
+@click.option('--max-streak', default=14, show_default=True, help='Longest current workout streak.')
+@click.option('--random-seed', type=int, default=None, help='Seed for reproducible data.')
+@click.option('--reset', is_flag=True, help='Drop and recreate all tables first.')
+@with_appcontext
+def seed_data_command(users, years, meals_per_day, plans_per_week, max_streak, random_seed, reset):
+    """Seed the database with synthetic members and history."""
+    if reset:
+        db.drop_all()
+        db.create_all()
+
+    # Trade durability for speed while bulk loading; the data is throwaway
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(text('PRAGMA synchronous = OFF'))
+
+    started = time.perf_counter()
+    counts = seed(users, years, meals_per_day, plans_per_week, max_streak, random.Random(random_seed))
+    elapsed = time.perf_counter() - started
+
+    total = sum(counts.values())
+    for table, count in counts.items():
+        click.echo(f'{table:>18}: {count}')
+    click.echo(f'Inserted {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)')
+    click.echo(f'Log in as member<N>@example.com with password "{SEED_PASSWORD}"')
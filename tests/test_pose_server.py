@@ -0,0 +1,50 @@
+"""Binary packets sent to the realtime pose server over a real WebSocket."""
+import asyncio
+import json
+import zlib
+
+import pytest
+import websockets
+
+import pose_server
+from pose_server import FLAG_ZLIB, KIND_FRAME, MAX_MESSAGE_BYTES, PACKET_HEADER, PoseServer
+
+SECRET_KEY = 'test-secret'
+
+
+def compressed_packet(size):
+    payload = zlib.compress(b'\0' * size, 9)
+    return PACKET_HEADER.pack(KIND_FRAME, FLAG_ZLIB, 1, 0.0) + payload
+
+
+async def send_packet(packet):
+    server = PoseServer(SECRET_KEY, workers=1)
+    server.slots = asyncio.Semaphore(server.max_in_flight)
+    try:
+        async with websockets.serve(server.handler, '127.0.0.1', 0, max_size=MAX_MESSAGE_BYTES,
+                                    compression=None) as listener:
+            port = listener.sockets[0].getsockname()[1]
+            async with websockets.connect(f'ws://127.0.0.1:{port}', compression=None) as websocket:
+                token = pose_server.make_ws_token(SECRET_KEY, 1, 'member')
+                await websocket.send(json.dumps({'token': token, 'exercise': 'squat'}))
+                await websocket.send(packet)
+                return json.loads(await asyncio.wait_for(websocket.recv(), timeout=5))
+    finally:
+        server.close()
+
+
+def test_oversized_compressed_packet_is_rejected():
+    packet = compressed_packet(200 * 1024 * 1024)
+    assert len(packet) < MAX_MESSAGE_BYTES
+
+    reply = asyncio.run(send_packet(packet))
+
+    assert reply == {'type': 'error', 'error': 'decompressed payload too large'}
+
+
+def test_compressed_packet_within_limit_decodes():
+    kind, seq, _, payload = pose_server.decode_packet(compressed_packet(MAX_MESSAGE_BYTES))
+
+    assert (kind, seq, len(payload)) == (KIND_FRAME, 1, MAX_MESSAGE_BYTES)
+    with pytest.raises(ValueError, match='too large'):
+        pose_server.decode_packet(compressed_packet(MAX_MESSAGE_BYTES + 1))
@@ -0,0 +1,145 @@
+"""Pose session uploads and downloads through a real WSGI server."""
+import http.cookiejar
+import json
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+import pytest
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server
+
+import pose_store
+from app import create_app
+from db import db
+from models import PoseChunk, PoseSession, User
+
+
+@pytest.fixture
+def server(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'POSE_SESSION_DIR': str(tmp_path / 'pose_sessions'),
+        'RECOMMENDATION_DIR': str(tmp_path / 'recommendations'),
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'REPORT_DIR': str(tmp_path / 'reports'),
+        'RATELIMIT_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(email='member@example.com', password=generate_password_hash('password'), name='Member'))
+        db.session.commit()
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield app, f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+    thread.join()
+
+
+def login(base_url):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    form = urllib.parse.urlencode({'email': 'member@example.com', 'password': 'password'}).encode()
+    opener.open(f'{base_url}/', form)
+    return opener
+
+
+def new_session(opener, base_url):
+    request = urllib.request.Request(f'{base_url}/api/pose_sessions', data=b'{"exercise": "squat"}',
+                                     headers={'Content-Type': 'application/json'})
+    with opener.open(request) as response:
+        return json.loads(response.read())['id']
+
+
+def upload(opener, base_url, session_id, timestamps, landmarks):
+    request = urllib.request.Request(f'{base_url}/api/pose_sessions/{session_id}/frames',
+                                     data=pose_store.encode_batch(timestamps, landmarks),
+                                     headers={'Content-Type': 'application/octet-stream'})
+    with opener.open(request) as response:
+        return response.status
+
+
+def read_frames(body):
+    # Downloads use the upload layout but are not bound by the upload frame limit
+    count = int(np.frombuffer(body, dtype='<u4', count=1)[0])
+    timestamps = np.frombuffer(body, dtype='<u4', count=count, offset=4)
+    landmarks = np.frombuffer(body, dtype=np.float16, offset=4 + count * 4)
+    return timestamps, landmarks.reshape((count,) + pose_store.FRAME_SHAPE)
+
+
+def batch(start_ms, count, seed):
+    timestamps = np.arange(start_ms, start_ms + count * 33, 33)[:count]
+    landmarks = np.random.default_rng(seed).random((count,) + pose_store.FRAME_SHAPE).astype(np.float16)
+    return timestamps, landmarks
+
+
+def test_stored_session_streams_back_over_wsgi(server):
+    app, base_url = server
+    opener = login(base_url)
+    session_id = new_session(opener, base_url)
+    # More frames than one streamed chunk, so the body spans several writes
+    batches = [batch(0, 1800, 1), batch(100_000, 1800, 2), batch(200_000, 900, 3)]
+    assert sum(len(timestamps) for timestamps, _ in batches) > pose_store.STREAM_CHUNK_FRAMES
+    for frames in batches:
+        assert upload(opener, base_url, session_id, *frames) == 200
+
+    with opener.open(f'{base_url}/api/pose_sessions/{session_id}/frames') as response:
+        assert response.headers['X-Pose-Dtype'] == 'float16'
+        body = response.read()
+    timestamps, landmarks = read_frames(body)
+    np.testing.assert_array_equal(timestamps, np.concatenate([frames[0] for frames in batches]))
+    np.testing.assert_array_equal(landmarks, np.concatenate([frames[1] for frames in batches]))
+
+    with opener.open(f'{base_url}/api/pose_sessions/{session_id}/frames?start_ms=200000') as response:
+        timestamps, landmarks = read_frames(response.read())
+    np.testing.assert_array_equal(landmarks, batches[2][1])
+
+
+def test_racing_uploads_do_not_overwrite_each_other(server):
+    app, base_url = server
+    opener = login(base_url)
+    session_id = new_session(opener, base_url)
+    # The page never races its uploads, but a client that does may only get batches refused:
+    # whatever order they land in, what is stored must stay a consistent prefix of accepted batches
+    batches = [batch(i * 10_000, 50, i) for i in range(8)]
+    statuses = []
+    threads = [threading.Thread(target=lambda b=b: statuses.append(_try_upload(opener, base_url, session_id, b)))
+               for b in batches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        session = db.session.get(PoseSession, session_id)
+        chunks = PoseChunk.query.filter_by(session_id=session_id).order_by(PoseChunk.frame_offset).all()
+        assert session.num_frames == sum(chunk.num_frames for chunk in chunks) == 50 * statuses.count(200)
+        assert [chunk.frame_offset for chunk in chunks] == [50 * i for i in range(len(chunks))]
+        timestamps, landmarks = pose_store.open_session(app.config['POSE_SESSION_DIR'], session)
+        stored = {int(chunk.start_ms) // 10_000: (chunk.frame_offset, chunk.num_frames) for chunk in chunks}
+        for index, (offset, count) in stored.items():
+            np.testing.assert_array_equal(timestamps[offset:offset + count], batches[index][0])
+            np.testing.assert_array_equal(landmarks[offset:offset + count], batches[index][1])
+
+
+def _try_upload(opener, base_url, session_id, frames):
+    # A batch that lands after a later one is refused as overlapping; it must not corrupt the session
+    try:
+        return upload(opener, base_url, session_id, *frames)
+    except urllib.error.HTTPError as error:
+        assert error.code == 400
+        return error.code
+
+
+def test_batch_before_stored_frames_is_refused(server):
+    app, base_url = server
+    opener = login(base_url)
+    session_id = new_session(opener, base_url)
+    assert upload(opener, base_url, session_id, *batch(10_000, 50, 1)) == 200
+
+    with pytest.raises(urllib.error.HTTPError) as refused:
+        upload(opener, base_url, session_id, *batch(0, 50, 2))
+    assert refused.value.code == 400
+    assert json.loads(refused.value.read())['error'] == 'batch overlaps frames already stored'
@@ -0,0 +1,46 @@
+"""Production WSGI entry point for prefork servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+gunicorn.conf.py turns on ``preload_app``, so the master imports this module
+once, before any worker exists. ``preload()`` then does the work every
+worker would otherwise repeat:
+
+* import the app and its heavy dependencies (cv2, mediapipe, numpy, scipy)
+* configure the ORM mappers and compile every template
+* fill the in-memory leaderboards and map the recommendation snapshot
+
+Afterwards the master closes its database connections so that no socket is
+shared across the fork. It then runs one full collection, and the
+``pre_fork`` hook calls ``gc.freeze()``. A worker's own collections then
+skip the preloaded objects, and these pages stay shared copy-on-write
+instead of being copied into every worker the first time a full collection
+runs. Compare with ``python bench_workers.py``.
+
+Nothing here starts a thread: the master's threads would not survive the
+fork. Each worker starts the leaderboard reconciler in gunicorn.conf.py's
+``post_fork`` hook.
+"""
+import gc
+
+from sqlalchemy.orm import configure_mappers
+
+from app import create_app
+from config import ProductionConfig
+from db import db
+
+
+def preload(app):
+    with app.app_context():
+        configure_mappers()
+        for name in app.jinja_env.list_templates(extensions=('html',)):
+            app.jinja_env.get_template(name)
+        app.extensions['leaderboards'].refresh(force=True)
+        app.extensions['recommender'].load()
+        db.session.remove()
+        db.engine.dispose()
+    gc.collect()
+
+
+application = create_app(ProductionConfig)
+preload(application)